@@ -1,14 +1,43 @@
 import os
+import threading
+import time
+from datetime import timedelta
 
+import click
 # Set the environment to production
 os.environ['FLASK_ENV'] = 'production'
 
-from flask import Flask, render_template, request, flash, redirect, session, g, url_for, abort
+from flask import Flask, Response, render_template, request, flash, redirect, session, g, url_for, abort, jsonify, get_flashed_messages
+from flask.globals import app_ctx, request_ctx
 from flask_debugtoolbar import DebugToolbarExtension
-from sqlalchemy.exc import IntegrityError
+from sqlalchemy import func, or_, select
+from sqlalchemy.orm import joinedload
 
 from forms import UserAddForm, LoginForm, MessageForm
-from models import db, connect_db, User, Message
+from models import db, connect_db, ArchivedCounts, User, Message, Follows, Likes
+import like_counts
+import migrations
+import partitions
+from page_cache import PageCache
+from pagination import cursors, keyset, page_url, paginate
+from read_models import select_message_rows, to_message_row
+from archive import MessageArchive
+from assets import Assets
+from availability import taken
+from compression import GzipMiddleware
+import counters
+from fragments import FragmentCache
+import http_cache
+from current_user import CurrentUserCache, SNAPSHOT_COLUMNS
+from metrics import metrics
+from passwords import hasher
+from pool_stats import pool_stats
+from snowflake import OFFLINE_SLOT, ids, worker_id_for
+from query_stats import QueryStats
+from replicas import ReplicaRouter, use_primary
+import search
+import timelines
+from typeahead import usernames
 
 
 CURR_USER_KEY = "curr_user"
@@ -25,21 +54,175 @@ app.config['SQLALCHEMY_DATABASE_URI'] = (
     os.environ.get('DATABASE_URL', 'postgresql:///warbler'))
 
 
+# Read replicas of that database, comma separated (see replicas.py). A user
+# who just wrote reads from the primary for REPLICA_STICKY_SECONDS, which
+# must cover the lag a replica is allowed (and defaults to that plus the
+# 5 s between replica checks).
+app.config['SQLALCHEMY_REPLICA_URIS'] = [
+    url for url in os.environ.get('DATABASE_REPLICA_URLS', '').split(',') if url]
+app.config['REPLICA_MAX_LAG_SECONDS'] = float(
+    os.environ.get('REPLICA_MAX_LAG_SECONDS', 10))
+app.config['REPLICA_STICKY_SECONDS'] = float(
+    os.environ.get('REPLICA_STICKY_SECONDS',
+                   app.config['REPLICA_MAX_LAG_SECONDS'] + 5))
+
+# Connection pools, per process and per database. Each of a gunicorn
+# worker's WEB_THREADS threads (see gunicorn.conf.py) holds at most one
+# connection to a database at a time, so the pool keeps that many open,
+# with a little overflow for background flushes. Postgres must allow
+# workers * (DB_POOL_SIZE + DB_MAX_OVERFLOW) connections from each machine.
+app.config['DB_POOL_SIZE'] = int(
+    os.environ.get('DB_POOL_SIZE', os.environ.get('WEB_THREADS', 1)))
+app.config['DB_MAX_OVERFLOW'] = int(os.environ.get('DB_MAX_OVERFLOW', 2))
+app.config['DB_POOL_TIMEOUT'] = float(os.environ.get('DB_POOL_TIMEOUT', 5))
+app.config['DB_POOL_RECYCLE'] = int(os.environ.get('DB_POOL_RECYCLE', 1800))
+app.config['DB_POOL_PRE_PING'] = os.environ.get('DB_POOL_PRE_PING', '1') == '1'
+
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
 app.config['SQLALCHEMY_ECHO'] = False
 app.config['DEBUG_TB_INTERCEPT_REDIRECTS'] = False
-def connect_db(app):
-    with app.app_context():
-        db.app = app
-        db.init_app(app)
-        db.create_all()
+
+# Apply pending schema migrations when the app starts, instead of only
+# through `flask db-upgrade`.
+app.config['MIGRATE_ON_START'] = os.environ.get('MIGRATE_ON_START') == '1'
+
 app.config['DEBUG_TB_ENABLED'] = False
 app.config['SECRET_KEY'] = os.environ.get('SECRET_KEY', "it's a secret")
 
+# How many items list pages (timelines, profiles, followers...) show at once.
+app.config['PAGE_SIZE'] = int(os.environ.get('PAGE_SIZE', 100))
+
+# Username typeahead: how many names the in-process index may hold (the
+# most-followed users, when there are more), how many suggestions to
+# return, how often to pick up other workers' signups and renames, and how
+# often to rebuild it in the background (which drops the old names of
+# users renamed or deleted elsewhere).
+app.config['TYPEAHEAD_MAX_ENTRIES'] = int(
+    os.environ.get('TYPEAHEAD_MAX_ENTRIES', 2_000_000))
+app.config['TYPEAHEAD_LIMIT'] = 10
+app.config['TYPEAHEAD_SYNC_SECONDS'] = 5
+app.config['TYPEAHEAD_RELOAD_SECONDS'] = 300
+
+# Username/email availability: the bloom filter is sized for at least this
+# many users, picks up other workers' signups and renames this often, and
+# is rebuilt from scratch in the background this often.
+app.config['AVAILABILITY_CAPACITY'] = int(
+    os.environ.get('AVAILABILITY_CAPACITY', 1_000_000))
+app.config['AVAILABILITY_SYNC_SECONDS'] = 5
+app.config['AVAILABILITY_RELOAD_SECONDS'] = 3600
+
+# The in-process name indexes re-read users whose names changed this long
+# before the latest change they have seen, in case a slower transaction
+# committed a change stamped earlier.
+app.config['NAME_SYNC_OVERLAP_SECONDS'] = 60
+
+# How many messages each materialized home timeline keeps.
+app.config['TIMELINE_MAX_LENGTH'] = int(
+    os.environ.get('TIMELINE_MAX_LENGTH', 800))
+
+# A post trims about one in this many of the timelines it is pushed to,
+# so timelines run about this many entries over TIMELINE_MAX_LENGTH.
+app.config['TIMELINE_TRIM_EVERY'] = int(
+    os.environ.get('TIMELINE_TRIM_EVERY', 100))
+
+# Authors with at least this many followers are merged into timelines on
+# read instead of being pushed to every follower when they post. They go
+# back to being pushed once they are down to fewer than
+# TIMELINE_PUSH_THRESHOLD followers and `flask settle-timelines` has run.
+app.config['TIMELINE_FANOUT_THRESHOLD'] = int(
+    os.environ.get('TIMELINE_FANOUT_THRESHOLD', 10000))
+app.config['TIMELINE_PUSH_THRESHOLD'] = int(
+    os.environ.get('TIMELINE_PUSH_THRESHOLD', 9000))
+
+# This process's worker id in new message ids (see snowflake.py). Under
+# gunicorn, gunicorn.conf.py sets it for each worker; other processes get
+# the slot on this machine that gunicorn leaves free.
+app.config['SNOWFLAKE_WORKER_ID'] = int(os.environ.get(
+    'SNOWFLAKE_WORKER_ID',
+    worker_id_for(int(os.environ.get('SNOWFLAKE_NODE_ID', 0)), OFFLINE_SLOT)))
+
+# bcrypt work factor for new password hashes, how many processes each web
+# process hashes passwords on (only worth it with WEB_THREADS > 1; 0 hashes
+# inline), and how many hashes a web process may have pending before it
+# turns logins away with a 503.
+app.config['BCRYPT_LOG_ROUNDS'] = int(os.environ.get('BCRYPT_LOG_ROUNDS', 12))
+app.config['BCRYPT_WORKERS'] = int(os.environ.get('BCRYPT_WORKERS', 1))
+app.config['BCRYPT_MAX_PENDING'] = int(
+    os.environ.get('BCRYPT_MAX_PENDING', 4 * app.config['BCRYPT_WORKERS'] or 1))
+
+# Rendered message bodies are cached in up to this many bytes per process.
+app.config['FRAGMENT_CACHE_MAX_BYTES'] = int(
+    os.environ.get('FRAGMENT_CACHE_MAX_BYTES', 64 * 2**20))
+
+# The home timeline and likes pages show other users' like counts, names
+# and avatars, which their ETags don't cover; a revalidating browser gets
+# them re-rendered at least this often (see http_cache.py).
+app.config['ETAG_REFRESH_SECONDS'] = int(
+    os.environ.get('ETAG_REFRESH_SECONDS', 60))
+
+# Streamed pages are sent in pieces of about this many characters.
+app.config['STREAM_CHUNK_SIZE'] = 4096
+
+# Pages for logged-out visitors are cached for this many seconds, in
+# process or, if PAGE_CACHE_URL names a Redis server, shared by all workers.
+app.config['PAGE_CACHE_TTL'] = int(os.environ.get('PAGE_CACHE_TTL', 60))
+app.config['PAGE_CACHE_URL'] = os.environ.get('PAGE_CACHE_URL')
+
+# Logged-in users are cached per process for up to this many seconds.
+app.config['CURRENT_USER_CACHE_TTL'] = int(
+    os.environ.get('CURRENT_USER_CACHE_TTL', 30))
+
+# Text responses of at least this many bytes are gzipped at this level
+# for clients that accept it.
+app.config['GZIP_MIN_SIZE'] = int(os.environ.get('GZIP_MIN_SIZE', 1024))
+app.config['GZIP_LEVEL'] = int(os.environ.get('GZIP_LEVEL', 6))
+
+# `flask build-static` writes hashed, precompressed static files here.
+app.config['ASSETS_FOLDER'] = os.environ.get(
+    'ASSETS_FOLDER', os.path.join(app.root_path, 'dist'))
+
+# Messages are kept in monthly partitions created this many months ahead;
+# `flask archive-messages` moves months older than ARCHIVE_AFTER_DAYS out
+# of the database into segment files in ARCHIVE_FOLDER.
+app.config['PARTITION_MONTHS_AHEAD'] = int(
+    os.environ.get('PARTITION_MONTHS_AHEAD', partitions.MONTHS_AHEAD))
+app.config['ARCHIVE_AFTER_DAYS'] = int(os.environ.get('ARCHIVE_AFTER_DAYS', 365))
+app.config['ARCHIVE_FOLDER'] = os.environ.get(
+    'ARCHIVE_FOLDER', os.path.join(app.root_path, 'archive'))
+# How often a process may look in ARCHIVE_FOLDER for segments other
+# processes wrote, when asked for an old message it doesn't have.
+app.config['ARCHIVE_RESCAN_SECONDS'] = int(
+    os.environ.get('ARCHIVE_RESCAN_SECONDS', 60))
+
+# Requests that run one statement this many times are logged as possible
+# N+1 queries, as are requests whose queries take over this many ms.
+app.config['QUERY_STATS_N_PLUS_ONE'] = int(
+    os.environ.get('QUERY_STATS_N_PLUS_ONE', 5))
+app.config['QUERY_STATS_SLOW_MS'] = int(
+    os.environ.get('QUERY_STATS_SLOW_MS', 100))
+
 toolbar = DebugToolbarExtension(app)
+query_stats = QueryStats(app)
+replicas = ReplicaRouter(app)
+pool_stats.init_app(app)
+like_buffer = like_counts.LikeCountBuffer(app)
+current_users = CurrentUserCache(app)
+ids.init_app(app)
+hasher.init_app(app)
+http_cache.init_app(app)
+fragment_cache = FragmentCache(app)
+page_cache = PageCache(app, session_key=CURR_USER_KEY)
+assets = Assets(app)
+message_archive = MessageArchive(app)
+
+app.wsgi_app = GzipMiddleware(app.wsgi_app,
+                              min_size=app.config['GZIP_MIN_SIZE'],
+                              level=app.config['GZIP_LEVEL'])
 
 connect_db(app)
 
+app.jinja_env.globals['page_url'] = page_url
+
 # Print the current Flask environment
 current_env = os.environ.get('FLASK_ENV', 'default')
 print(f"Running in {current_env} mode")
@@ -48,10 +231,14 @@ print(f"Running in {current_env} mode")
 
 @app.before_request
 def add_user_to_g():
-    """If we're logged in, add curr user to Flask global."""
+    """If we're logged in, add curr user to Flask global.
+
+    g.user is a cached CurrentUser; views that change the user call
+    `g.user.load()` for the full User.
+    """
 
     if CURR_USER_KEY in session:
-        g.user = User.query.get(session[CURR_USER_KEY])
+        g.user = current_users.get(session[CURR_USER_KEY])
 
     else:
         g.user = None
@@ -70,6 +257,45 @@ def do_logout():
         del session[CURR_USER_KEY]
 
 
+def stream_page(template_name, **context):
+    """Render a template as a streamed response.
+
+    The page goes out in STREAM_CHUNK_SIZE pieces as it renders, so the
+    head and nav reach the browser first and the whole document is never
+    held in memory. Everything the template shows must already be loaded:
+    the session is closed first, so a slow client doesn't hold on to a
+    database connection.
+    """
+
+    chunk_size = app.config['STREAM_CHUNK_SIZE']
+    template = app.jinja_env.get_template(template_name)
+    contexts = (app_ctx._get_current_object(), request_ctx._get_current_object())
+    app.update_template_context(context)
+
+    # Take the flashed messages out of the session now, while it can
+    # still be saved; the template reads them back from the request.
+    get_flashed_messages()
+    db.session.close()
+
+    def generate():
+        pieces = template.generate(context)
+        while True:
+            # The contexts are pushed only while a chunk renders, so the
+            # stream never holds them between writes.
+            chunk, size = [], 0
+            with contexts[0], contexts[1]:
+                for piece in pieces:
+                    chunk.append(piece)
+                    size += len(piece)
+                    if size >= chunk_size:
+                        break
+            if not chunk:
+                return
+            yield ''.join(chunk)
+
+    return Response(generate(), mimetype='text/html')
+
+
 @app.route('/signup', methods=["GET", "POST"])
 def signup():
     """Handle user signup.
@@ -85,41 +311,39 @@ def signup():
     form = UserAddForm()
 
     if form.validate_on_submit():
-        # Check if the email or username is already taken
-        existing_user = User.query.filter(
-            (User.username == form.username.data) and 
-            (User.email == form.email.data)
-        ).first()
-        existing_username = User.query.filter(
-            (User.username == form.username.data)).first()
-        existing_email = User.query.filter(User.email == form.email.data).first()
-        if existing_user:
+        # Check if the email or username is already taken, in one query
+        username_taken, email_taken = taken_by(form.username.data,
+                                               form.email.data)
+        if username_taken and email_taken:
             flash('Username and email already taken', 'danger')
             return render_template('users/signup.html', form=form)
-        elif existing_username:
+        elif username_taken:
             flash('Username already taken', 'danger')
             return render_template('users/signup.html', form=form)
-        elif existing_email:
+        elif email_taken:
             flash('Email already taken', 'danger')
             return render_template('users/signup.html', form=form)
-        try:
-            user = User.signup(
-                username=form.username.data,
-                password=form.password.data,
-                email=form.email.data,
-                image_url=form.image_url.data or User.image_url.default.arg,
-                bio=form.bio.data,
-                location=form.location.data,
-                header_image_url=form.header_image_url.data or User.header_image_url.default.arg,
-            )
-            db.session.commit()
 
-        except IntegrityError:
-            db.session.rollback()
-            flash("Username already taken", 'danger')
+        user = User.signup(
+            username=form.username.data,
+            password=form.password.data,
+            email=form.email.data,
+            image_url=form.image_url.data or User.image_url.default.arg,
+            bio=form.bio.data,
+            location=form.location.data,
+            header_image_url=form.header_image_url.data or User.header_image_url.default.arg,
+        )
+        if user is None:
+            # Someone else signed up with it since the check
+            flash("Username or email already taken", 'danger')
             return render_template('users/signup.html', form=form)
 
+        # Use the user before the commit expires it (and reloads it)
         do_login(user)
+        usernames.add(user.id, user.username)
+        taken.add(user.username, user.email)
+        db.session.commit()
+
         return redirect("/")
 
     else:
@@ -127,6 +351,98 @@ def signup():
 
 
 
+def taken_by(username, email):
+    """Whether this username and this email are already in use."""
+
+    rows = db.session.execute(
+        select(User.username == username, User.email == email)
+        .where(or_(User.username == username, User.email == email))
+        .limit(2)).all()
+
+    return (any(row[0] for row in rows), any(row[1] for row in rows))
+
+
+def sync_names(index, columns, sync_seconds, reload_seconds):
+    """Bring an in-process index of user names up to date, if it's due.
+
+    Reads `columns` plus names_changed_at of the users changed since the
+    index last synced, from the primary, every `sync_seconds`. Every
+    `reload_seconds` a background thread rebuilds the index from all
+    users instead (see `reload_names()`), so no request waits for that.
+    """
+
+    now = time.monotonic()
+    if now - index.synced_at < sync_seconds or not index.syncing.acquire(blocking=False):
+        return
+
+    if now - index.loaded_at >= reload_seconds:
+        # The thread releases index.syncing once the new index is in place
+        index.loaded_at = now
+        threading.Thread(target=reload_names, args=(index, columns),
+                         name=f'reload-{type(index).__name__}',
+                         daemon=True).start()
+        return
+
+    try:
+        query = select(*columns, User.names_changed_at)
+        with use_primary():
+            if index.changed_through is not None:
+                overlap = timedelta(seconds=app.config['NAME_SYNC_OVERLAP_SECONDS'])
+                query = query.where(
+                    User.names_changed_at > index.changed_through - overlap)
+            index.catch_up(db.session.execute(query))
+    finally:
+        index.syncing.release()
+
+
+def reload_names(index, columns):
+    """Rebuild an in-process index of user names from every user.
+
+    `index.load()` builds the new index aside and swaps it in, so lookups
+    go on against the old one meanwhile. Releases `index.syncing`, which
+    the caller must hold. Signups and renames that land during the
+    rebuild are picked up by the next sync, as it reads back from the
+    rebuilt index's watermark.
+    """
+
+    try:
+        with app.app_context(), db.engine.connect() as conn:
+            index.load(conn.execute(select(*columns, User.names_changed_at)))
+    except Exception:
+        # Try again after another reload interval; catch-ups carry on
+        app.logger.exception("Rebuilding %s failed", type(index).__name__)
+    finally:
+        index.syncing.release()
+
+
+@app.route('/users/available')
+def availability():
+    """JSON: are the 'username' and/or 'email' params free to sign up with?
+
+    Values the in-process bloom filter has never seen are free without a
+    query; possible matches are checked against the database. The filter
+    is rebuilt off the request path (see `sync_names()`).
+    """
+
+    sync_names(taken, (User.username, User.email),
+               app.config['AVAILABILITY_SYNC_SECONDS'],
+               app.config['AVAILABILITY_RELOAD_SECONDS'])
+
+    wanted = {field: request.args[field] for field in ('username', 'email')
+              if request.args.get(field)}
+    answer = {field: not taken.might_be_taken(field, value)
+              for field, value in wanted.items()}
+
+    maybe = [field for field, free in answer.items() if not free]
+    if maybe:
+        in_use = dict(zip(('username', 'email'),
+                          taken_by(wanted.get('username'), wanted.get('email'))))
+        for field in maybe:
+            answer[field] = not in_use[field]
+
+    return jsonify(answer)
+
+
 @app.route('/login', methods=["GET", "POST"])
 def login():
     """Handle user login."""
@@ -138,6 +454,8 @@ def login():
                                  form.password.data)
 
         if user:
+            # Saves the password hash if it was upgraded
+            db.session.commit()
             do_login(user)
             flash(f"Hello, {user.username}!", "success")
             return redirect("/")
@@ -167,17 +485,51 @@ def list_users():
     Can take a 'q' param in querystring to search by that username.
     """
 
-    search = request.args.get('q')
+    q = request.args.get('q')
 
-    if not search:
-        users = User.query.all()
+    if not q:
+        page = paginate(select(User), (User.id,), **cursors())
     else:
-        users = User.query.filter(User.username.like(f"%{search}%")).all()
+        page = search.search_users(q, **cursors())
+    users = page.items
+
+    if g.user:
+        g.user.viewer_state.load(user_ids=[user.id for user in users])
+
+    return render_template('users/index.html', users=users, page=page)
+
+
+@app.route('/users/autocomplete')
+def autocomplete_users():
+    """JSON list of users whose username starts with the 'q' param.
+
+    Served from the in-process typeahead index; users other workers sign
+    up or rename are picked up every TYPEAHEAD_SYNC_SECONDS.
+    """
+
+    q = request.args.get('q', '').strip()
+    if not q:
+        return jsonify(users=[])
+
+    sync_names(usernames, (User.id, User.username, User.followers_count),
+               app.config['TYPEAHEAD_SYNC_SECONDS'],
+               app.config['TYPEAHEAD_RELOAD_SECONDS'])
+
+    matches = usernames.complete(q, limit=app.config['TYPEAHEAD_LIMIT'])
+
+    return jsonify(users=[{'id': user_id, 'username': username}
+                          for user_id, username in matches])
+
 
-    return render_template('users/index.html', users=users)
+def profile_version(user):
+    """What a profile header shows about `user`, for ETags."""
+
+    return (tuple(getattr(user, column) for column in SNAPSHOT_COLUMNS),
+            g.user.is_following(user))
 
 
 @app.route('/users/<int:user_id>')
+@http_cache.cache_for(0)
 def users_show(user_id):
     """Show user profile."""
     
@@ -189,25 +541,31 @@ def users_show(user_id):
     #If the user is not logged in
     if g.user is None:
         flash("Access unauthorized.", "danger")
-        print("g.user is not logged in")
         return redirect("/login")
     
     #If the user that is logged in tries to change their user id to access another user id
     if g.user.id != user_id:
         flash("Access unauthorized.", "danger")
-        print(">>>>>>>>>>>>>>>>>>>>>>second option")
         return redirect(url_for("homepage"))
 
-    messages = (Message
-                .query
-                .filter(Message.user_id == user_id)
-                .order_by(Message.timestamp.desc())
-                .limit(100)
-                .all())
-    return render_template('users/show.html', user=user, messages=messages)
+    # The newest message and messages_count tell if any were added or removed
+    newest = db.session.execute(
+        select(func.max(Message.id)).where(Message.user_id == user_id)).scalar()
+    cached = http_cache.not_modified(profile_version(user), newest)
+    if cached:
+        return cached
+
+    page = paginate(select_message_rows().where(Message.user_id == user_id),
+                    (Message.id,),
+                    row_factory=to_message_row,
+                    **cursors())
+
+    return stream_page('users/show.html', user=user,
+                       messages=page.items, page=page)
 
 
 @app.route('/users/<int:user_id>/following')
+@http_cache.cache_for(0)
 def show_following(user_id):
     """Show list of people this user is following."""
 
@@ -216,10 +574,33 @@ def show_following(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/following.html', user=user)
+
+    # Who is on the page, off the follows index alone; their names and
+    # pictures are covered by the refresh
+    listed_ids = db.session.execute(keyset(
+        select(Follows.user_being_followed_id).where(Follows.user_following_id == user_id),
+        (Follows.user_being_followed_id,),
+        **cursors())).scalars().all()
+    cached = http_cache.not_modified(
+        profile_version(user), listed_ids,
+        refresh=app.config['ETAG_REFRESH_SECONDS'])
+    if cached:
+        return cached
+
+    page = paginate(
+        select(User)
+        .join(Follows, Follows.user_being_followed_id == User.id)
+        .where(Follows.user_following_id == user_id),
+        (Follows.user_being_followed_id,),
+        **cursors())
+    g.user.viewer_state.load(user_ids=[user.id for user in page.items])
+
+    return render_template('users/following.html', user=user,
+                           following=page.items, page=page)
 
 
 @app.route('/users/<int:user_id>/followers')
+@http_cache.cache_for(0)
 def users_followers(user_id):
     """Show list of followers of this user."""
 
@@ -228,7 +609,29 @@ def users_followers(user_id):
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/followers.html', user=user)
+
+    # Who is on the page, off the follows index alone; their names and
+    # pictures are covered by the refresh
+    listed_ids = db.session.execute(keyset(
+        select(Follows.user_following_id).where(Follows.user_being_followed_id == user_id),
+        (Follows.user_following_id,),
+        **cursors())).scalars().all()
+    cached = http_cache.not_modified(
+        profile_version(user), listed_ids,
+        refresh=app.config['ETAG_REFRESH_SECONDS'])
+    if cached:
+        return cached
+
+    page = paginate(
+        select(User)
+        .join(Follows, Follows.user_following_id == User.id)
+        .where(Follows.user_being_followed_id == user_id),
+        (Follows.user_following_id,),
+        **cursors())
+    g.user.viewer_state.load(user_ids=[user.id for user in page.items])
+
+    return render_template('users/followers.html', user=user,
+                           followers=page.items, page=page)
 
 
 @app.route('/users/follow/<int:follow_id>', methods=['POST'])
@@ -240,8 +643,12 @@ def add_follow(follow_id):
         return redirect("/")
 
     followed_user = User.query.get_or_404(follow_id)
-    g.user.following.append(followed_user)
+    g.user.load().following.append(followed_user)
+    db.session.flush()
+    counters.followed(g.user.id, followed_user.id)
+    timelines.follow(g.user.id, followed_user.id)
     db.session.commit()
+    current_users.invalidate(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -255,8 +662,11 @@ def stop_following(follow_id):
         return redirect("/")
 
     followed_user = User.query.get(follow_id)
-    g.user.following.remove(followed_user)
+    g.user.load().following.remove(followed_user)
+    counters.unfollowed(g.user.id, followed_user.id)
+    timelines.unfollow(g.user.id, followed_user.id)
     db.session.commit()
+    current_users.invalidate(g.user.id, followed_user.id)
 
     return redirect(f"/users/{g.user.id}/following")
 
@@ -269,11 +679,12 @@ def profile():
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
-    user = g.user
+    user = g.user.load()
     form = UserAddForm(obj=user)
 
     if form.validate_on_submit():
         if User.authenticate(user.username, form.password.data):
+            old_username = user.username
             user.username = form.username.data
             user.email = form.email.data
             user.image_url = form.image_url.data or "/static/images/default-pic.png"
@@ -283,6 +694,12 @@ def profile():
             
 
             db.session.commit()
+            current_users.invalidate(user.id)
+
+            usernames.remove(user.id, old_username)
+            usernames.add(user.id, user.username)
+            taken.add(username=user.username, email=user.email)
+
             return redirect(f"/users/{user.id}")
 
         flash("Wrong password, please try again.", 'danger')
@@ -300,8 +717,28 @@ def delete_user():
 
     do_logout()
 
-    db.session.delete(g.user)
+    user_id, username = g.user.id, g.user.username
+
+    # Logged-out visitors may have their messages' pages cached. Archived
+    # messages can't be listed cheaply; if they have any, every page goes.
+    message_ids = db.session.execute(
+        select(Message.id).where(Message.user_id == user_id)).scalars().all()
+    archived = db.session.execute(
+        select(ArchivedCounts.messages_count)
+        .where(ArchivedCounts.user_id == user_id)).scalar()
+
+    counters.user_deleted(user_id)
+    db.session.delete(g.user.load())
     db.session.commit()
+    current_users.invalidate(user_id)
+
+    if archived:
+        page_cache.clear()
+    else:
+        page_cache.invalidate(*(url_for('messages_show', message_id=message_id)
+                                for message_id in message_ids))
+
+    usernames.remove(user_id, username)
 
     return redirect("/signup")
 
@@ -323,57 +760,152 @@ def add_message():
     form = MessageForm()
 
     if form.validate_on_submit():
-        msg = Message(text=form.text.data)
-        g.user.messages.append(msg)
+        msg = Message(text=form.text.data, user_id=g.user.id)
+        db.session.add(msg)
+        db.session.flush()
+        counters.message_added(msg)
+        timelines.push_message(msg)
         db.session.commit()
+        current_users.invalidate(g.user.id)
 
         return redirect(f"/users/{g.user.id}")
-    else:
-        print("Form errors:", form.errors)  # This will print any form validation errors
+    elif form.errors:
+        app.logger.debug("Message form errors: %s", form.errors)
 
     return render_template('messages/new.html', form=form)
 
+@app.route('/messages/search')
+def search_messages():
+    """Page of messages containing every word of the 'q' param, newest first."""
+
+    q = request.args.get('q', '').strip()
+    page = search.search_messages(q, **cursors())
+    messages = page.items
+
+    likes = set()
+    if g.user:
+        viewer = g.user.viewer_state
+        viewer.load(message_ids=[msg.id for msg in messages])
+        likes = viewer.liked_ids
+
+    return render_template('messages/search.html', q=q, messages=messages,
+                           likes=likes, page=page)
+
+
 @app.route('/messages/<int:message_id>', methods=["GET"])
+@http_cache.cache_for(60)
+@page_cache.cached()
 def messages_show(message_id):
     """Show a message."""
 
-    msg = Message.query.get(message_id)
-    if msg is None:
-        # Return a 404 Not Found response if there is no message with the given ID
-        abort(404)
-    return render_template('messages/show.html', message=msg)
+    msg = (Message
+           .query
+           .options(joinedload(Message.user))
+           .filter(Message.id == message_id)
+           .first())
+    archived = msg is None
+    if archived:
+        # Old messages live on in the archive, read-only
+        msg = message_archive.find(message_id)
+        author = msg and db.session.get(User, msg.user_id)
+        if author is None:
+            # Return a 404 Not Found response if there is no message with the given ID
+            abort(404)
+        msg = msg._replace(user=author)
+
+    author = msg.user
+    cached = http_cache.not_modified(
+        msg.id, msg.text, msg.timestamp, archived,
+        author.id, author.username, author.image_url,
+        g.user is not None and g.user.is_following(author))
+    if cached:
+        return cached
+
+    return render_template('messages/show.html', message=msg, archived=archived)
 
 
 @app.route('/users/add_like/<int:message_id>' , methods=['GET','POST'])
+@app.route('/messages/<int:message_id>/like', methods=['POST'])
 def like_message(message_id):
-    """Toggle a liked message for the currently-logged-in user."""
+    """Toggle a liked message for the currently-logged-in user.
+
+    Async clients can send `liked=true|false` to set the state instead of
+    toggling it, and get the new state and like count back as JSON.
+    """
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
-    liked_message = Message.query.get_or_404(message_id)
-    if liked_message.user_id == g.user.id:
+    author_id = db.session.execute(
+        select(Message.user_id).where(Message.id == message_id)).scalar()
+    if author_id is None:
+        abort(404)
+    if author_id == g.user.id:
         return abort(403)
 
-    user_likes = g.user.likes
+    payload = request.get_json(silent=True)
+    if payload is None:
+        payload = request.form
+    elif not isinstance(payload, dict):
+        abort(400)
+    wanted = payload.get('liked')
 
-    if liked_message in user_likes:
-        g.user.likes = [like for like in user_likes if like != liked_message]
+    if wanted is None:
+        liked, changed = Likes.toggle(g.user.id, message_id)
     else:
-        g.user.likes.append(liked_message)
+        liked = str(wanted).lower() in ('1', 'true', 'on', 'yes')
+        changed = Likes.set(g.user.id, message_id, liked)
+
+    if changed:
+        counters.liked(g.user.id, 1 if liked else -1)
 
     db.session.commit()
 
+    if changed:
+        like_buffer.add(message_id, 1 if liked else -1)
+        current_users.invalidate(g.user.id)
+
+    if request.accept_mimetypes.best == 'application/json':
+        count = db.session.execute(
+            select(Message.like_count).where(Message.id == message_id)
+        ).scalar()
+        return jsonify(liked=liked,
+                       likes=count + like_buffer.pending(message_id))
+
     return redirect("/")
 
 @app.route('/users/<int:user_id>/likes', methods=["GET"])
+@http_cache.cache_for(0)
 def show_likes(user_id):
     if not g.user:
         flash("Access unauthorized.", "danger")
         return redirect("/")
 
     user = User.query.get_or_404(user_id)
-    return render_template('users/likes.html', user=user, likes=user.likes)
+
+    # Which messages are on the page, off the likes index alone
+    liked_ids = db.session.execute(keyset(
+        select(Likes.message_id).where(Likes.user_id == user_id),
+        (Likes.message_id,),
+        **cursors())).scalars().all()
+    cached = http_cache.not_modified(
+        profile_version(user), liked_ids,
+        refresh=app.config['ETAG_REFRESH_SECONDS'])
+    if cached:
+        return cached
+
+    page = paginate(
+        select_message_rows()
+        .join(Likes, Likes.message_id == Message.id)
+        .where(Likes.user_id == user_id),
+        (Likes.message_id,),
+        row_factory=to_message_row,
+        **cursors())
+    # detail.html asks if the viewer follows `user`, after the session closes
+    g.user.viewer_state.load(user_ids=[user.id])
+
+    return stream_page('users/likes.html', user=user,
+                       likes=page.items, page=page)
 
 @app.route('/messages/<int:message_id>/delete', methods=["POST"])
 def delete_message(message_id):
@@ -393,8 +925,12 @@ def delete_message(message_id):
         return redirect('/')
 
     # If checks pass, delete the message
+    counters.message_deleted(msg)
+    timelines.remove_message(msg)
     db.session.delete(msg)
     db.session.commit()
+    current_users.invalidate(g.user.id)
+    page_cache.invalidate(url_for('messages_show', message_id=message_id))
 
     flash("Message deleted.", "success")
     return redirect(f"/users/{g.user.id}")
@@ -404,46 +940,49 @@ def delete_message(message_id):
 
 
 @app.route('/')
+@http_cache.cache_for(0)
+@page_cache.cached()
 def homepage():
     """Show homepage:
 
     - anon users: no messages
-    - logged in: 100 most recent messages of followed_users
+    - logged in: a page of the most recent messages on their home timeline
     """
 
     if g.user:
 
-        following_ids = [f.id for f in g.user.following] + [g.user.id]
+        # The viewer's own likes and follows are in their snapshot and
+        # last write; new messages from others move the newest id
+        cached = http_cache.not_modified(
+            timelines.latest(g.user.id),
+            refresh=app.config['ETAG_REFRESH_SECONDS'])
+        if cached:
+            return cached
 
-        messages = (Message
-                    .query
-                    .filter(Message.user_id.in_(following_ids))
-                    .order_by(Message.timestamp.desc())
-                    .limit(100)
-                    .all())
+        page = timelines.read(g.user.id, **cursors())
+        viewer = g.user.viewer_state
+        viewer.load(message_ids=[msg.id for msg in page.items])
 
-        return render_template('home.html', messages=messages)
+        return stream_page('home.html', messages=page.items, page=page,
+                           likes=viewer.liked_ids)
 
     else:
-        return render_template('home-anon.html')
+        return http_cache.not_modified() or render_template('home-anon.html')
 
 
 ##############################################################################
-# Turn off all caching in Flask
-#   (useful for dev; in production, this kind of stuff is typically
-#   handled elsewhere)
-#
-# https://stackoverflow.com/questions/34066804/disabling-caching-in-flask
-
-@app.after_request
-def add_header(req):
-    """Add non-caching headers on every request."""
-
-    req.headers["Cache-Control"] = "no-cache, no-store, must-revalidate"
-    req.headers["Pragma"] = "no-cache"
-    req.headers["Expires"] = "0"
-    req.headers['Cache-Control'] = 'public, max-age=0'
-    return req
+# Metrics: per-endpoint query counts and timings (see query_stats.py)
+
+@app.route('/metrics')
+def show_metrics():
+    """This process's metrics, in the Prometheus text format."""
+
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+
+##############################################################################
+# Caching: see http_cache.py. Views opt in with @http_cache.cache_for;
+# every other response is sent with Cache-Control: no-store.
 
 @app.cli.command() 
 def test():
@@ -452,6 +991,141 @@ def test():
     # tests = unittest.TestLoader().discover('tests')
     # unittest.TextTestRunner(verbosity=2).run(tests)
 
-# To create table that are in models.py
+@app.cli.command('rebuild-timelines')
+@click.option('--user-id', type=int,
+              help="Only rebuild this user's timeline.")
+def rebuild_timelines(user_id):
+    """Rebuild materialized home timelines from follows and messages."""
+
+    if user_id:
+        timelines.rebuild(user_id)
+        db.session.commit()
+    else:
+        timelines.rebuild_all()
+
+    click.echo("Timelines rebuilt.")
+
+
+@app.cli.command('settle-timelines')
+def settle_timelines():
+    """Switch authors who lost followers from pull back to push."""
+
+    for user_id in timelines.settle_all():
+        click.echo(f"Pushed user {user_id}'s messages to their followers.")
+
+
+@app.cli.command('reconcile-counters')
+def reconcile_counters():
+    """Recompute every user's message/follow/like counters."""
+
+    counters.reconcile()
+    db.session.commit()
+
+    click.echo("Counters reconciled.")
+
+
+@app.cli.command('recount-likes')
+def recount_likes():
+    """Recompute every message's like count from the likes table.
+
+    Stop the web workers first: likes still in their write-behind buffers
+    would be added again on top of the recount.
+    """
+
+    like_buffer.flush()
+    like_counts.recount()
+    db.session.commit()
+
+    click.echo("Like counts recomputed.")
+
+
+@app.cli.command('reindex-users')
+def reindex_users():
+    """Rebuild the username search index."""
+
+    search.reindex_users()
+
+    click.echo("Username index rebuilt.")
+
+
+@app.cli.command('reindex-messages')
+def reindex_messages():
+    """Rebuild the full-text message search index."""
+
+    search.reindex_messages()
+
+    click.echo("Message index rebuilt.")
+
+
+@app.cli.command('build-static')
+def build_static():
+    """Write hashed, gzipped copies of static/ for far-future caching."""
+
+    manifest = assets.build()
+
+    click.echo(f"Built {len(manifest)} assets into {assets.folder}.")
+
+@app.cli.command('archive-messages')
+@click.option('--older-than-days', type=click.IntRange(min=0),
+              help="Archive months older than this (ARCHIVE_AFTER_DAYS).")
+def archive_messages(older_than_days):
+    """Create upcoming message partitions, archive old ones and drop
+    deleted users' messages from the archive."""
+
+    with db.engine.begin() as conn:
+        for partition in partitions.ensure(
+                conn, months_ahead=app.config['PARTITION_MONTHS_AHEAD']):
+            click.echo(f"Created {partition.name}.")
+
+    for partition in message_archive.archive_older_than(older_than_days):
+        click.echo(f"Archived {partition.name}.")
+
+    for path in message_archive.purge_deleted_users():
+        click.echo(f"Removed deleted users' messages from {path.name}.")
+
+
+@app.cli.command('db-upgrade')
+def db_upgrade():
+    """Apply pending schema migrations."""
+
+    ran = migrations.upgrade(
+        db.engine,
+        on_apply=lambda m: click.echo(f"Applying {m.version:04d} {m.name}..."))
+
+    click.echo(f"Applied {len(ran)} migrations." if ran
+               else "Database is up to date.")
+
+
+@app.cli.command('db-status')
+def db_status():
+    """List the schema migrations not yet applied."""
+
+    for migration in migrations.pending(db.engine):
+        click.echo(f"pending: {migration.version:04d} {migration.name}")
+
+
+# Bring the schema up to date if asked to, then load the in-memory indexes
 with app.app_context():
-    db.create_all()
\ No newline at end of file
+    pending_migrations = migrations.pending(db.engine)
+    if pending_migrations and app.config['MIGRATE_ON_START']:
+        migrations.upgrade(db.engine)
+        pending_migrations = []
+
+    if pending_migrations:
+        app.logger.warning("%d schema migrations pending; run `flask db-upgrade`",
+                           len(pending_migrations))
+    else:
+        # Make sure this month and the next few can take new messages
+        with db.engine.begin() as conn:
+            partitions.ensure(conn, months_ahead=app.config['PARTITION_MONTHS_AHEAD'])
+
+        # Build the username typeahead index
+        usernames.max_size = app.config['TYPEAHEAD_MAX_ENTRIES']
+        usernames.syncing.acquire()
+        reload_names(usernames, (User.id, User.username, User.followers_count))
+
+        # Build the username/email availability filter
+        taken.capacity = app.config['AVAILABILITY_CAPACITY']
+        taken.syncing.acquire()
+        reload_names(taken, (User.username, User.email))
+    db.session.remove()
@@ -0,0 +1,316 @@
+"""Cold storage for old messages.
+
+Once a month of messages is older than ARCHIVE_AFTER_DAYS, `flask
+archive-messages` writes its partition (see partitions.py) out to a
+segment file in ARCHIVE_FOLDER and drops it from the database, along with
+the likes, search terms and timeline entries that pointed at it.
+
+Archiving moves messages, it doesn't delete them: they can still be
+viewed, and they still count towards their authors' messages_count and
+their likers' likes_count (ArchivedCounts keeps those shares, so
+`counters.reconcile()` agrees). Their likes are frozen in the
+like_count stored with them; they can't be liked or unliked any more.
+
+A deleted user's archived messages stop being shown right away, and
+the next `flask archive-messages` rewrites the segments that hold them
+without them (`purge_deleted_users()`). Segments don't record who liked
+a message, so the likes those messages had stay in their likers'
+likes_count.
+
+A segment file is:
+
+    MAGIC
+    blocks       BLOCK_ROWS messages each, oldest first, as zlib'd JSON
+    index        one ENTRY per block: its first id, offset and length
+    FOOTER       the id range the segment covers and where the index is
+
+Segments are memory-mapped, and a lookup binary-searches the sparse index
+for the one block that could hold the id, so only that block is read and
+decompressed. `messages_show` falls back to `find()` for ids no longer
+in the database. Only ids older than ARCHIVE_AFTER_DAYS can be archived,
+so only those make a process look for new segments in the folder, and
+at most once every ARCHIVE_RESCAN_SECONDS; anything else is a plain
+404. (A month archived early with `--older-than-days` is seen once one
+of those looks happens.)
+"""
+
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from collections import namedtuple
+from datetime import datetime, timedelta
+from itertools import islice
+from pathlib import Path
+
+from sqlalchemy import delete, select, text
+
+from models import db, Likes, Message, MessageTerm, TimelineEntry, User
+import counters
+import partitions
+from snowflake import first_id_at
+
+
+MAGIC = b'WARBSEG1'
+
+# First message id, offset and length of each block
+ENTRY = struct.Struct('<qQI')
+
+# Lowest and highest (exclusive) id covered, index offset, block count
+FOOTER = struct.Struct('<qqQI8s')
+
+# The low bound stored for a partition starting at MINVALUE
+MIN_ID = -2**63
+
+BLOCK_ROWS = 128
+
+COLUMNS = ('id', 'text', 'timestamp', 'user_id', 'like_count')
+
+ArchivedMessage = namedtuple('ArchivedMessage', COLUMNS + ('user',),
+                             defaults=(None,))
+
+
+def write_segment(path, low, high, rows, block_rows=BLOCK_ROWS):
+    """Write `rows` (tuples of COLUMNS, in id order) to a segment file.
+
+    The file only appears at `path` once it is complete and on disk.
+    """
+
+    path = Path(path)
+    partial = path.with_suffix('.partial')
+    rows = iter(rows)
+    index = []
+
+    with open(partial, 'wb') as out:
+        out.write(MAGIC)
+        while block := list(islice(rows, block_rows)):
+            data = zlib.compress(json.dumps(
+                [[id, text, timestamp.isoformat(), user_id, like_count]
+                 for id, text, timestamp, user_id, like_count in block]
+            ).encode())
+            index.append(ENTRY.pack(block[0][0], out.tell(), len(data)))
+            out.write(data)
+
+        index_offset = out.tell()
+        out.writelines(index)
+        out.write(FOOTER.pack(MIN_ID if low is None else low, high,
+                              index_offset, len(index), MAGIC))
+        out.flush()
+        os.fsync(out.fileno())
+
+    os.replace(partial, path)
+    directory = os.open(path.parent, os.O_RDONLY)
+    try:
+        os.fsync(directory)
+    finally:
+        os.close(directory)
+
+
+class Segment:
+    """A memory-mapped segment file."""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        with open(self.path, 'rb') as f:
+            # Tells this file from a rewrite of it at the same path
+            self.inode = os.fstat(f.fileno()).st_ino
+            self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        (self.low, self.high, self._index, self._blocks,
+         magic) = FOOTER.unpack_from(self._map, len(self._map) - FOOTER.size)
+        if magic != MAGIC or self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{self.path} is not a message segment")
+
+    def __len__(self):
+        return self._blocks
+
+    def __getitem__(self, block):
+        """The first id in this block (so bisect can search the index)."""
+
+        if not 0 <= block < self._blocks:
+            raise IndexError(block)
+        return ENTRY.unpack_from(self._map, self._index + block * ENTRY.size)[0]
+
+    def covers(self, message_id):
+        return self.low <= message_id < self.high
+
+    def _block(self, block):
+        _, offset, length = ENTRY.unpack_from(
+            self._map, self._index + block * ENTRY.size)
+        return [ArchivedMessage(id, text, datetime.fromisoformat(timestamp),
+                                user_id, like_count)
+                for id, text, timestamp, user_id, like_count in json.loads(
+                    zlib.decompress(self._map[offset:offset + length]))]
+
+    def find(self, message_id):
+        """The ArchivedMessage with this id, or None."""
+
+        if not self.covers(message_id):
+            return None
+        block = bisect.bisect_right(self, message_id) - 1
+        if block < 0:
+            return None
+
+        for msg in self._block(block):
+            if msg.id == message_id:
+                return msg
+
+        return None
+
+    def messages(self):
+        """Every ArchivedMessage in the segment, in id order."""
+
+        for block in range(self._blocks):
+            yield from self._block(block)
+
+    def close(self):
+        self._map.close()
+
+
+class MessageArchive:
+    """The segment files of archived messages, and the job that writes them."""
+
+    def __init__(self, app=None):
+        self._segments = {}
+        self._lock = threading.Lock()
+        self._scanned_at = float('-inf')
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ARCHIVE_FOLDER', str(Path(app.root_path, 'archive')))
+        app.config.setdefault('ARCHIVE_AFTER_DAYS', 365)
+        app.config.setdefault('ARCHIVE_RESCAN_SECONDS', 60)
+
+        self.folder = Path(app.config['ARCHIVE_FOLDER'])
+        self.after_days = app.config['ARCHIVE_AFTER_DAYS']
+        self.rescan_seconds = app.config['ARCHIVE_RESCAN_SECONDS']
+
+    def path_for(self, partition):
+        return self.folder / f"{partition.name}.seg"
+
+    def load(self):
+        """Open any segments written since the last look at the folder,
+        and close any that are gone."""
+
+        with self._lock:
+            self._scanned_at = time.monotonic()
+            paths = set(self.folder.glob('*.seg')) if self.folder.is_dir() else set()
+            for path, segment in list(self._segments.items()):
+                if path not in paths or path.stat().st_ino != segment.inode:
+                    self._segments.pop(path).close()
+            for path in paths - self._segments.keys():
+                self._segments[path] = Segment(path)
+
+    def _covering(self, message_id):
+        for segment in list(self._segments.values()):
+            if segment.covers(message_id):
+                return segment
+        return None
+
+    def _may_have_archived(self, message_id):
+        """Could another process have archived this id since we looked?"""
+
+        cutoff = datetime.utcnow() - timedelta(days=self.after_days)
+        return (message_id < first_id_at(cutoff)
+                and time.monotonic() - self._scanned_at >= self.rescan_seconds)
+
+    def find(self, message_id):
+        """The archived message with this id, or None.
+
+        Looks in the folder again when no open segment covers an id old
+        enough to have been archived, in case another process archived
+        it since (see the module docstring).
+        """
+
+        segment = self._covering(message_id)
+        if segment is None and self._may_have_archived(message_id):
+            self.load()
+            segment = self._covering(message_id)
+
+        return segment.find(message_id) if segment else None
+
+    def archive(self, partition):
+        """Write one partition to a segment file, then drop it.
+
+        Commits. If anything fails before the commit the partition stays
+        in the database, and running this again rewrites the segment.
+        """
+
+        in_partition = select(Message.id).where(Message.id < partition.high)
+        if partition.low is not None:
+            in_partition = in_partition.where(Message.id >= partition.low)
+
+        # Nothing can change the partition while it is being copied
+        db.session.execute(text(f"LOCK TABLE {partition.name} IN SHARE MODE"))
+
+        rows = db.session.execute(
+            text(f"SELECT {', '.join(COLUMNS)} FROM {partition.name} ORDER BY id")
+            .execution_options(yield_per=1000))
+        self.folder.mkdir(parents=True, exist_ok=True)
+        write_segment(self.path_for(partition), partition.low, partition.high, rows)
+
+        counters.messages_archived(in_partition)
+        for model in (Likes, MessageTerm, TimelineEntry):
+            db.session.execute(
+                delete(model)
+                .where(model.message_id.in_(in_partition))
+                .execution_options(synchronize_session=False)
+            )
+        partitions.drop(db.session.connection(), partition)
+        db.session.commit()
+
+    def archive_older_than(self, days=None):
+        """Archive every partition whose messages are all older than `days`
+        (ARCHIVE_AFTER_DAYS by default). Returns the ones archived.
+        """
+
+        cutoff = datetime.utcnow() - timedelta(
+            days=self.after_days if days is None else days)
+
+        old = [partition
+               for partition in partitions.partitions(db.session.connection())
+               if partition.high <= first_id_at(cutoff)]
+        db.session.commit()
+
+        for partition in old:
+            self.archive(partition)
+        if old:
+            self.load()
+
+        return old
+
+    def purge_deleted_users(self):
+        """Rewrite the segments holding messages of users since deleted,
+        without those messages. Returns the paths rewritten.
+
+        Reads every segment, so it is left to `flask archive-messages`.
+        """
+
+        self.load()
+        rewritten = []
+
+        for path, segment in sorted(self._segments.items()):
+            authors = {msg.user_id for msg in segment.messages()}
+            kept = set(db.session.execute(
+                select(User.id).where(User.id.in_(authors))).scalars())
+            if kept == authors:
+                continue
+
+            write_segment(path, None if segment.low == MIN_ID else segment.low,
+                          segment.high,
+                          ((msg.id, msg.text, msg.timestamp, msg.user_id,
+                            msg.like_count)
+                           for msg in segment.messages()
+                           if msg.user_id in kept))
+            rewritten.append(path)
+
+        db.session.commit()
+        self.load()
+
+        return rewritten
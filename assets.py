@@ -0,0 +1,162 @@
+"""Content-hashed, precompressed static assets.
+
+`flask build-static` copies every file under static/ into ASSETS_FOLDER
+with a hash of its contents in its name (style.css becomes
+style.1a2b3c4d5e.css), writes a gzipped copy next to each text file, and
+records the mapping in manifest.json. References to /static/... inside
+stylesheets are rewritten to the hashed names as well.
+
+Because a hashed name only ever has one content, the files are served
+from ASSETS_URL_PATH with a one-year, immutable Cache-Control, and
+browsers never ask for them again until a deploy changes the name. The
+gzipped copy is sent to clients that accept it, so nothing is compressed
+per request.
+
+Templates link to assets with `asset_url('stylesheets/style.css')`,
+which falls back to the plain /static URL until a build exists.
+"""
+
+import gzip
+import hashlib
+import json
+import mimetypes
+import re
+from pathlib import Path
+
+from flask import request, send_from_directory, url_for
+from werkzeug.exceptions import NotFound
+
+from compression import is_compressible
+
+
+# One year, the longest max-age caches are expected to honour
+IMMUTABLE_MAX_AGE = 365 * 24 * 60 * 60
+
+STATIC_URL_RE = re.compile(r'''url\((['"]?)/static/([^'")]+)\1\)''')
+
+
+def hashed_name(path, data):
+    """`path` with a hash of `data` before its extension."""
+
+    digest = hashlib.blake2b(data, digest_size=5).hexdigest()
+    path = Path(path)
+    return path.with_name(f"{path.stem}.{digest}{path.suffix}").as_posix()
+
+
+class Assets:
+    """Builds and serves hashed copies of the static files."""
+
+    def __init__(self, app=None):
+        self.manifest = {}
+        self.gzipped = set()
+        self.version = ''
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('ASSETS_FOLDER', str(Path(app.root_path, 'dist')))
+        app.config.setdefault('ASSETS_URL_PATH', '/assets')
+
+        self.static_folder = Path(app.static_folder)
+        self.folder = Path(app.config['ASSETS_FOLDER'])
+        self.url_path = app.config['ASSETS_URL_PATH']
+        self.load()
+
+        app.extensions['assets'] = self
+        app.add_url_rule(f"{self.url_path}/<path:filename>", 'assets', self.serve)
+        app.jinja_env.globals['asset_url'] = self.asset_url
+
+    def load(self):
+        """Read the manifest left by the last build, if any."""
+
+        manifest = self.folder / 'manifest.json'
+        if manifest.exists():
+            self.manifest = json.loads(manifest.read_text())
+        else:
+            self.manifest = {}
+
+        # Pages link to the hashed names, so ETags change with this
+        self.version = hashlib.blake2b(
+            json.dumps(self.manifest, sort_keys=True).encode('UTF-8'),
+            digest_size=8).hexdigest()
+        self.gzipped = {name for name in self.manifest.values()
+                        if (self.folder / f"{name}.gz").exists()}
+
+    def build(self):
+        """Hash and compress every static file into the assets folder.
+
+        Files from earlier builds are left in place, so pages rendered
+        before a deploy can still load the assets they link to.
+        """
+
+        sources = sorted(path for path in self.static_folder.rglob('*')
+                         if path.is_file())
+        manifest = {}
+
+        # Stylesheets go last, so the files they refer to are already hashed
+        for path in sorted(sources, key=lambda path: path.suffix == '.css'):
+            name = path.relative_to(self.static_folder).as_posix()
+            data = path.read_bytes()
+
+            if path.suffix == '.css':
+                data = self.rewrite_urls(data.decode('UTF-8'),
+                                         manifest).encode('UTF-8')
+
+            manifest[name] = hashed_name(name, data)
+            target = self.folder / manifest[name]
+            target.parent.mkdir(parents=True, exist_ok=True)
+            target.write_bytes(data)
+
+            mimetype, _ = mimetypes.guess_type(name)
+            if mimetype and is_compressible(mimetype):
+                # mtime=0 keeps the output the same from build to build
+                compressed = gzip.compress(data, compresslevel=9, mtime=0)
+                if len(compressed) < len(data):
+                    Path(f"{target}.gz").write_bytes(compressed)
+
+        (self.folder / 'manifest.json').write_text(
+            json.dumps(manifest, indent=2, sort_keys=True))
+        self.load()
+
+        return manifest
+
+    def rewrite_urls(self, css, manifest):
+        """Point url(/static/...) references in `css` at hashed assets."""
+
+        def replace(match):
+            quote, name = match.groups()
+            if name not in manifest:
+                return match.group(0)
+            return f"url({quote}{self.url_path}/{manifest[name]}{quote})"
+
+        return STATIC_URL_RE.sub(replace, css)
+
+    def asset_url(self, filename):
+        """The URL to link to for static/`filename`."""
+
+        if filename in self.manifest:
+            return url_for('assets', filename=self.manifest[filename])
+        return url_for('static', filename=filename)
+
+    def serve(self, filename):
+        if filename.endswith('.gz') or filename == 'manifest.json':
+            raise NotFound()
+
+        if (filename in self.gzipped
+                and request.accept_encodings['gzip'] > 0):
+            response = send_from_directory(
+                self.folder, f"{filename}.gz",
+                mimetype=mimetypes.guess_type(filename)[0])
+            response.content_encoding = 'gzip'
+        else:
+            response = send_from_directory(self.folder, filename)
+
+        if filename in self.gzipped:
+            response.vary.add('Accept-Encoding')
+
+        response.cache_control.max_age = IMMUTABLE_MAX_AGE
+        response.cache_control.public = True
+        response.cache_control.immutable = True
+
+        return response
@@ -0,0 +1,112 @@
+"""In-process "is this username / email taken?" precheck.
+
+Every existing username and email is added to a bloom filter. A bloom
+filter can say for certain that a value was never added, so the common
+"this name is free" answer comes straight from memory; only a possible
+match (a taken name, or a false positive about `error_rate` of the time)
+has to be confirmed against Postgres.
+
+Like the typeahead index, each worker builds its own filter from `users`
+at startup and adds its own signups and renames. `catch_up()` adds the
+users whose username or email other workers set since, found by
+`users.names_changed_at`; the filter remembers the latest of those it has
+read from the database, never the time of its own changes, so it can't
+skip past another worker's. Rebuilds run on a background thread and swap
+the new filter in whole. Nothing is ever removed between rebuilds, so
+a deleted user's old name just costs a database check. The answer is a
+hint for the signup form; the unique constraints still decide.
+"""
+
+import hashlib
+import math
+import threading
+import time
+
+
+class BloomFilter:
+    """A fixed-size bloom filter over strings."""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.01):
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hash_count = max(1, round(self.size / capacity * math.log(2)))
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, value):
+        # Two 64-bit hashes combined give all k positions (Kirsch-Mitzenmacher)
+        digest = hashlib.blake2b(value.encode('UTF-8'), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+        return ((h1 + i * h2) % self.size for i in range(self.hash_count))
+
+    def add(self, value):
+        for pos in self._positions(value):
+            self._bits[pos >> 3] |= 1 << (pos & 7)
+
+    def __contains__(self, value):
+        return all(self._bits[pos >> 3] & (1 << (pos & 7))
+                   for pos in self._positions(value))
+
+
+class TakenFilter:
+    """Bloom filter of the usernames and emails already in use."""
+
+    def __init__(self, capacity=1_000_000, error_rate=0.01):
+        self.capacity = capacity
+        self.error_rate = error_rate
+        # The latest names_changed_at read from the database
+        self.changed_through = None
+        self.loaded_at = 0.0
+        self.synced_at = 0.0
+        self.syncing = threading.Lock()
+        self._filter = BloomFilter(capacity, error_rate)
+        self._lock = threading.Lock()
+
+    def load(self, rows):
+        """Rebuild the filter from `rows` of (username, email, names_changed_at).
+
+        The filter is sized for twice as many rows, to leave room to grow.
+        """
+
+        rows = list(rows)
+        bloom = BloomFilter(max(self.capacity, 2 * len(rows)), self.error_rate)
+        for username, email, _ in rows:
+            bloom.add(f"username:{username}")
+            bloom.add(f"email:{email}")
+
+        with self._lock:
+            self._filter = bloom
+            self.changed_through = max((row[2] for row in rows), default=None)
+            self.loaded_at = self.synced_at = time.monotonic()
+
+    def add(self, username=None, email=None):
+        """Mark a username and/or email as taken."""
+
+        with self._lock:
+            if username is not None:
+                self._filter.add(f"username:{username}")
+            if email is not None:
+                self._filter.add(f"email:{email}")
+
+    def catch_up(self, rows):
+        """Add `rows` of (username, email, names_changed_at) changed since
+        the last sync.
+
+        Callers select users changed after `changed_through`, less a margin
+        for transactions that commit out of order.
+        """
+
+        for username, email, changed_at in rows:
+            self.add(username, email)
+            with self._lock:
+                if self.changed_through is None or changed_at > self.changed_through:
+                    self.changed_through = changed_at
+        self.synced_at = time.monotonic()
+
+    def might_be_taken(self, field, value):
+        """False if `value` is certainly not in use as this field."""
+
+        with self._lock:
+            return f"{field}:{value}" in self._filter
+
+
+taken = TakenFilter()
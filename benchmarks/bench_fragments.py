@@ -0,0 +1,80 @@
+"""Benchmark rendering a home timeline with and without the fragment cache.
+
+Renders home.html for a page of `--messages` messages, first with the
+fragment cache turned off (every message body rendered each time, as
+before the cache) and then with a warm cache, and prints per-render
+timings for both. Importing the app needs the database in DATABASE_URL.
+
+    python benchmarks/bench_fragments.py [--messages 100] [--renders 1000]
+"""
+
+import argparse
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from flask import g, render_template  # noqa: E402
+
+from app import app, fragment_cache  # noqa: E402
+from current_user import CurrentUser, UserSnapshot  # noqa: E402
+from pagination import Page  # noqa: E402
+from read_models import MessageRow  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def time_renders(rows, renders):
+    timings = []
+    for _ in range(renders):
+        start = time.perf_counter()
+        render_template('home.html', messages=rows,
+                        page=Page(rows, None, None), likes={rows[0].id})
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--messages', type=int, default=100)
+    parser.add_argument('--renders', type=int, default=1000)
+    args = parser.parse_args()
+
+    now = datetime(2024, 5, 1)
+    rows = [MessageRow(id, f"Message number {id} about nothing much at all",
+                       now - timedelta(minutes=id), id % 20,
+                       f"user{id % 20}", f"/static/images/{id % 20}.png",
+                       id % 7)
+            for id in range(args.messages, 0, -1)]
+    viewer = UserSnapshot(1, "viewer", "viewer@example.com", "/v.png",
+                          "/h.png", "Bio", "Here", 10, 20, 30, 40)
+
+    with app.test_request_context('/'):
+        g.user = CurrentUser(viewer)
+
+        max_bytes = fragment_cache._fragments.maxweight
+        fragment_cache._fragments.maxweight = 0
+        fragment_cache.clear()
+        uncached = time_renders(rows, args.renders)
+
+        fragment_cache._fragments.maxweight = max_bytes
+        time_renders(rows, 1)
+        cached = time_renders(rows, args.renders)
+
+    print(f"messages/page:  {args.messages}")
+    print(f"renders:        {args.renders:,}")
+    for label, timings in (('uncached', uncached), ('cached', cached)):
+        print(f"{label:<9}       p50 {percentile(timings, 50) * 1e3:.2f} ms"
+              f"   p99 {percentile(timings, 99) * 1e3:.2f} ms")
+    print(f"speedup (p50):  "
+          f"{percentile(uncached, 50) / percentile(cached, 50):.1f}x")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,109 @@
+"""Benchmark password checks under a concurrent login burst.
+
+Simulates a threaded web worker: `--clients` threads each check
+`--logins` passwords back to back, while one more thread keeps serving a
+cheap stand-in for a timeline request. Reports login throughput,
+latency, how many logins were turned away with HasherBusy, and how slow
+the other "requests" got during the burst. Run it once inline
+(--workers 0) and once on a pool to compare.
+
+    python benchmarks/bench_login.py [--workers 4] [--clients 32] [--rounds 12]
+"""
+
+import argparse
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from passwords import HasherBusy, PasswordHasher  # noqa: E402
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1)
+    parser.add_argument('--max-pending', type=int, default=None)
+    parser.add_argument('--clients', type=int, default=32)
+    parser.add_argument('--logins', type=int, default=10)
+    parser.add_argument('--rounds', type=int, default=12)
+    args = parser.parse_args()
+
+    config = {
+        'BCRYPT_LOG_ROUNDS': args.rounds,
+        'BCRYPT_WORKERS': args.workers,
+    }
+    if args.max_pending is not None:
+        config['BCRYPT_MAX_PENDING'] = args.max_pending
+    hasher = PasswordHasher(type('App', (), {'config': config})())
+
+    hashed = hasher.hash("password")  # also warms up the pool
+
+    login_times = []
+    rejected = []
+    lock = threading.Lock()
+
+    def client():
+        for _ in range(args.logins):
+            start = time.perf_counter()
+            try:
+                hasher.check(hashed, "password")
+            except HasherBusy:
+                with lock:
+                    rejected.append(1)
+                time.sleep(0.01)
+                continue
+            with lock:
+                login_times.append(time.perf_counter() - start)
+
+    other_times = []
+    done = threading.Event()
+
+    def other_requests():
+        while not done.is_set():
+            start = time.perf_counter()
+            sum(range(20_000))
+            other_times.append(time.perf_counter() - start)
+            time.sleep(0.001)
+
+    probe = threading.Thread(target=other_requests)
+    probe.start()
+
+    clients = [threading.Thread(target=client) for _ in range(args.clients)]
+    start = time.perf_counter()
+    for thread in clients:
+        thread.start()
+    for thread in clients:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    done.set()
+    probe.join()
+    hasher.shutdown()
+
+    login_times.sort()
+    other_times.sort()
+
+    print(f"workers:        {args.workers or 'inline'} "
+          f"(max pending {hasher._slots._initial_value})")
+    print(f"work factor:    {args.rounds}")
+    print(f"logins:         {len(login_times):,} ok, {len(rejected):,} "
+          f"rejected in {elapsed:.2f} s")
+    print(f"throughput:     {len(login_times) / elapsed:.1f} logins/s")
+    if login_times:
+        for pct in (50, 99):
+            print(f"login p{pct:<3}      "
+                  f"{percentile(login_times, pct) * 1e3:.1f} ms")
+    for pct in (50, 99):
+        print(f"other p{pct:<3}      "
+              f"{percentile(other_times, pct) * 1e3:.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
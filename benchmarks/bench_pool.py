@@ -0,0 +1,157 @@
+"""Benchmark where the connection pool saturates for a worker layout.
+
+Starts `--workers` processes, each with its own pool configured like the
+app's (InstrumentedQueuePool, DB_POOL_SIZE, DB_MAX_OVERFLOW...), and in
+each runs a rising number of client threads, like a gunicorn worker
+with that many threads. A client's "request" checks out a connection,
+runs `--queries` statements of `--query-ms` each, and gives it back.
+
+For every step it prints throughput, request latency, time spent waiting
+for a connection and checkouts that timed out. Once clients outnumber
+DB_POOL_SIZE + DB_MAX_OVERFLOW, throughput stops growing and the extra
+latency is all checkout wait. Uses the database in DATABASE_URL; it
+needs no tables.
+
+    python benchmarks/bench_pool.py [--workers 4] [--pool-size 4] [--clients 1,2,4,8,16]
+"""
+
+import argparse
+import multiprocessing
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from sqlalchemy import create_engine, text  # noqa: E402
+from sqlalchemy.exc import TimeoutError  # noqa: E402
+
+from pool_stats import InstrumentedQueuePool  # noqa: E402
+
+
+QUERY = text("SELECT pg_sleep(:seconds)")
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def run_worker(args, clients, results):
+    """One worker process: `clients` threads sharing one pool."""
+
+    engine = create_engine(
+        args.url, poolclass=InstrumentedQueuePool,
+        pool_size=args.pool_size, max_overflow=args.max_overflow,
+        pool_timeout=args.pool_timeout, pool_pre_ping=args.pre_ping)
+
+    latencies = []
+    waits = []
+    timeouts = []
+    in_use = [0]
+    lock = threading.Lock()
+    deadline = time.perf_counter() + args.seconds
+
+    def client():
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            try:
+                with engine.connect() as conn:
+                    waited = time.perf_counter() - start
+                    busy = engine.pool.checkedout()
+                    for _ in range(args.queries):
+                        conn.execute(QUERY, {'seconds': args.query_ms / 1000})
+                    conn.rollback()
+            except TimeoutError:
+                # Counted as a wait, so starved clients show up there too
+                with lock:
+                    waits.append(time.perf_counter() - start)
+                    timeouts.append(1)
+                continue
+
+            with lock:
+                latencies.append(time.perf_counter() - start)
+                waits.append(waited)
+                in_use[0] = max(in_use[0], busy)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    engine.dispose()
+
+    results.put((latencies, waits, len(timeouts), in_use[0]))
+
+
+def run_step(args, clients):
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    workers = [context.Process(target=run_worker, args=(args, clients, results))
+               for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+
+    latencies, waits, timeouts, in_use = [], [], 0, 0
+    for _ in workers:
+        worker_latencies, worker_waits, worker_timeouts, worker_in_use = results.get()
+        latencies += worker_latencies
+        waits += worker_waits
+        timeouts += worker_timeouts
+        in_use = max(in_use, worker_in_use)
+    for worker in workers:
+        worker.join()
+
+    latencies.sort()
+    waits.sort()
+    return latencies, waits, timeouts, in_use
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--url', default=os.environ.get(
+        'DATABASE_URL', 'postgresql:///warbler'))
+    parser.add_argument('--workers', type=int, default=2)
+    parser.add_argument('--clients', default='1,2,4,8,16',
+                        help="Client threads per worker, one step each.")
+    parser.add_argument('--pool-size', type=int, default=4)
+    parser.add_argument('--max-overflow', type=int, default=2)
+    parser.add_argument('--pool-timeout', type=float, default=5)
+    parser.add_argument('--no-pre-ping', dest='pre_ping', action='store_false')
+    parser.add_argument('--queries', type=int, default=3)
+    parser.add_argument('--query-ms', type=float, default=2)
+    parser.add_argument('--seconds', type=float, default=5)
+    args = parser.parse_args()
+
+    engine = create_engine(args.url)
+    with engine.connect() as conn:
+        max_connections = conn.execute(text("SHOW max_connections")).scalar()
+    engine.dispose()
+
+    per_worker = args.pool_size + args.max_overflow
+    print(f"layout:         {args.workers} workers, pool {args.pool_size} "
+          f"+ {args.max_overflow} overflow, timeout {args.pool_timeout:g} s")
+    print(f"connections:    up to {args.workers * per_worker} "
+          f"(server max_connections {max_connections})")
+    print(f"request:        {args.queries} x {args.query_ms:g} ms queries")
+    print()
+    print(f"{'clients':>8} {'in use':>7} {'req/s':>9} {'p50 ms':>8} "
+          f"{'p99 ms':>8} {'wait p50':>9} {'wait p99':>9} {'timeouts':>9}")
+
+    for clients in [int(n) for n in args.clients.split(',')]:
+        latencies, waits, timeouts, in_use = run_step(args, clients)
+        if not latencies:
+            print(f"{clients:>8} {in_use:>7} {'-':>9} {'-':>8} {'-':>8} "
+                  f"{'-':>9} {'-':>9} {timeouts:>9}")
+            continue
+
+        print(f"{clients:>8} {in_use:>7} {len(latencies) / args.seconds:>9.1f} "
+              f"{percentile(latencies, 50) * 1e3:>8.1f} "
+              f"{percentile(latencies, 99) * 1e3:>8.1f} "
+              f"{percentile(waits, 50) * 1e3:>9.2f} "
+              f"{percentile(waits, 99) * 1e3:>9.2f} {timeouts:>9}")
+
+
+if __name__ == '__main__':
+    main()
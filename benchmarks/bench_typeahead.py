@@ -0,0 +1,73 @@
+"""Benchmark the username typeahead index.
+
+Loads an index with random usernames and times prefix lookups against it.
+
+    python benchmarks/bench_typeahead.py [--users 1000000] [--queries 100000]
+"""
+
+import argparse
+import os
+import random
+import string
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+
+from typeahead import UsernameIndex  # noqa: E402
+
+
+def random_username(rng):
+    length = rng.randint(4, 15)
+    return ''.join(rng.choice(string.ascii_lowercase + string.digits + '_')
+                   for _ in range(length))
+
+
+def percentile(sorted_values, pct):
+    index = min(len(sorted_values) - 1, int(len(sorted_values) * pct / 100))
+    return sorted_values[index]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--users', type=int, default=1_000_000)
+    parser.add_argument('--queries', type=int, default=100_000)
+    parser.add_argument('--limit', type=int, default=10)
+    args = parser.parse_args()
+
+    rng = random.Random(1234)
+    names = [random_username(rng) for _ in range(args.users)]
+
+    tracemalloc.start()
+    start = time.perf_counter()
+    index = UsernameIndex(max_size=args.users)
+    index.load(enumerate(names, start=1))
+    load_time = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    prefixes = [rng.choice(names)[:rng.randint(1, 5)]
+                for _ in range(args.queries)]
+    timings = []
+    for prefix in prefixes:
+        start = time.perf_counter()
+        index.complete(prefix, limit=args.limit)
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    print(f"usernames:      {len(index):,}")
+    print(f"load time:      {load_time:.2f} s")
+    # The username strings are allocated before tracing starts, so this is
+    # the index's own overhead on top of them.
+    print(f"index memory:   {current / 2**20:.0f} MiB (peak while loading "
+          f"{peak / 2**20:.0f} MiB)")
+    print(f"queries:        {len(timings):,} (top {args.limit})")
+    for pct in (50, 90, 99, 99.9):
+        print(f"p{pct:<5}         {percentile(timings, pct) * 1e6:.1f} us")
+    print(f"max             {timings[-1] * 1e6:.1f} us")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,78 @@
+"""A small thread-safe LRU cache with optional expiry.
+
+Entries past `ttl` seconds old count as missing. When the cache holds more
+than `maxsize` entries, or its entries weigh more than `maxweight` in
+total (as measured by `weigher`, e.g. their size in bytes), the least
+recently used ones are dropped.
+"""
+
+import threading
+import time
+from collections import OrderedDict
+
+
+class LRUCache:
+    """Maps keys to values, evicting least recently used entries."""
+
+    def __init__(self, maxsize=1024, ttl=None, weigher=None, maxweight=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.weigher = weigher
+        self.maxweight = maxweight
+        self.weight = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """The value cached for `key`, or `default` if missing or expired."""
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+
+            value, expires, _ = entry
+            if expires is not None and expires <= time.monotonic():
+                self._remove(key)
+                return default
+
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        """Cache `value` under `key`."""
+
+        expires = time.monotonic() + self.ttl if self.ttl else None
+        weight = self.weigher(value) if self.weigher else 0
+
+        with self._lock:
+            self._remove(key)
+            self._entries[key] = (value, expires, weight)
+            self.weight += weight
+
+            while self._entries and (
+                    (self.maxsize is not None
+                     and len(self._entries) > self.maxsize)
+                    or (self.maxweight is not None
+                        and self.weight > self.maxweight)):
+                _, (_, _, evicted) = self._entries.popitem(last=False)
+                self.weight -= evicted
+
+    def pop(self, key):
+        """Forget `key`, if cached."""
+
+        with self._lock:
+            self._remove(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.weight = 0
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.weight -= entry[2]
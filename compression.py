@@ -0,0 +1,90 @@
+"""Gzip compression for Warbler's responses.
+
+`GzipMiddleware` wraps the WSGI app and gzips text responses (HTML, CSS,
+JS, JSON, SVG) for clients that accept it. Responses with a known length
+under `min_size` bytes are sent as they are, since the gzip header and
+the CPU time would cost more than they save. Streamed responses are
+compressed chunk by chunk, with a sync flush after each one, so the
+browser still gets the page's head before the rest has rendered.
+
+Responses that already have a Content-Encoding (such as precompressed
+static assets) are passed through untouched.
+"""
+
+import zlib
+
+from werkzeug.datastructures import Headers
+from werkzeug.http import parse_accept_header
+from werkzeug.wsgi import ClosingIterator
+
+
+COMPRESSIBLE_TYPES = {
+    'application/javascript',
+    'application/json',
+    'application/xml',
+    'image/svg+xml',
+}
+
+
+def is_compressible(content_type):
+    mimetype = content_type.split(';')[0].strip().lower()
+    return mimetype.startswith('text/') or mimetype in COMPRESSIBLE_TYPES
+
+
+class GzipMiddleware:
+    """WSGI middleware that gzips compressible responses."""
+
+    def __init__(self, app, min_size=1024, level=6):
+        self.app = app
+        self.min_size = min_size
+        self.level = level
+
+    def __call__(self, environ, start_response):
+        accepted = parse_accept_header(environ.get('HTTP_ACCEPT_ENCODING'))
+        accepts_gzip = accepted['gzip'] > 0
+        state = {'compress': False, 'streamed': False}
+
+        def gzip_start_response(status, headers, exc_info=None):
+            headers = Headers(headers)
+
+            if (is_compressible(headers.get('Content-Type', ''))
+                    and 'Content-Encoding' not in headers):
+                headers.add('Vary', 'Accept-Encoding')
+
+                length = headers.get('Content-Length', type=int)
+                if (accepts_gzip and status.startswith('200')
+                        and environ['REQUEST_METHOD'] != 'HEAD'
+                        and (length is None or length >= self.min_size)):
+                    state['compress'] = True
+                    state['streamed'] = length is None
+                    headers['Content-Encoding'] = 'gzip'
+                    headers.pop('Content-Length', None)
+
+                    # A strong ETag names exact bytes, and these have changed
+                    etag = headers.get('ETag')
+                    if etag and not etag.startswith('W/'):
+                        headers['ETag'] = 'W/' + etag
+
+            return start_response(status, headers.to_wsgi_list(), exc_info)
+
+        body = self.app(environ, gzip_start_response)
+        if not state['compress']:
+            return body
+
+        return ClosingIterator(self.compress(body, state['streamed']),
+                               getattr(body, 'close', None))
+
+    def compress(self, body, streamed):
+        """Gzip the chunks of `body`, flushing after each one if `streamed`."""
+
+        # wbits=31 writes a gzip header and trailer around the deflate data
+        compressor = zlib.compressobj(self.level, zlib.DEFLATED, 31)
+
+        for chunk in body:
+            data = compressor.compress(chunk)
+            if streamed:
+                data += compressor.flush(zlib.Z_SYNC_FLUSH)
+            if data:
+                yield data
+
+        yield compressor.flush()
@@ -0,0 +1,161 @@
+"""Denormalized per-user counters for Warbler.
+
+`users` carries messages_count, following_count, followers_count and
+likes_count so that profile and home pages can show them without loading
+whole relationships. The views keep them up to date in the same
+transaction as the change they count; `reconcile()` recomputes all of
+them in bulk if they ever drift.
+
+None of these functions commit; they run inside the caller's transaction.
+"""
+
+from sqlalchemy import func, select, update
+from sqlalchemy.dialects.postgresql import insert
+
+from models import db, ArchivedCounts, Follows, Likes, Message, User
+
+
+def adjust(user_ids, **deltas):
+    """Add `deltas` (e.g. messages_count=1) to the counters of these users.
+
+    `user_ids` is a single id, a list of ids or a select of ids.
+    """
+
+    if isinstance(user_ids, int):
+        user_ids = [user_ids]
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(user_ids))
+        .values({getattr(User, name): getattr(User, name) + delta
+                 for name, delta in deltas.items()})
+        .execution_options(synchronize_session=False)
+    )
+
+
+def message_added(msg):
+    """Count a new message for its author."""
+
+    adjust(msg.user_id, messages_count=1)
+
+
+def message_deleted(msg):
+    """Uncount a message for its author and for everyone who liked it."""
+
+    adjust(msg.user_id, messages_count=-1)
+    adjust(select(Likes.user_id).where(Likes.message_id == msg.id),
+           likes_count=-1)
+
+
+def messages_archived(message_ids):
+    """Move many messages' counts over to ArchivedCounts as they are archived.
+
+    `message_ids` is a select of ids. The users' counters don't change,
+    since archived messages are still theirs (see archive.py); the shares
+    are kept so `reconcile()` can add them back. The likes must still
+    exist.
+    """
+
+    def archive(column, owner, counter):
+        archived = (select(owner, func.count())
+                    .where(column.in_(message_ids))
+                    .group_by(owner))
+        stmt = insert(ArchivedCounts).from_select(['user_id', counter], archived)
+        db.session.execute(stmt.on_conflict_do_update(
+            index_elements=['user_id'],
+            set_={counter: getattr(ArchivedCounts, counter)
+                  + getattr(stmt.excluded, counter)}))
+
+    archive(Message.id, Message.user_id, 'messages_count')
+    archive(Likes.message_id, Likes.user_id, 'likes_count')
+
+
+def followed(follower_id, followed_id):
+    """Count a new follow on both ends."""
+
+    adjust(follower_id, following_count=1)
+    adjust(followed_id, followers_count=1)
+
+
+def unfollowed(follower_id, followed_id):
+    """Uncount a follow on both ends."""
+
+    adjust(follower_id, following_count=-1)
+    adjust(followed_id, followers_count=-1)
+
+
+def liked(user_id, delta):
+    """Count (delta=1) or uncount (delta=-1) a like by this user."""
+
+    adjust(user_id, likes_count=delta)
+
+
+def user_deleted(user_id):
+    """Uncount everything a user is about to take with them, including
+    their likes from other users' messages' like_count.
+
+    Must run before the user is deleted, while their follows, messages,
+    likes and the likes on their messages still exist.
+    """
+
+    adjust(select(Follows.user_following_id)
+           .where(Follows.user_being_followed_id == user_id),
+           following_count=-1)
+    adjust(select(Follows.user_being_followed_id)
+           .where(Follows.user_following_id == user_id),
+           followers_count=-1)
+
+    lost_likes = (select(func.count())
+                  .select_from(Likes)
+                  .join(Message, Message.id == Likes.message_id)
+                  .where(Message.user_id == user_id,
+                         Likes.user_id == User.id)
+                  .scalar_subquery())
+    likers = (select(Likes.user_id)
+              .join(Message, Message.id == Likes.message_id)
+              .where(Message.user_id == user_id))
+
+    db.session.execute(
+        update(User)
+        .where(User.id.in_(likers))
+        .values(likes_count=User.likes_count - lost_likes)
+        .execution_options(synchronize_session=False)
+    )
+
+    # Their own messages go with them, so only the others need a write
+    db.session.execute(
+        update(Message)
+        .where(Message.id.in_(select(Likes.message_id)
+                              .where(Likes.user_id == user_id)),
+               Message.user_id != user_id)
+        .values(like_count=Message.like_count - 1)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def reconcile():
+    """Recompute every user's counters from the underlying tables."""
+
+    def count(column, owner):
+        return (select(func.count())
+                .where(column == owner)
+                .scalar_subquery())
+
+    def archived(counter):
+        return func.coalesce(
+            select(counter)
+            .where(ArchivedCounts.user_id == User.id)
+            .scalar_subquery(), 0)
+
+    db.session.execute(
+        update(User)
+        .values(
+            messages_count=(count(Message.user_id, User.id)
+                            + archived(ArchivedCounts.messages_count)),
+            following_count=count(Follows.user_following_id, User.id),
+            followers_count=count(Follows.user_being_followed_id, User.id),
+            likes_count=(count(Likes.user_id, User.id)
+                         + archived(ArchivedCounts.likes_count)),
+        )
+        .execution_options(synchronize_session=False)
+    )
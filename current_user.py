@@ -0,0 +1,108 @@
+"""Process-local cache of logged-in users.
+
+Every request needs to know who is logged in, but most only need the
+user's id, name, pictures and counters. Those are cached here as small
+UserSnapshot tuples keyed by user id, so a request for a cached user
+doesn't touch the database at all. The full ORM User is only loaded, with
+`CurrentUser.load()`, by views that change the user.
+
+Views that change what a snapshot holds call `invalidate()` after they
+commit. Changes made by other workers, or to other users' counters as a
+side effect, show up once a snapshot expires after
+CURRENT_USER_CACHE_TTL seconds.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from cache import LRUCache
+from models import db, User, ViewerState
+from replicas import use_primary
+
+
+SNAPSHOT_COLUMNS = [
+    'id', 'username', 'email', 'image_url', 'header_image_url', 'bio',
+    'location', 'messages_count', 'following_count', 'followers_count',
+    'likes_count',
+]
+
+UserSnapshot = namedtuple('UserSnapshot', SNAPSHOT_COLUMNS)
+
+
+class CurrentUser:
+    """The logged-in user for one request, backed by a cached snapshot.
+
+    Snapshot fields read as attributes, like on a User.
+    """
+
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+        self._user = None
+        self._viewer_state = None
+
+    def __getattr__(self, name):
+        return getattr(self.snapshot, name)
+
+    @property
+    def viewer_state(self):
+        """This request's ViewerState for the user, created on first use."""
+
+        if self._viewer_state is None:
+            self._viewer_state = ViewerState(self.id)
+        return self._viewer_state
+
+    def is_following(self, other_user):
+        """Is this user following `other_user`?"""
+
+        return self.viewer_state.is_following(other_user.id)
+
+    def load(self):
+        """The full User, loaded from the database on first use."""
+
+        if self._user is None:
+            self._user = db.get_or_404(User, self.id)
+        return self._user
+
+
+class CurrentUserCache:
+    """Caches UserSnapshots by user id."""
+
+    def __init__(self, app=None):
+        self._snapshots = LRUCache()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('CURRENT_USER_CACHE_SIZE', 10000)
+        app.config.setdefault('CURRENT_USER_CACHE_TTL', 30)
+        self._snapshots.maxsize = app.config['CURRENT_USER_CACHE_SIZE']
+        self._snapshots.ttl = app.config['CURRENT_USER_CACHE_TTL']
+
+    def get(self, user_id):
+        """A CurrentUser for this id, or None if there is no such user."""
+
+        snapshot = self._snapshots.get(user_id)
+
+        if snapshot is None:
+            # A replica could hand back the user from before an invalidation
+            with use_primary():
+                row = db.session.execute(
+                    select(*(getattr(User, name) for name in SNAPSHOT_COLUMNS))
+                    .where(User.id == user_id)).first()
+            if row is None:
+                return None
+            snapshot = UserSnapshot._make(row)
+            self._snapshots.set(user_id, snapshot)
+
+        return CurrentUser(snapshot)
+
+    def invalidate(self, *user_ids):
+        """Drop the snapshots of these users."""
+
+        for user_id in user_ids:
+            self._snapshots.pop(user_id)
+
+    def clear(self):
+        self._snapshots.clear()
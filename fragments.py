@@ -0,0 +1,66 @@
+"""Cache of rendered message bodies.
+
+A message's avatar, author link, date and text render the same for
+every viewer and on every list page (home timeline, profile, likes,
+search). `FragmentCache.message_body(msg)`, available in templates as
+`message_body`, renders that part once from templates/messages/_body.html
+and keeps the HTML in an LRU capped at FRAGMENT_CACHE_MAX_BYTES. The list
+templates add the per-viewer overlay (like button and count) around it.
+
+Entries are keyed by message id, the author fields shown (a renamed
+author or new avatar makes a new key) and a hash of the fragment
+template's source. Message text never changes once posted, so the id
+stands for it. Old keys are never looked up again and age out of the LRU.
+"""
+
+import hashlib
+import sys
+
+from markupsafe import Markup
+
+from cache import LRUCache
+
+
+TEMPLATE = 'messages/_body.html'
+
+
+class FragmentCache:
+    """LRU of rendered message body fragments, capped by size."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self.version = None
+        self._fragments = LRUCache(maxsize=None, weigher=sys.getsizeof)
+        self._template = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('FRAGMENT_CACHE_MAX_BYTES', 64 * 2**20)
+        self._fragments.maxweight = app.config['FRAGMENT_CACHE_MAX_BYTES']
+        self.app = app
+
+        source, _, _ = app.jinja_env.loader.get_source(app.jinja_env, TEMPLATE)
+        self.version = hashlib.blake2b(source.encode('UTF-8'),
+                                       digest_size=8).hexdigest()
+
+        app.jinja_env.globals['message_body'] = self.message_body
+
+    def message_body(self, msg):
+        """The rendered body of `msg`, a MessageRow."""
+
+        key = (msg.id, msg.user_id, msg.username, msg.image_url, self.version)
+        html = self._fragments.get(key)
+
+        if html is None:
+            if self._template is None:
+                self._template = self.app.jinja_env.get_template(TEMPLATE)
+            html = self._template.render(msg=msg)
+            if self._fragments.maxweight:
+                self._fragments.set(key, html)
+
+        return Markup(html)
+
+    def clear(self):
+        self._fragments.clear()
@@ -0,0 +1,48 @@
+"""Gunicorn settings for Warbler.
+
+    gunicorn app:app
+
+Each worker gets its own snowflake worker id (see snowflake.py), made of
+this machine's SNOWFLAKE_NODE_ID and a slot number that is free among
+the workers running right now. A worker that is replaced hands its slot
+on to its replacement, so ids stay unique however often workers restart.
+The last slot is never handed out; it is left for CLI commands.
+Give every machine serving the app a different SNOWFLAKE_NODE_ID.
+
+Workers (WEB_CONCURRENCY) each run WEB_THREADS threads; the app sizes
+its database connection pools from WEB_THREADS as well.
+"""
+
+import os
+
+from snowflake import OFFLINE_SLOT, worker_id_for
+
+
+threads = int(os.environ.get('WEB_THREADS', 1))
+
+# This machine, the high bits of its workers' ids
+NODE_ID = int(os.environ.get('SNOWFLAKE_NODE_ID', 0))
+
+
+def pre_fork(server, worker):
+    """Give the worker about to be forked the lowest free slot."""
+
+    taken = {getattr(other, 'snowflake_slot', None)
+             for other in server.WORKERS.values()}
+    free = [slot for slot in range(OFFLINE_SLOT) if slot not in taken]
+    if not free:
+        raise RuntimeError(f"No more than {OFFLINE_SLOT} workers per machine")
+    worker.snowflake_slot = free[0]
+
+
+def post_fork(server, worker):
+    """Make ids in the new worker with its slot's worker id."""
+
+    worker_id = worker_id_for(NODE_ID, worker.snowflake_slot)
+    os.environ['SNOWFLAKE_WORKER_ID'] = str(worker_id)
+
+    # With preload_app the app, and its id generator, already exist
+    from snowflake import ids
+    ids.worker_id = worker_id
+
+    server.log.info("Worker %s makes ids as worker %d", worker.pid, worker_id)
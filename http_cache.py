@@ -0,0 +1,137 @@
+"""Conditional GETs and per-route Cache-Control for Warbler.
+
+A view that can tell cheaply which version of its page it would show
+(the profile's counters, the id of the newest message on it...) calls
+`not_modified()` with those values before it runs the page's queries.
+They are hashed into a weak ETag, and if the client already has that
+version it gets an empty 304 instead of a freshly rendered page.
+
+Every ETag also covers the viewer's snapshot and the time of their last
+write, so anything a user does themselves shows on their next page view.
+Pages that show what other users change and no cheap value stands for
+(like counts, or authors' names and avatars on the home timeline) pass
+`refresh`, and are re-rendered at least that often.
+
+Views opt in to being stored by browsers and proxies with `@cache_for`.
+Pages for logged-out visitors may be kept by shared caches, and must be
+revalidated once `max_age` runs out. A logged-in user's pages are
+private to their browser and revalidated every time (max-age=0), since
+they show the user's own follows and likes. Every other response, and
+any page showing flashed messages, is marked no-store.
+
+The template sources and the asset manifest are part of every ETag, so
+a deploy that changes a template or a static file (and so the hashed
+asset names pages link to) doesn't leave old pages valid.
+"""
+
+import hashlib
+import time
+from functools import wraps
+from pathlib import Path
+
+from flask import current_app, g, make_response, request, session
+
+
+# When the user's requests last wrote to the database
+WROTE_KEY = '_wrote_at'
+
+def cache_for(max_age=0):
+    """Let GET responses from this view be stored, revalidating logged-out
+    visitors' copies after `max_age` s and logged-in users' every time."""
+
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            g.cache_max_age = max_age
+            return view(*args, **kwargs)
+        return wrapper
+
+    return decorator
+
+
+def etag_for(*parts):
+    """A weak ETag for a page built from `parts`."""
+
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(current_app.config['TEMPLATES_VERSION'].encode('ascii'))
+    assets = current_app.extensions.get('assets')
+    if assets is not None:
+        digest.update(assets.version.encode('ascii'))
+    digest.update(repr(parts).encode('UTF-8'))
+
+    return digest.hexdigest()
+
+
+def not_modified(*parts, refresh=None):
+    """A 304 response if the client's copy of this page is current, else None.
+
+    `parts` stand for the version of the page that would be rendered; the
+    ETag made from them is also sent with the rendered page. With
+    `refresh`, the ETag changes every `refresh` seconds as well.
+    """
+
+    if g.showing_flashes or request.method not in ('GET', 'HEAD'):
+        return None
+
+    if refresh:
+        parts += (int(time.time() // refresh),)
+    g.etag = etag_for(g.user and g.user.snapshot, session.get(WROTE_KEY), *parts)
+
+    if request.if_none_match.contains_weak(g.etag):
+        return make_response('', 304)
+
+    return None
+
+
+def templates_version(app):
+    """A hash of every template's source."""
+
+    digest = hashlib.blake2b(digest_size=8)
+    root = Path(app.root_path, app.template_folder)
+    for path in sorted(root.rglob('*.html')):
+        digest.update(path.relative_to(root).as_posix().encode('UTF-8'))
+        digest.update(path.read_bytes())
+
+    return digest.hexdigest()
+
+
+def init_app(app):
+    app.config['TEMPLATES_VERSION'] = templates_version(app)
+
+    @app.before_request
+    def start_request():
+        g.etag = None
+        g.cache_max_age = None
+        g.showing_flashes = '_flashes' in session
+
+    @app.after_request
+    def set_cache_headers(response):
+        # Static files and hashed assets keep their own caching headers
+        if request.endpoint in ('static', 'assets'):
+            return response
+
+        # Set by the RoutingSession (see replicas.py)
+        if g.get('db_wrote'):
+            session[WROTE_KEY] = time.time()
+
+        if g.etag is not None and response.status_code in (200, 304):
+            response.set_etag(g.etag, weak=True)
+
+        max_age = g.cache_max_age
+        storable = (max_age is not None
+                    and request.method in ('GET', 'HEAD')
+                    and response.status_code in (200, 304)
+                    and not g.showing_flashes)
+
+        if storable:
+            if g.get('user'):
+                response.cache_control.private = True
+                response.cache_control.max_age = 0
+            else:
+                response.cache_control.public = True
+                response.cache_control.max_age = max_age
+            response.vary.add('Cookie')
+        else:
+            response.cache_control.no_store = True
+
+        return response
@@ -0,0 +1,126 @@
+"""Write-behind per-message like counts.
+
+`messages.like_count` is not updated inside the like request. Each like or
+unlike adds +1/-1 to an in-memory buffer, which coalesces the changes per
+message and writes them out in one batch when it holds
+LIKE_BUFFER_MAX_SIZE messages or LIKE_BUFFER_INTERVAL seconds after the
+first pending change. A popular message then takes one row update per
+flush instead of one per liker. A flush that fails keeps its changes and
+is retried on its own, backing off from LIKE_BUFFER_INTERVAL up to
+LIKE_BUFFER_MAX_RETRY_INTERVAL seconds while the database stays down.
+
+The buffer lives in process memory, so a crash loses at most one
+interval's worth of changes; `recount()` (`flask recount-likes`) rebuilds
+every count from the likes table. A recount can only flush its own
+process's buffer: changes still pending in running web workers are
+already in the likes table, and get added again when those workers
+flush. Recount with the web workers stopped, or expect a message liked
+in the last LIKE_BUFFER_INTERVAL seconds to be off by those likes.
+"""
+
+import atexit
+import threading
+from collections import defaultdict
+
+from sqlalchemy import bindparam, func, select, update
+
+from models import db, Likes, Message
+
+
+class LikeCountBuffer:
+    """Coalesces like-count changes in memory and flushes them in batches."""
+
+    def __init__(self, app=None):
+        self.app = None
+        self._pending = defaultdict(int)
+        self._lock = threading.Lock()
+        self._timer = None
+        # Flushes failed in a row, for the retry backoff
+        self._failures = 0
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('LIKE_BUFFER_INTERVAL', 5.0)
+        app.config.setdefault('LIKE_BUFFER_MAX_SIZE', 500)
+        app.config.setdefault('LIKE_BUFFER_MAX_RETRY_INTERVAL', 60.0)
+        self.app = app
+        atexit.register(self.flush)
+
+    def add(self, message_id, delta):
+        """Record a committed like (+1) or unlike (-1) of a message."""
+
+        with self._lock:
+            self._pending[message_id] += delta
+            full = len(self._pending) >= self.app.config['LIKE_BUFFER_MAX_SIZE']
+
+            if not full and self._timer is None:
+                self._schedule(self.app.config['LIKE_BUFFER_INTERVAL'])
+
+        if full:
+            self.flush()
+
+    def _schedule(self, delay):
+        # Call with the lock held
+        self._timer = threading.Timer(delay, self.flush)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def pending(self, message_id):
+        """The change to this message's count that hasn't been written yet."""
+
+        with self._lock:
+            return self._pending.get(message_id, 0)
+
+    def flush(self):
+        """Write every pending change in one batch, in its own transaction."""
+
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+                self._timer = None
+            batch, self._pending = self._pending, defaultdict(int)
+
+        changes = [{'message_id': message_id, 'delta': delta}
+                   for message_id, delta in batch.items() if delta]
+        if not changes:
+            return
+
+        messages = Message.__table__
+        stmt = (update(messages)
+                .where(messages.c.id == bindparam('message_id'))
+                .values(like_count=messages.c.like_count + bindparam('delta')))
+
+        try:
+            with self.app.app_context(), db.engine.begin() as conn:
+                conn.execute(stmt, changes)
+        except Exception:
+            # Put the changes back and retry them, even if no more come in
+            with self._lock:
+                for change in changes:
+                    self._pending[change['message_id']] += change['delta']
+                self._failures = min(self._failures + 1, 16)
+                if self._timer is None:
+                    self._schedule(min(
+                        self.app.config['LIKE_BUFFER_INTERVAL'] * 2 ** self._failures,
+                        self.app.config['LIKE_BUFFER_MAX_RETRY_INTERVAL']))
+            self.app.logger.exception("Could not flush like counts")
+        else:
+            self._failures = 0
+
+
+def recount():
+    """Recompute every message's like_count from the likes table.
+
+    Changes pending in other processes' buffers are counted twice (see
+    above); stop the web workers first for exact counts.
+    """
+
+    db.session.execute(
+        update(Message)
+        .values(like_count=(select(func.count())
+                            .where(Likes.message_id == Message.id)
+                            .scalar_subquery()))
+        .execution_options(synchronize_session=False)
+    )
@@ -0,0 +1,176 @@
+"""Counters, gauges and histograms served in the Prometheus text format.
+
+Metrics are registered once on the module's `metrics` registry and
+updated from anywhere in the process; `metrics.render()` writes them all
+out for GET /metrics. Values are per process, so with several gunicorn
+workers each scrape sees the worker that answered it: give every worker
+its own scrape target, or sum over them in the query.
+"""
+
+import threading
+from bisect import bisect_left
+
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+
+    def escape(value):
+        return (str(value).replace('\\', r'\\').replace('"', r'\"')
+                .replace('\n', r'\n'))
+
+    return '{' + ','.join(f'{name}="{escape(value)}"'
+                          for name, value in pairs) + '}'
+
+
+def format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    """A count that only goes up, per combination of label values."""
+
+    type = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, *labels, amount=1):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def value(self, *labels):
+        return self._values.get(labels, 0)
+
+    def samples(self):
+        with self._lock:
+            values = sorted(self._values.items())
+
+        for labels, value in values:
+            yield self.name, format_labels(self.labels, labels), value
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Gauge:
+    """A value read when metrics are rendered.
+
+    `collect` returns a mapping from tuples of label values to numbers.
+    """
+
+    type = 'gauge'
+
+    def __init__(self, name, help, collect, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.collect = collect
+
+    def samples(self):
+        for labels, value in sorted(self.collect().items()):
+            yield self.name, format_labels(self.labels, labels), value
+
+    def clear(self):
+        pass
+
+
+class Histogram:
+    """Counts of observed values falling under each of `buckets`."""
+
+    type = 'histogram'
+
+    def __init__(self, name, help, buckets, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self.buckets = tuple(sorted(buckets)) + (float('inf'),)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value, *labels):
+        index = bisect_left(self.buckets, value)
+
+        with self._lock:
+            entry = self._values.get(labels)
+            if entry is None:
+                entry = self._values[labels] = [[0] * len(self.buckets), 0, 0]
+            entry[0][index] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *labels):
+        entry = self._values.get(labels)
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            values = sorted((labels, (list(counts), total, count))
+                            for labels, (counts, total, count)
+                            in self._values.items())
+
+        for labels, (counts, total, count) in values:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                yield (f"{self.name}_bucket",
+                       format_labels(self.labels, labels,
+                                     [('le', format_value(bound))]),
+                       cumulative)
+            yield f"{self.name}_sum", format_labels(self.labels, labels), total
+            yield f"{self.name}_count", format_labels(self.labels, labels), count
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+
+class Registry:
+    """The metrics this process exports."""
+
+    def __init__(self):
+        self._metrics = {}
+
+    def add(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Metric {metric.name} is already registered")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, help, labels=()):
+        return self.add(Counter(name, help, labels))
+
+    def gauge(self, name, help, collect, labels=()):
+        return self.add(Gauge(name, help, collect, labels))
+
+    def histogram(self, name, help, buckets, labels=()):
+        return self.add(Histogram(name, help, buckets, labels))
+
+    def render(self):
+        """Every metric, in the Prometheus text exposition format."""
+
+        lines = []
+        for metric in self._metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            for name, labels, value in metric.samples():
+                lines.append(f"{name}{labels} {format_value(value)}")
+
+        return '\n'.join(lines) + '\n'
+
+    def clear(self):
+        """Reset every counter and histogram."""
+
+        for metric in self._metrics.values():
+            metric.clear()
+
+
+metrics = Registry()
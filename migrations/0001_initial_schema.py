@@ -0,0 +1,46 @@
+"""The tables Warbler started out with."""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS users (
+            id serial PRIMARY KEY,
+            email text NOT NULL UNIQUE,
+            username text NOT NULL UNIQUE,
+            image_url text,
+            header_image_url text,
+            bio text,
+            location text,
+            password text NOT NULL
+        )
+    """))
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS follows (
+            user_being_followed_id integer
+                REFERENCES users (id) ON DELETE CASCADE,
+            user_following_id integer
+                REFERENCES users (id) ON DELETE CASCADE,
+            PRIMARY KEY (user_being_followed_id, user_following_id)
+        )
+    """))
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS messages (
+            id serial PRIMARY KEY,
+            text varchar(140) NOT NULL,
+            timestamp timestamp NOT NULL,
+            user_id integer NOT NULL REFERENCES users (id) ON DELETE CASCADE
+        )
+    """))
+
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS likes (
+            id serial PRIMARY KEY,
+            user_id integer REFERENCES users (id) ON DELETE CASCADE,
+            message_id integer UNIQUE
+                REFERENCES messages (id) ON DELETE CASCADE
+        )
+    """))
@@ -0,0 +1,22 @@
+"""Key likes by (user_id, message_id) instead of a surrogate id.
+
+The original table also allowed only one like per message in total.
+"""
+
+from sqlalchemy import text
+
+from migrations import column_exists
+
+
+def upgrade(conn):
+    if column_exists(conn, 'likes', 'id'):
+        conn.execute(text(
+            "DELETE FROM likes WHERE user_id IS NULL OR message_id IS NULL"))
+        conn.execute(text("ALTER TABLE likes DROP COLUMN id"))
+        conn.execute(text(
+            "ALTER TABLE likes DROP CONSTRAINT IF EXISTS likes_message_id_key"))
+        conn.execute(text(
+            "ALTER TABLE likes ADD PRIMARY KEY (user_id, message_id)"))
+
+    conn.execute(text(
+        "CREATE INDEX IF NOT EXISTS ix_likes_message_id ON likes (message_id)"))
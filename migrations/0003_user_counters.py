@@ -0,0 +1,31 @@
+"""Denormalized message/follow/like counters on users (see counters.py)."""
+
+from sqlalchemy import text
+
+from migrations import column_exists
+
+
+COUNTERS = ('messages_count', 'following_count', 'followers_count',
+            'likes_count')
+
+
+def upgrade(conn):
+    missing = [column for column in COUNTERS
+               if not column_exists(conn, 'users', column)]
+
+    for column in missing:
+        conn.execute(text(f"ALTER TABLE users ADD COLUMN {column} "
+                          f"integer NOT NULL DEFAULT 0"))
+
+    if missing:
+        conn.execute(text("""
+            UPDATE users SET
+                messages_count = (SELECT count(*) FROM messages
+                                  WHERE messages.user_id = users.id),
+                following_count = (SELECT count(*) FROM follows
+                                   WHERE follows.user_following_id = users.id),
+                followers_count = (SELECT count(*) FROM follows
+                                   WHERE follows.user_being_followed_id = users.id),
+                likes_count = (SELECT count(*) FROM likes
+                               WHERE likes.user_id = users.id)
+        """))
@@ -0,0 +1,18 @@
+"""Per-message like counts (see like_counts.py)."""
+
+from sqlalchemy import text
+
+from migrations import column_exists
+
+
+def upgrade(conn):
+    if column_exists(conn, 'messages', 'like_count'):
+        return
+
+    conn.execute(text("ALTER TABLE messages ADD COLUMN like_count "
+                      "integer NOT NULL DEFAULT 0"))
+    conn.execute(text("""
+        UPDATE messages SET like_count = (SELECT count(*) FROM likes
+                                          WHERE likes.message_id = messages.id)
+        WHERE id IN (SELECT message_id FROM likes)
+    """))
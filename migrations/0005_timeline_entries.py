@@ -0,0 +1,49 @@
+"""Materialized home timelines (see timelines.py).
+
+New timelines are filled with the latest TIMELINE_MAX_LENGTH messages
+from each user and the users they follow. Authors over the fan-out
+threshold are included too; reads drop the duplicates.
+"""
+
+from sqlalchemy import text
+
+from migrations import table_exists
+
+
+# The TIMELINE_MAX_LENGTH default
+TIMELINE_MAX_LENGTH = 800
+
+
+def upgrade(conn):
+    if table_exists(conn, 'timeline_entries'):
+        return
+
+    conn.execute(text("""
+        CREATE TABLE timeline_entries (
+            user_id integer REFERENCES users (id) ON DELETE CASCADE,
+            message_id integer REFERENCES messages (id) ON DELETE CASCADE,
+            timestamp timestamp NOT NULL,
+            PRIMARY KEY (user_id, message_id)
+        )
+    """))
+    conn.execute(text("CREATE INDEX ix_timeline_entries_message_id "
+                      "ON timeline_entries (message_id)"))
+    conn.execute(text("CREATE INDEX ix_timeline_entries_user_timestamp "
+                      "ON timeline_entries (user_id, timestamp, message_id)"))
+
+    conn.execute(text("""
+        INSERT INTO timeline_entries (user_id, message_id, timestamp)
+        SELECT user_id, message_id, timestamp FROM (
+            SELECT readers.user_id, messages.id AS message_id,
+                   messages.timestamp,
+                   row_number() OVER (PARTITION BY readers.user_id
+                                      ORDER BY messages.timestamp DESC,
+                                               messages.id DESC) AS position
+            FROM (SELECT id AS user_id, id AS author_id FROM users
+                  UNION
+                  SELECT user_following_id, user_being_followed_id
+                  FROM follows) AS readers
+            JOIN messages ON messages.user_id = readers.author_id
+        ) AS latest
+        WHERE position <= :max_length
+    """), {'max_length': TIMELINE_MAX_LENGTH})
@@ -0,0 +1,32 @@
+"""The inverted trigram index over usernames (see search.py)."""
+
+from sqlalchemy import text
+
+from migrations import table_exists
+from models import username_grams
+
+
+def upgrade(conn, batch_size=1000):
+    if table_exists(conn, 'username_grams'):
+        return
+
+    conn.execute(text("""
+        CREATE TABLE username_grams (
+            gram text,
+            user_id integer REFERENCES users (id)
+                ON DELETE CASCADE ON UPDATE CASCADE,
+            PRIMARY KEY (gram, user_id)
+        )
+    """))
+    conn.execute(text("CREATE INDEX ix_username_grams_user_id "
+                      "ON username_grams (user_id)"))
+
+    users = conn.execute(text("SELECT id, username FROM users")
+                   .execution_options(yield_per=batch_size))
+    for batch in users.partitions():
+        rows = [{'gram': gram, 'user_id': user_id}
+                for user_id, username in batch
+                for gram in username_grams(username)]
+        if rows:
+            conn.execute(text("INSERT INTO username_grams (gram, user_id) "
+                              "VALUES (:gram, :user_id)"), rows)
@@ -0,0 +1,32 @@
+"""The inverted full-text index over messages (see search.py)."""
+
+from sqlalchemy import text
+
+from migrations import table_exists
+from models import message_terms
+
+
+def upgrade(conn, batch_size=1000):
+    if table_exists(conn, 'message_terms'):
+        return
+
+    conn.execute(text("""
+        CREATE TABLE message_terms (
+            term text,
+            message_id integer REFERENCES messages (id)
+                ON DELETE CASCADE ON UPDATE CASCADE,
+            PRIMARY KEY (term, message_id)
+        )
+    """))
+    conn.execute(text("CREATE INDEX ix_message_terms_message_id "
+                      "ON message_terms (message_id)"))
+
+    messages = conn.execute(text("SELECT id, text FROM messages")
+                   .execution_options(yield_per=batch_size))
+    for batch in messages.partitions():
+        rows = [{'term': term, 'message_id': message_id}
+                for message_id, body in batch
+                for term in message_terms(body)]
+        if rows:
+            conn.execute(text("INSERT INTO message_terms (term, message_id) "
+                              "VALUES (:term, :message_id)"), rows)
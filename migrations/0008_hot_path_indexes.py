@@ -0,0 +1,35 @@
+"""Indexes for the profile timeline and the "following" list.
+
+A user's messages are read newest first, by (timestamp, id) descending;
+the id column is descending too so the index yields that order without
+an extra sort. Who a user follows is looked up by user_following_id,
+which is only the second column of the follows primary key. Likes by a
+user are already served by the likes primary key, (user_id, message_id).
+
+The indexes are built CONCURRENTLY so writes carry on meanwhile.
+"""
+
+from sqlalchemy import text
+
+
+transactional = False
+
+INDEXES = {
+    'ix_messages_user_timestamp':
+        "messages (user_id, timestamp DESC, id DESC)",
+    'ix_follows_user_following_id':
+        "follows (user_following_id, user_being_followed_id)",
+}
+
+
+def upgrade(conn):
+    for name, definition in INDEXES.items():
+        # A concurrent build that failed leaves an invalid index behind
+        invalid = conn.execute(text(
+            "SELECT NOT indisvalid FROM pg_index "
+            "WHERE indexrelid = to_regclass(:name)"), {'name': name}).scalar()
+        if invalid:
+            conn.execute(text(f"DROP INDEX CONCURRENTLY {name}"))
+
+        conn.execute(text(
+            f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name} ON {definition}"))
@@ -0,0 +1,39 @@
+"""64-bit, time-ordered message ids (see snowflake.py).
+
+Message ids are now made by the app instead of a sequence. Existing
+messages keep their ids: they are far below any snowflake, so they still
+sort before every new message, in the order they were posted. Sorting by
+id replaces sorting by (timestamp, id), so the indexes that carried
+timestamps are replaced by ones on ids alone, and timeline entries no
+longer copy the message timestamp.
+
+Changing the column types rewrites these tables under an exclusive lock.
+"""
+
+from sqlalchemy import text
+
+
+REFERENCES = ('likes', 'message_terms', 'timeline_entries')
+
+
+def upgrade(conn):
+    sequence = conn.execute(text(
+        "SELECT pg_get_serial_sequence('messages', 'id')")).scalar()
+
+    conn.execute(text("ALTER TABLE messages ALTER COLUMN id DROP DEFAULT"))
+    conn.execute(text("ALTER TABLE messages ALTER COLUMN id TYPE bigint"))
+    if sequence:
+        conn.execute(text(f"DROP SEQUENCE {sequence}"))
+
+    for table in REFERENCES:
+        conn.execute(text(
+            f"ALTER TABLE {table} ALTER COLUMN message_id TYPE bigint"))
+
+    conn.execute(text("DROP INDEX IF EXISTS ix_messages_user_timestamp"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_messages_user_id_id "
+                      "ON messages (user_id, id)"))
+
+    conn.execute(text(
+        "DROP INDEX IF EXISTS ix_timeline_entries_user_timestamp"))
+    conn.execute(text(
+        "ALTER TABLE timeline_entries DROP COLUMN IF EXISTS timestamp"))
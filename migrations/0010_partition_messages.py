@@ -0,0 +1,69 @@
+"""Partition messages by month of id (see partitions.py).
+
+The existing table becomes the first partition, covering every id up to
+the end of the current month, so no rows are copied: the table and its
+indexes are renamed, a partitioned `messages` takes over the old name,
+and the old table is attached under it. Foreign keys to messages are
+pointed at the new parent. Later months get partitions of their own.
+
+Attaching scans the old table once to check its ids fit the partition,
+under an exclusive lock.
+"""
+
+from datetime import datetime
+
+from sqlalchemy import text
+
+import partitions
+from snowflake import first_id_at
+
+
+def upgrade(conn):
+    partitioned = conn.execute(text(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'messages'::regclass"
+    )).scalar()
+
+    if not partitioned:
+        now = datetime.utcnow()
+        name = partitions.name_for(now)
+        high = first_id_at(partitions.next_month(now))
+
+        conn.execute(text("LOCK TABLE messages IN ACCESS EXCLUSIVE MODE"))
+
+        references = conn.execute(text(
+            "SELECT conrelid::regclass::text, conname,"
+            " pg_get_constraintdef(oid)"
+            " FROM pg_constraint"
+            " WHERE contype = 'f' AND confrelid = 'messages'::regclass")).all()
+        for table, constraint, _ in references:
+            conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {constraint}"))
+
+        conn.execute(text(f"ALTER TABLE messages RENAME TO {name}"))
+        conn.execute(text(f"ALTER INDEX messages_pkey RENAME TO {name}_pkey"))
+        conn.execute(text(f"ALTER INDEX IF EXISTS ix_messages_user_id_id "
+                          f"RENAME TO {name}_user_id_id_idx"))
+        conn.execute(text(f"ALTER TABLE {name} "
+                          f"ALTER COLUMN timestamp SET NOT NULL"))
+
+        conn.execute(text("""
+            CREATE TABLE messages (
+                id bigint NOT NULL,
+                text varchar(140) NOT NULL,
+                timestamp timestamp NOT NULL,
+                user_id integer NOT NULL CONSTRAINT messages_user_id_fkey
+                    REFERENCES users (id) ON DELETE CASCADE,
+                like_count integer NOT NULL DEFAULT 0,
+                PRIMARY KEY (id)
+            ) PARTITION BY RANGE (id)
+        """))
+        conn.execute(text(
+            "CREATE INDEX ix_messages_user_id_id ON messages (user_id, id)"))
+        conn.execute(text(f"ALTER TABLE messages ATTACH PARTITION {name} "
+                          f"FOR VALUES FROM (MINVALUE) TO ({high})"))
+
+        for table, constraint, definition in references:
+            # Read before the rename, so these now name the new parent
+            conn.execute(text(
+                f"ALTER TABLE {table} ADD CONSTRAINT {constraint} {definition}"))
+
+    partitions.ensure(conn)
@@ -0,0 +1,17 @@
+"""When each user's username or email last changed (see availability.py).
+
+The in-process username indexes catch up with other workers by reading
+the users changed since they last looked. The default, now(), is stable,
+so adding the column doesn't rewrite the table: existing users all get
+the time of the upgrade.
+"""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text(
+        "ALTER TABLE users ADD COLUMN IF NOT EXISTS"
+        " names_changed_at timestamp NOT NULL DEFAULT now()"))
+    conn.execute(text("CREATE INDEX IF NOT EXISTS ix_users_names_changed_at "
+                      "ON users (names_changed_at)"))
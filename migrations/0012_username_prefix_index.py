@@ -0,0 +1,27 @@
+"""An index for username prefix search (see search.py).
+
+Lowercased usernames in "C" collation order, so `LIKE 'prefix%'` is a
+range scan and the matches come out already sorted.
+
+The index is built CONCURRENTLY so signups and renames carry on meanwhile.
+"""
+
+from sqlalchemy import text
+
+
+transactional = False
+
+NAME = 'ix_users_username_lower'
+
+
+def upgrade(conn):
+    # A concurrent build that failed leaves an invalid index behind
+    invalid = conn.execute(text(
+        "SELECT NOT indisvalid FROM pg_index "
+        "WHERE indexrelid = to_regclass(:name)"), {'name': NAME}).scalar()
+    if invalid:
+        conn.execute(text(f"DROP INDEX CONCURRENTLY {NAME}"))
+
+    conn.execute(text(
+        f'CREATE INDEX CONCURRENTLY IF NOT EXISTS {NAME}'
+        ' ON users ((lower(username) COLLATE "C"), id)'))
@@ -0,0 +1,14 @@
+"""The archived share of each user's counters (see archive.py)."""
+
+from sqlalchemy import text
+
+
+def upgrade(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS archived_counts (
+            user_id integer PRIMARY KEY
+                REFERENCES users (id) ON DELETE CASCADE,
+            messages_count integer NOT NULL DEFAULT 0,
+            likes_count integer NOT NULL DEFAULT 0
+        )
+    """))
@@ -0,0 +1,25 @@
+"""Whether each author's messages are pulled into timelines on read.
+
+Until now that followed from followers_count on every read; it is a
+stored flag now (see timelines.py), set for the authors who are pulled
+today so nothing moves.
+"""
+
+from sqlalchemy import text
+
+from migrations import column_exists
+
+
+# The TIMELINE_FANOUT_THRESHOLD default
+TIMELINE_FANOUT_THRESHOLD = 10000
+
+
+def upgrade(conn):
+    if column_exists(conn, 'users', 'timeline_pulled'):
+        return
+
+    conn.execute(text("ALTER TABLE users ADD COLUMN timeline_pulled "
+                      "boolean NOT NULL DEFAULT false"))
+    conn.execute(text("UPDATE users SET timeline_pulled = true "
+                      "WHERE followers_count >= :threshold"),
+                 {'threshold': TIMELINE_FANOUT_THRESHOLD})
@@ -0,0 +1,136 @@
+"""Versioned schema migrations for Warbler.
+
+Each module in this package named NNNN_description.py is one migration:
+it has an `upgrade(conn)` function that is given a Connection and changes
+the schema with plain SQL. `upgrade(engine)` (`flask db-upgrade`) runs
+every migration not yet recorded in the `schema_migrations` table, in
+order, each in its own transaction, and records it there. A migration
+that sets `transactional = False` (e.g. to CREATE INDEX CONCURRENTLY) runs
+on an autocommit connection instead.
+
+Migrations are written to be safe against any earlier Warbler schema,
+including databases built by `db.create_all()` before this package
+existed: they check for what is already there rather than assuming it.
+
+A Postgres advisory lock serializes upgrades, so several processes can
+run `flask db-upgrade` at once and only one of them does the work.
+"""
+
+import importlib
+import pkgutil
+import re
+from collections import namedtuple
+
+from sqlalchemy import text
+
+
+Migration = namedtuple('Migration', ['version', 'name', 'module'])
+
+# Arbitrary key for pg_advisory_lock, shared by every process
+LOCK_KEY = 0x77617262
+
+
+def discover():
+    """Every migration in this package, in version order."""
+
+    found = []
+    for info in pkgutil.iter_modules(__path__):
+        match = re.fullmatch(r'(\d{4})_(\w+)', info.name)
+        if match:
+            module = importlib.import_module(f'{__name__}.{info.name}')
+            found.append(Migration(int(match[1]), match[2], module))
+
+    return sorted(found)
+
+
+def applied(conn):
+    """The versions already recorded as applied."""
+
+    conn.execute(text(
+        "CREATE TABLE IF NOT EXISTS schema_migrations ("
+        " version integer PRIMARY KEY,"
+        " name text NOT NULL,"
+        " applied_at timestamptz NOT NULL DEFAULT now())"))
+
+    return set(conn.execute(text("SELECT version FROM schema_migrations"))
+               .scalars())
+
+
+def pending(engine):
+    """The migrations this database hasn't had yet."""
+
+    with engine.begin() as conn:
+        done = applied(conn)
+
+    return [migration for migration in discover()
+            if migration.version not in done]
+
+
+def upgrade(engine, on_apply=None):
+    """Apply every pending migration and return the ones applied.
+
+    `on_apply(migration)` is called before each one runs.
+    """
+
+    ran = []
+    with engine.connect() as conn:
+        conn.execute(text("SELECT pg_advisory_lock(:key)"), {'key': LOCK_KEY})
+        conn.commit()
+
+        try:
+            # Checked under the lock, so another process's work is seen
+            with conn.begin():
+                done = applied(conn)
+
+            for migration in discover():
+                if migration.version in done:
+                    continue
+                if on_apply:
+                    on_apply(migration)
+
+                if getattr(migration.module, 'transactional', True):
+                    with conn.begin():
+                        migration.module.upgrade(conn)
+                        record(conn, migration)
+                else:
+                    with engine.connect() as autocommit:
+                        migration.module.upgrade(autocommit.execution_options(
+                            isolation_level='AUTOCOMMIT'))
+                    with conn.begin():
+                        record(conn, migration)
+
+                ran.append(migration)
+        finally:
+            conn.rollback()
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {'key': LOCK_KEY})
+            conn.commit()
+
+    return ran
+
+
+def record(conn, migration):
+    conn.execute(text("INSERT INTO schema_migrations (version, name) "
+                      "VALUES (:version, :name)"),
+                 {'version': migration.version, 'name': migration.name})
+
+
+def clear_history(engine):
+    """Forget every applied migration, e.g. after dropping all tables."""
+
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE IF EXISTS schema_migrations"))
+
+
+# Helpers for migrations
+
+def table_exists(conn, table):
+    return conn.execute(text("SELECT to_regclass(:table) IS NOT NULL"),
+                        {'table': table}).scalar()
+
+
+def column_exists(conn, table, column):
+    return conn.execute(text(
+        "SELECT EXISTS (SELECT 1 FROM information_schema.columns"
+        " WHERE table_schema = current_schema()"
+        " AND table_name = :table AND column_name = :column)"),
+        {'table': table, 'column': column}).scalar()
@@ -1,14 +1,21 @@
 """SQLAlchemy models for Warbler."""
 
+import re
 from datetime import datetime
 
-from flask_bcrypt import Bcrypt
 from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import delete, event, select
+from sqlalchemy.dialects.postgresql import insert
 from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import validates
 
+import partitions
+from passwords import hasher
+from replicas import RoutingSession
+from snowflake import ids
 
-bcrypt = Bcrypt()
-db = SQLAlchemy()
+
+db = SQLAlchemy(session_options={'class_': RoutingSession})
 
 
 class Follows(db.Model):
@@ -28,26 +35,231 @@ class Follows(db.Model):
         primary_key=True,
     )
 
+    # Who a user follows; the primary key only covers their followers
+    __table_args__ = (
+        db.Index(
+            'ix_follows_user_following_id',
+            'user_following_id', 'user_being_followed_id',
+        ),
+    )
+
 
 class Likes(db.Model):
     """Mapping user likes to warbles."""
 
-    __tablename__ = 'likes' 
+    __tablename__ = 'likes'
 
-    id = db.Column(
+    user_id = db.Column(
         db.Integer,
-        primary_key=True
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+    @classmethod
+    def set(cls, user_id, message_id, liked):
+        """Make this user like (or not like) this message.
+
+        Idempotent: a single DELETE, or a single INSERT that does nothing
+        if the like is already there. Returns True if anything changed.
+        """
+
+        if liked:
+            stmt = (insert(cls)
+                    .values(user_id=user_id, message_id=message_id)
+                    .on_conflict_do_nothing())
+        else:
+            stmt = delete(cls).where(cls.user_id == user_id,
+                                     cls.message_id == message_id)
+
+        return db.session.execute(stmt).rowcount > 0
+
+    @classmethod
+    def toggle(cls, user_id, message_id):
+        """Unlike this message if the user likes it, otherwise like it.
+
+        Returns (liked, changed): whether the message is now liked, and
+        whether this call changed that. A concurrent request can remove
+        the like before our DELETE and put it back before our INSERT, in
+        which case neither statement changes anything.
+        """
+
+        if cls.set(user_id, message_id, liked=False):
+            return False, True
+
+        return True, cls.set(user_id, message_id, liked=True)
+
+
+class ViewerState:
+    """Who one user follows and what they like, looked up a page at a time.
+
+    Answers are kept in hash sets. `load()` fetches them for a whole page of
+    users and messages with one query per relationship; anything asked about
+    that wasn't loaded is fetched on its own and remembered. A User's
+    ViewerState is dropped whenever the User is expired (e.g. on commit).
+    """
+
+    def __init__(self, user_id):
+        self.user_id = user_id
+        self.following_ids = set()
+        self.liked_ids = set()
+        self._checked_users = set()
+        self._checked_messages = set()
+
+    def load(self, user_ids=(), message_ids=()):
+        """Look up follow state for `user_ids` and like state for
+        `message_ids`, skipping any already known."""
+
+        user_ids = set(user_ids) - self._checked_users
+        if user_ids:
+            self.following_ids.update(db.session.execute(
+                select(Follows.user_being_followed_id)
+                .where(Follows.user_following_id == self.user_id,
+                       Follows.user_being_followed_id.in_(user_ids))
+            ).scalars())
+            self._checked_users |= user_ids
+
+        message_ids = set(message_ids) - self._checked_messages
+        if message_ids:
+            self.liked_ids.update(db.session.execute(
+                select(Likes.message_id)
+                .where(Likes.user_id == self.user_id,
+                       Likes.message_id.in_(message_ids))
+            ).scalars())
+            self._checked_messages |= message_ids
+
+    def is_following(self, user_id):
+        """Does this viewer follow the user with this id?"""
+
+        self.load(user_ids=[user_id])
+        return user_id in self.following_ids
+
+    def has_liked(self, message_id):
+        """Has this viewer liked the message with this id?"""
+
+        self.load(message_ids=[message_id])
+        return message_id in self.liked_ids
+
+
+def username_grams(username):
+    """The trigrams of a username, lowercased.
+
+    Like pg_trgm, the name is padded with two spaces in front and one
+    behind, so one- and two-letter prefixes have trigrams of their own.
+    """
+
+    padded = f"  {username.lower()} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class UsernameGram(db.Model):
+    """One entry in the inverted trigram index over usernames."""
+
+    __tablename__ = 'username_grams'
+
+    gram = db.Column(
+        db.Text,
+        primary_key=True,
     )
 
     user_id = db.Column(
         db.Integer,
-        db.ForeignKey('users.id', ondelete='cascade')
+        db.ForeignKey('users.id', ondelete='cascade', onupdate='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+# Words too common to be worth a posting list of their own
+STOP_WORDS = frozenset({
+    'a', 'an', 'and', 'are', 'as', 'at', 'be', 'but', 'by', 'for', 'if',
+    'in', 'is', 'it', 'of', 'on', 'or', 'so', 'that', 'the', 'this', 'to',
+    'was', 'with',
+})
+
+
+def message_terms(text):
+    """The distinct search terms in a message's text, lowercased."""
+
+    return {word for word in re.findall(r"\w+", text.lower())
+            if word not in STOP_WORDS}
+
+
+class MessageTerm(db.Model):
+    """One entry in the inverted full-text index over messages.
+
+    The primary key keeps each term's posting list together and ordered
+    by message id, so it can be read newest-first straight off the index.
+    """
+
+    __tablename__ = 'message_terms'
+
+    term = db.Column(
+        db.Text,
+        primary_key=True,
     )
 
     message_id = db.Column(
+        db.BigInteger,
+        db.ForeignKey('messages.id', ondelete='cascade', onupdate='cascade'),
+        primary_key=True,
+        index=True,
+    )
+
+
+class TimelineEntry(db.Model):
+    """A message materialized into one user's home timeline."""
+
+    __tablename__ = 'timeline_entries'
+
+    user_id = db.Column(
         db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    # Message ids are time-ordered, so the primary key keeps each
+    # timeline in order.
+    message_id = db.Column(
+        db.BigInteger,
         db.ForeignKey('messages.id', ondelete='cascade'),
-        unique=True
+        primary_key=True,
+        index=True,
+    )
+
+
+class ArchivedCounts(db.Model):
+    """How many of a user's messages and likes have gone to the archive.
+
+    Part of their messages_count and likes_count; see archive.py.
+    """
+
+    __tablename__ = 'archived_counts'
+
+    user_id = db.Column(
+        db.Integer,
+        db.ForeignKey('users.id', ondelete='cascade'),
+        primary_key=True,
+    )
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
     )
 
 
@@ -96,7 +308,63 @@ class User(db.Model):
         nullable=False,
     )
 
-    messages = db.relationship('Message', back_populates='user', overlaps="user")
+    # When the username or email was last set, so that each worker's
+    # in-memory name indexes can pick up other workers' changes
+    names_changed_at = db.Column(
+        db.DateTime,
+        nullable=False,
+        server_default=db.func.now(),
+        index=True,
+    )
+
+    # Denormalized counts, kept up to date by the views (see counters.py)
+
+    messages_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    following_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    followers_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    likes_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
+    # Whether this author's messages are pulled into home timelines on
+    # read instead of pushed to followers (see timelines.py)
+    timeline_pulled = db.Column(
+        db.Boolean,
+        nullable=False,
+        default=False,
+        server_default='false',
+    )
+
+    # The database cascades message deletes; don't load them just to
+    # delete them (or worse, null out their user_id).
+    messages = db.relationship(
+        'Message',
+        back_populates='user',
+        overlaps="user",
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
 
     followers = db.relationship(
         "User",
@@ -121,26 +389,50 @@ class User(db.Model):
         secondary="likes"
     )
 
+    grams = db.relationship(
+        'UsernameGram',
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    @validates('username')
+    def index_username(self, key, username):
+        """Keep this user's entries in the username search index current."""
+
+        wanted = username_grams(username or '')
+        kept = [g for g in self.grams if g.gram in wanted]
+        added = wanted - {g.gram for g in kept}
+        self.grams = kept + [UsernameGram(gram=gram) for gram in added]
+
+        return username
+
     def __repr__(self):
         return f"<User #{self.id}: {self.username}, {self.email}>"
 
+    @property
+    def viewer_state(self):
+        """This user's ViewerState, created on first use."""
+
+        if getattr(self, '_viewer_state', None) is None:
+            self._viewer_state = ViewerState(self.id)
+        return self._viewer_state
+
     def is_followed_by(self, other_user):
         """Is this user followed by `other_user`?"""
 
-        found_user_list = [user for user in self.followers if user == other_user]
-        return len(found_user_list) == 1
+        return other_user.viewer_state.is_following(self.id)
 
     def is_following(self, other_user):
         """Is this user following `other_use`?"""
 
-        found_user_list = [user for user in self.following if user == other_user]
-        return len(found_user_list) == 1
+        return self.viewer_state.is_following(other_user.id)
 
     @classmethod
     def signup(cls, username, email, password, image_url,bio,location,header_image_url):
         """Sign up user.
 
-        Hashes password and adds user to system.
+        Hashes password and adds user to system. The user is flushed, not
+        committed; returns None if the username or email is taken.
         """
 
         if not username:
@@ -151,7 +443,7 @@ class User(db.Model):
         if not email:
             raise ValueError("Email cannot be empty")
 
-        hashed_pwd = bcrypt.generate_password_hash(password).decode('UTF-8')
+        hashed_pwd = hasher.hash(password)
 
         user = User(
             username=username,
@@ -162,16 +454,15 @@ class User(db.Model):
             location=location,
             header_image_url=header_image_url,
         )
-        # Add to the session and commit to the database
+        # Add to the session and insert it; the caller commits
         db.session.add(user)
         try:
-            db.session.commit()
+            db.session.flush()
         except IntegrityError:
             # Rollback the session on error to reset the transaction state
             db.session.rollback()
             return None
 
-        # Return the user object after successful commit
         return user
 
     @classmethod
@@ -183,26 +474,46 @@ class User(db.Model):
         and, if it finds such a user, returns that user object.
 
         If can't find matching user (or if password is wrong), returns False.
+
+        A hash made with an old work factor is replaced on success; the
+        caller commits it.
         """
 
         user = cls.query.filter_by(username=username).first()
 
         if user:
-            is_auth = bcrypt.check_password_hash(user.password, password)
+            is_auth = hasher.check(user.password, password)
             if is_auth:
+                if hasher.needs_rehash(user.password):
+                    user.password = hasher.hash(password)
                 return user
 
         return False
 
 
+@event.listens_for(User, 'expire')
+def forget_viewer_state(user, attrs):
+    """Drop cached follow/like answers along with the rest of the user."""
+
+    # Commits expire users that were already garbage collected, too
+    if user is not None:
+        user.__dict__.pop('_viewer_state', None)
+
+
 class Message(db.Model):
     """An individual message ("warble")."""
 
     __tablename__ = 'messages'
 
+    # One partition per month of ids (see partitions.py)
+    __table_args__ = {'postgresql_partition_by': 'RANGE (id)'}
+
+    # Time-ordered (see snowflake.py): newest first is highest id first
     id = db.Column(
-        db.Integer,
+        db.BigInteger,
         primary_key=True,
+        autoincrement=False,
+        default=ids.next_id,
     )
 
     text = db.Column(
@@ -213,7 +524,7 @@ class Message(db.Model):
     timestamp = db.Column(
         db.DateTime,
         nullable=False,
-        default=datetime.utcnow(),
+        default=datetime.utcnow,
     )
 
     user_id = db.Column(
@@ -222,8 +533,58 @@ class Message(db.Model):
         nullable=False,
     )
 
+    # Denormalized, written behind in batches (see like_counts.py)
+    like_count = db.Column(
+        db.Integer,
+        nullable=False,
+        default=0,
+        server_default='0',
+    )
+
     user = db.relationship('User', back_populates='messages', overlaps="user")
 
+    terms = db.relationship(
+        'MessageTerm',
+        cascade="all, delete-orphan",
+        passive_deletes=True,
+    )
+
+    @validates('text')
+    def index_text(self, key, text):
+        """Keep this message's entries in the full-text index current."""
+
+        wanted = message_terms(text or '')
+        kept = [t for t in self.terms if t.term in wanted]
+        added = wanted - {t.term for t in kept}
+        self.terms = kept + [MessageTerm(term=term) for term in added]
+
+        return text
+
+
+# A user's messages, newest first
+db.Index('ix_messages_user_id_id', Message.user_id, Message.id)
+
+# Usernames in lowercase byte order, so prefix searches are range scans
+db.Index('ix_users_username_lower',
+         db.func.lower(User.username).collate('C'), User.id)
+
+
+@event.listens_for(User, 'before_update')
+def stamp_names_changed(mapper, connection, user):
+    """Note when a user's username or email changes."""
+
+    state = db.inspect(user)
+    if (state.attrs.username.history.has_changes()
+            or state.attrs.email.history.has_changes()):
+        user.names_changed_at = db.func.now()
+
+
+@event.listens_for(Message.__table__, 'after_create')
+def create_partitions(target, connection, **kw):
+    """Give a newly created messages table its first partitions."""
+
+    partitions.ensure(connection)
+
 
 # def connect_db(app):
 #     """Connect this database to provided Flask app.
@@ -235,7 +596,11 @@ class Message(db.Model):
 #     db.init_app(app)
 
 def connect_db(app):
-    with app.app_context():
-        db.app = app
-        db.init_app(app)
-        db.create_all()
\ No newline at end of file
+    """Connect this database to provided Flask app.
+
+    The schema is created and kept current by `flask db-upgrade`
+    (see migrations/).
+    """
+
+    db.app = app
+    db.init_app(app)
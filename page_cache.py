@@ -0,0 +1,153 @@
+"""Whole-page cache for logged-out visitors.
+
+Pages such as the anonymous home page and a single message look the same
+to everyone who isn't logged in. A view decorated with `@page_cache.cached()`
+stores its rendered response, keyed by path, the first time a logged-out
+visitor asks for it, and serves the stored copy to every logged-out
+visitor after that for PAGE_CACHE_TTL seconds, without running the view
+or touching the database. Logged-in users (CURR_USER_KEY in the session)
+and visitors with flashed messages waiting always get a fresh render.
+
+Stored pages live in a pluggable backend: an in-process LRU by default,
+or Redis when PAGE_CACHE_URL is set (`pip install redis`), so that every
+worker shares one copy. Views that change cached pages call
+`invalidate(*paths)`, or `clear()` when they can't tell which pages;
+with the in-process backend the other workers keep their copies until
+they expire.
+"""
+
+import json
+from collections import namedtuple
+from functools import wraps
+
+from flask import g, make_response, request, session
+
+from cache import LRUCache
+
+
+CachedPage = namedtuple('CachedPage', ['status', 'content_type', 'etag', 'body'])
+
+
+class LRUBackend:
+    """Keeps pages in this process's memory."""
+
+    def __init__(self, max_entries, ttl):
+        self._pages = LRUCache(maxsize=max_entries, ttl=ttl)
+
+    def get(self, key):
+        return self._pages.get(key)
+
+    def set(self, key, page):
+        self._pages.set(key, page)
+
+    def delete(self, *keys):
+        for key in keys:
+            self._pages.pop(key)
+
+    def clear(self):
+        self._pages.clear()
+
+
+class RedisBackend:
+    """Keeps pages in Redis, shared by every worker."""
+
+    def __init__(self, url, ttl, prefix='warbler:page:'):
+        import redis
+
+        self._redis = redis.Redis.from_url(url)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, key):
+        raw = self._redis.get(self.prefix + key)
+        if raw is None:
+            return None
+
+        meta, body = raw.split(b'\n', 1)
+        return CachedPage(*json.loads(meta), body)
+
+    def set(self, key, page):
+        meta = json.dumps([page.status, page.content_type, page.etag])
+        self._redis.set(self.prefix + key,
+                        meta.encode('UTF-8') + b'\n' + page.body, ex=self.ttl)
+
+    def delete(self, *keys):
+        keys = [self.prefix + key for key in keys]
+        # In batches, so one DEL doesn't hold up Redis for long
+        for start in range(0, len(keys), 1000):
+            self._redis.delete(*keys[start:start + 1000])
+
+    def clear(self):
+        for key in self._redis.scan_iter(self.prefix + '*'):
+            self._redis.delete(key)
+
+
+class PageCache:
+    """Caches whole responses for logged-out visitors."""
+
+    def __init__(self, app=None, session_key='curr_user'):
+        self.session_key = session_key
+        self.backend = None
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('PAGE_CACHE_TTL', 60)
+        app.config.setdefault('PAGE_CACHE_MAX_ENTRIES', 10000)
+        app.config.setdefault('PAGE_CACHE_URL', None)
+
+        if app.config['PAGE_CACHE_URL']:
+            self.backend = RedisBackend(app.config['PAGE_CACHE_URL'],
+                                        app.config['PAGE_CACHE_TTL'])
+        else:
+            self.backend = LRUBackend(app.config['PAGE_CACHE_MAX_ENTRIES'],
+                                      app.config['PAGE_CACHE_TTL'])
+
+    def cacheable(self):
+        """Can this request be answered from, and stored in, the cache?"""
+
+        return (request.method in ('GET', 'HEAD')
+                and self.session_key not in session
+                and '_flashes' not in session)
+
+    def cached(self):
+        """Decorator: serve this view's logged-out responses from the cache."""
+
+        def decorator(view):
+            @wraps(view)
+            def wrapper(*args, **kwargs):
+                if not self.cacheable():
+                    return view(*args, **kwargs)
+
+                page = self.backend.get(request.path)
+                if page is not None:
+                    g.etag = page.etag
+                    if page.etag and request.if_none_match.contains_weak(page.etag):
+                        return make_response('', 304)
+                    response = make_response(page.body, page.status)
+                    response.content_type = page.content_type
+                    return response
+
+                response = make_response(view(*args, **kwargs))
+
+                # The view may have logged someone in or flashed a message
+                if (response.status_code == 200 and self.cacheable()
+                        and not response.is_streamed):
+                    self.backend.set(request.path, CachedPage(
+                        response.status_code, response.content_type,
+                        g.get('etag'), response.get_data()))
+
+                return response
+            return wrapper
+
+        return decorator
+
+    def invalidate(self, *paths):
+        """Forget the cached pages at `paths`."""
+
+        if paths:
+            self.backend.delete(*paths)
+
+    def clear(self):
+        self.backend.clear()
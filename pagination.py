@@ -0,0 +1,183 @@
+"""Keyset ("cursor") pagination for Warbler list pages.
+
+A page is fetched with a WHERE on its sort key instead of an OFFSET, so a
+deep page costs the same as the first one. Cursors are opaque, URL-safe
+strings holding the sort key of the first or last item on a page:
+
+- `?before=<cursor>` asks for the page of older items after that one
+- `?after=<cursor>` asks for the page of newer items before that one
+
+Lists are newest-first (descending) by default. Ranked lists such as
+search results can be ascending instead; "before" then still means
+further down the list.
+"""
+
+import base64
+import binascii
+import json
+from collections import namedtuple
+from datetime import datetime
+
+from flask import abort, current_app, request, url_for
+from sqlalchemy import tuple_
+
+from models import db
+
+
+# `before` is the cursor for the next (older) page and `after` the cursor
+# for the previous (newer) page; either is None when there is no such page.
+Page = namedtuple('Page', ['items', 'before', 'after'])
+
+
+def encode_cursor(values):
+    """Turn a tuple of sort-key values into an opaque cursor string."""
+
+    encoded = [{'dt': value.isoformat()} if isinstance(value, datetime)
+               else value
+               for value in values]
+    raw = json.dumps(encoded, separators=(',', ':')).encode('UTF-8')
+
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor, types=None):
+    """Turn a cursor string back into sort-key values; 400 if it's bogus.
+
+    With `types`, there must be one value of each type, in order (ints
+    within a bigint), e.g. not a cursor from before a list's sort key
+    changed.
+    """
+
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        encoded = json.loads(base64.urlsafe_b64decode(padded))
+        values = tuple(datetime.fromisoformat(value['dt'])
+                       if isinstance(value, dict) else value
+                       for value in encoded)
+    except (ValueError, TypeError, KeyError, binascii.Error):
+        abort(400)
+
+    if types is not None:
+        # Exact types: a bool is an int, but not a sort key
+        if (len(values) != len(types)
+                or any(type(value) is not kind for value, kind in zip(values, types))
+                or any(not -2**63 <= value < 2**63
+                       for value in values if type(value) is int)):
+            abort(400)
+
+    return values
+
+
+def cursors():
+    """The `before` / `after` cursors from the current request's query string."""
+
+    return {
+        'before': request.args.get('before'),
+        'after': request.args.get('after'),
+    }
+
+
+def page_url(**cursor):
+    """URL of the current page with its cursor swapped for `cursor`.
+
+    Used by templates/pagination.html; keeps any other query arguments.
+    """
+
+    args = request.args.to_dict()
+    args.pop('before', None)
+    args.pop('after', None)
+    args.update(cursor)
+
+    return url_for(request.endpoint, **request.view_args, **args)
+
+
+def per_page():
+    """How many items go on one page."""
+
+    return current_app.config['PAGE_SIZE']
+
+
+def keyset(stmt, keys, before=None, after=None, limit=None,
+           descending=True):
+    """Restrict `stmt` to one page of rows ordered by `keys`.
+
+    One extra row is fetched so the caller can tell whether there is
+    another page. Pages after an `after` cursor come back in reverse;
+    `page_of` puts them back in order.
+    """
+
+    limit = limit or per_page()
+    key = tuple_(*keys)
+
+    types = [key.type.python_type for key in keys]
+
+    def values_of(cursor):
+        return tuple_(*decode_cursor(cursor, types))
+
+    def further(cursor):
+        values = values_of(cursor)
+        return key < values if descending else key > values
+
+    def closer(cursor):
+        values = values_of(cursor)
+        return key > values if descending else key < values
+
+    if after:
+        stmt = (stmt
+                .where(closer(after))
+                .order_by(*(k.asc() if descending else k.desc()
+                            for k in keys)))
+    else:
+        if before:
+            stmt = stmt.where(further(before))
+        stmt = stmt.order_by(*(k.desc() if descending else k.asc()
+                               for k in keys))
+
+    return stmt.limit(limit + 1)
+
+
+def page_of(rows, key_of, before=None, after=None, limit=None):
+    """Build a Page out of the rows of a `keyset` query.
+
+    `key_of(row)` returns the sort-key values of a row, used for cursors.
+    """
+
+    limit = limit or per_page()
+    more = len(rows) > limit
+    rows = list(rows[:limit])
+
+    if after:
+        rows.reverse()
+
+    if not rows:
+        return Page([], None, None)
+
+    has_older = more if not after else True
+    has_newer = bool(before) or (bool(after) and more)
+
+    return Page(
+        rows,
+        encode_cursor(key_of(rows[-1])) if has_older else None,
+        encode_cursor(key_of(rows[0])) if has_newer else None,
+    )
+
+
+def paginate(stmt, keys, before=None, after=None, limit=None,
+             row_factory=lambda row: row[0], descending=True):
+    """Run `stmt` for one keyset page and return it as a Page.
+
+    `keys` are the columns that uniquely order the results, newest first
+    unless `descending` is False. Each result row is passed through
+    `row_factory` (by default, the first selected entity) to build the
+    page's items.
+    """
+
+    labels = [key.label(f'_cursor_{i}') for i, key in enumerate(keys)]
+    stmt = keyset(stmt.add_columns(*labels), keys, before, after, limit,
+                  descending)
+    rows = db.session.execute(stmt).all()
+
+    page = page_of(rows, lambda row: tuple(row[-len(keys):]),
+                   before, after, limit)
+
+    return page._replace(items=[row_factory(row) for row in page.items])
@@ -0,0 +1,124 @@
+"""Monthly range partitions of the messages table.
+
+`messages` is partitioned by RANGE (id). Message ids are time-ordered
+(see snowflake.py), so the partition for a month holds the ids from
+`first_id_at` the start of that month up to the start of the next: each
+partition is one month of messages, and queries that page by id only
+touch the months they reach. The oldest partition starts at MINVALUE and
+so also holds any messages from before snowflake ids.
+
+Inserts fail for a month that has no partition yet, so `ensure()` keeps
+partitions created a few months ahead. It runs when the app starts and
+from `flask archive-messages`; run that daily (or at least monthly) from
+cron. Creating a partition briefly locks the whole table, which is why
+it is done ahead of time, while the new partition is still empty.
+
+These functions take a Connection and run inside its transaction.
+"""
+
+import re
+from collections import namedtuple
+from datetime import datetime
+
+from sqlalchemy import text
+
+from snowflake import created_at, first_id_at
+
+
+# How many months past the current one get a partition in advance
+MONTHS_AHEAD = 2
+
+# Arbitrary key for pg_advisory_xact_lock, so workers starting at once
+# don't race to create the same partition
+LOCK_KEY = 0x70617274
+
+
+# Holds the ids from `low` (None for MINVALUE) up to, but not including, `high`
+Partition = namedtuple('Partition', ['name', 'low', 'high'])
+
+
+def month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def next_month(dt):
+    return datetime(dt.year + dt.month // 12, dt.month % 12 + 1, 1)
+
+
+def name_for(month):
+    """The name of the partition for the month `month` falls in."""
+
+    return f"messages_y{month.year}m{month.month:02d}"
+
+
+def _bound(value):
+    value = value.strip("'")
+    return None if value == 'MINVALUE' else int(value)
+
+
+def partitions(conn):
+    """The partitions of messages, oldest first."""
+
+    rows = conn.execute(text(
+        "SELECT child.relname, pg_get_expr(child.relpartbound, child.oid)"
+        " FROM pg_inherits"
+        " JOIN pg_class child ON child.oid = inhrelid"
+        " WHERE inhparent = 'messages'::regclass"))
+
+    found = []
+    for name, bound in rows:
+        match = re.fullmatch(r"FOR VALUES FROM \((.+)\) TO \((.+)\)", bound)
+        found.append(Partition(name, _bound(match[1]), _bound(match[2])))
+
+    return sorted(found, key=lambda partition: partition.high)
+
+
+def ensure(conn, now=None, months_ahead=MONTHS_AHEAD):
+    """Create the partitions missing between the newest one and
+    `months_ahead` months after `now`. Returns the ones created.
+
+    A table with no partitions gets one for the current month that starts
+    at MINVALUE.
+    """
+
+    now = now or datetime.utcnow()
+    conn.execute(text("SELECT pg_advisory_xact_lock(:key)"), {'key': LOCK_KEY})
+
+    until = month_start(now)
+    for _ in range(months_ahead + 1):
+        until = next_month(until)
+
+    existing = partitions(conn)
+    created = []
+    if existing:
+        month = created_at(existing[-1].high)
+    else:
+        month = next_month(month_start(now))
+        created.append(_create(conn, month_start(now), None, month))
+
+    while month < until:
+        created.append(_create(conn, month, first_id_at(month),
+                               next_month(month)))
+        month = next_month(month)
+
+    return created
+
+
+def _create(conn, month, low, end):
+    partition = Partition(name_for(month), low, first_id_at(end))
+    conn.execute(text(
+        f"CREATE TABLE {partition.name} PARTITION OF messages"
+        f" FOR VALUES FROM ({'MINVALUE' if low is None else low})"
+        f" TO ({partition.high})"))
+
+    return partition
+
+
+def drop(conn, partition):
+    """Detach a partition from messages and drop it.
+
+    Rows in other tables must no longer reference its messages.
+    """
+
+    conn.execute(text(f"ALTER TABLE messages DETACH PARTITION {partition.name}"))
+    conn.execute(text(f"DROP TABLE {partition.name}"))
@@ -0,0 +1,134 @@
+"""Password hashing on a bounded process pool.
+
+bcrypt is deliberately slow, so hashing a password inline ties up a web
+worker for the whole work factor. Here each hash or check is handed to a
+pool of BCRYPT_WORKERS processes, and at most BCRYPT_MAX_PENDING may be
+queued or running per web process. Past that, `PasswordHasher` raises
+HasherBusy, a 503 with Retry-After: a login burst is turned away early
+instead of occupying every worker and starving the rest of the site.
+
+The request thread still waits for its hash, so the pool only helps a
+web worker with other threads to serve requests meanwhile (WEB_THREADS
+> 1). Every web process starts its own pool, so BCRYPT_WORKERS defaults
+to 1: web processes times BCRYPT_WORKERS should stay within the CPUs.
+BCRYPT_WORKERS = 0 hashes on the calling thread, which suits single
+threaded workers, tests and scripts. If a pool process dies (say, the
+OOM killer picks it), the pool is replaced and the hash tried once more.
+
+BCRYPT_LOG_ROUNDS is the work factor for new hashes. `needs_rehash()`
+tells whether a stored hash was made with a different one, so it can be
+replaced the next time its owner logs in.
+"""
+
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+from werkzeug.exceptions import ServiceUnavailable
+
+
+class HasherBusy(ServiceUnavailable):
+    """Too many password hashes are already pending in this process."""
+
+    description = "Too many people are logging in right now; please try again."
+
+
+def _hash(password, rounds):
+    return bcrypt.hashpw(password.encode('UTF-8'),
+                         bcrypt.gensalt(rounds)).decode('UTF-8')
+
+
+def _check(hashed, password):
+    return bcrypt.checkpw(password.encode('UTF-8'), hashed.encode('UTF-8'))
+
+
+def hash_rounds(hashed):
+    """The work factor a bcrypt hash ("$2b$12$...") was made with."""
+
+    return int(hashed.split('$')[2])
+
+
+class PasswordHasher:
+    """Hashes and checks passwords on a bounded process pool."""
+
+    def __init__(self, app=None):
+        self.rounds = 12
+        self.workers = 0
+        self._slots = threading.BoundedSemaphore(1)
+        self._pool = None
+        self._pool_pid = None
+        self._lock = threading.Lock()
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('BCRYPT_LOG_ROUNDS', 12)
+        app.config.setdefault('BCRYPT_WORKERS', 1)
+        app.config.setdefault('BCRYPT_MAX_PENDING',
+                              4 * max(app.config['BCRYPT_WORKERS'], 1))
+
+        self.rounds = app.config['BCRYPT_LOG_ROUNDS']
+        self.workers = app.config['BCRYPT_WORKERS']
+        self._slots = threading.BoundedSemaphore(
+            app.config['BCRYPT_MAX_PENDING'])
+
+    def hash(self, password):
+        """A new hash of `password` at the configured work factor."""
+
+        return self._run(_hash, password, self.rounds)
+
+    def check(self, hashed, password):
+        """Does `password` match the stored `hashed` password?"""
+
+        return self._run(_check, hashed, password)
+
+    def needs_rehash(self, hashed):
+        """Was `hashed` made with a different work factor than the current one?"""
+
+        return hash_rounds(hashed) != self.rounds
+
+    def shutdown(self):
+        with self._lock:
+            if self._pool is not None:
+                self._pool.shutdown()
+                self._pool = None
+
+    def _run(self, fn, *args):
+        if not self._slots.acquire(blocking=False):
+            raise HasherBusy(retry_after=1)
+
+        try:
+            if not self.workers:
+                return fn(*args)
+
+            pool = self._executor()
+            try:
+                return pool.submit(fn, *args).result()
+            except BrokenProcessPool:
+                self._discard(pool)
+                return self._executor().submit(fn, *args).result()
+        finally:
+            self._slots.release()
+
+    def _discard(self, pool):
+        # Another thread may have replaced the broken pool already
+        with self._lock:
+            if self._pool is pool:
+                self._pool = None
+        pool.shutdown(wait=False)
+
+    def _executor(self):
+        # Each web worker starts its own pool, after gunicorn forks it
+        with self._lock:
+            if self._pool is None or self._pool_pid != os.getpid():
+                self._pool = ProcessPoolExecutor(
+                    self.workers, mp_context=multiprocessing.get_context('spawn'))
+                self._pool_pid = os.getpid()
+            return self._pool
+
+
+hasher = PasswordHasher()
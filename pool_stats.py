@@ -0,0 +1,122 @@
+"""Connection pool settings and metrics.
+
+`pool_stats.init_app(app)` gives every engine (the primary and each
+bind, e.g. read replicas) the same pool settings:
+
+    DB_POOL_SIZE      connections kept open per process
+    DB_MAX_OVERFLOW   extra connections opened when those are all in use
+    DB_POOL_TIMEOUT   seconds to wait for a connection before failing
+    DB_POOL_RECYCLE   seconds after which a connection is reopened
+    DB_POOL_PRE_PING  test each connection as it is checked out
+
+Every checkout is timed, including opening a new connection when the
+pool has room, and exported at GET /metrics with the pool's current
+connections in use, idle and overflow. Waits that grow while "in use"
+sits at DB_POOL_SIZE + DB_MAX_OVERFLOW mean the pool is saturated:
+requests are queueing for connections, not for the database.
+"""
+
+import time
+import weakref
+
+from sqlalchemy.exc import TimeoutError
+from sqlalchemy.pool import QueuePool
+
+from metrics import metrics
+
+
+WAIT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                0.5, 1, 2.5, 5)
+
+
+class InstrumentedQueuePool(QueuePool):
+    """A QueuePool that reports its checkouts to `pool_stats`."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.name = self.logging_name or 'primary'
+        pool_stats.pools[self.name] = self
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except TimeoutError:
+            pool_stats.timeouts.inc(self.name)
+            raise
+        finally:
+            pool_stats.checkout_seconds.observe(
+                time.perf_counter() - started, self.name)
+
+
+class PoolStats:
+    """Configures every engine's pool and exports how busy it is."""
+
+    def __init__(self, app=None, registry=metrics):
+        # The live pool of each engine, by bind name
+        self.pools = weakref.WeakValueDictionary()
+
+        self.checkout_seconds = registry.histogram(
+            'warbler_db_pool_checkout_seconds',
+            "Time spent getting a connection from the pool.",
+            WAIT_BUCKETS, labels=('pool',))
+        self.timeouts = registry.counter(
+            'warbler_db_pool_timeouts_total',
+            "Checkouts that gave up after DB_POOL_TIMEOUT seconds.",
+            labels=('pool',))
+        registry.gauge(
+            'warbler_db_pool_in_use',
+            "Connections checked out of the pool.",
+            lambda: self.collect(lambda pool: pool.checkedout()),
+            labels=('pool',))
+        registry.gauge(
+            'warbler_db_pool_idle',
+            "Open connections waiting in the pool.",
+            lambda: self.collect(lambda pool: pool.checkedin()),
+            labels=('pool',))
+        registry.gauge(
+            'warbler_db_pool_overflow',
+            "Connections open beyond DB_POOL_SIZE.",
+            lambda: self.collect(lambda pool: max(pool.overflow(), 0)),
+            labels=('pool',))
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Set up the pools; must run after the binds are configured and
+        before `db.init_app(app)`."""
+
+        app.config.setdefault('DB_POOL_SIZE', 5)
+        app.config.setdefault('DB_MAX_OVERFLOW', 2)
+        app.config.setdefault('DB_POOL_TIMEOUT', 5)
+        app.config.setdefault('DB_POOL_RECYCLE', 1800)
+        app.config.setdefault('DB_POOL_PRE_PING', True)
+
+        options = {
+            'poolclass': InstrumentedQueuePool,
+            'pool_size': app.config['DB_POOL_SIZE'],
+            'max_overflow': app.config['DB_MAX_OVERFLOW'],
+            'pool_timeout': app.config['DB_POOL_TIMEOUT'],
+            'pool_recycle': app.config['DB_POOL_RECYCLE'],
+            'pool_pre_ping': app.config['DB_POOL_PRE_PING'],
+        }
+
+        engine_options = app.config.setdefault('SQLALCHEMY_ENGINE_OPTIONS', {})
+        for option, value in options.items():
+            engine_options.setdefault(option, value)
+
+        # Binds don't get SQLALCHEMY_ENGINE_OPTIONS, so each needs its own
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        for name, bind in binds.items():
+            if not isinstance(bind, dict):
+                bind = binds[name] = {'url': bind}
+            for option, value in options.items():
+                bind.setdefault(option, value)
+            bind.setdefault('pool_logging_name', name)
+
+    def collect(self, measure):
+        return {(name,): measure(pool) for name, pool in list(self.pools.items())}
+
+
+pool_stats = PoolStats()
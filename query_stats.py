@@ -0,0 +1,151 @@
+"""Per-request database query statistics.
+
+Every SQL statement run while handling a request is counted and timed
+through SQLAlchemy's cursor events. When the request finishes, its
+query count and total database time go into per-endpoint histograms
+(see metrics.py, served at GET /metrics), along with the total time the
+request took.
+
+A request that runs the same statement QUERY_STATS_N_PLUS_ONE or more
+times, typically a lazy load inside a template loop, is counted as a
+suspected N+1 and logged as a warning with the statement. So is a
+request whose queries take longer than QUERY_STATS_SLOW_MS in total,
+together with its slowest statement.
+
+Recording a query costs two clock reads and a dict update, which is
+cheap enough to leave on in production.
+"""
+
+import time
+from collections import Counter
+
+from flask import g, has_app_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from metrics import metrics
+
+
+QUERY_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+SECONDS_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25,
+                   0.5, 1, 2.5)
+
+
+class RequestQueries:
+    """The statements one request has run."""
+
+    def __init__(self):
+        self.count = 0
+        self.seconds = 0.0
+        self.slowest = None
+        self.slowest_seconds = 0.0
+        self.statements = Counter()
+
+    def record(self, statement, seconds):
+        self.count += 1
+        self.seconds += seconds
+        self.statements[statement] += 1
+        if seconds > self.slowest_seconds:
+            self.slowest = statement
+            self.slowest_seconds = seconds
+
+    def repeated(self, threshold):
+        """(statement, times run) for statements run `threshold`+ times."""
+
+        return [(statement, count)
+                for statement, count in self.statements.most_common()
+                if count >= threshold]
+
+
+class QueryStats:
+    """Times every request's queries and exports them as metrics."""
+
+    def __init__(self, app=None, registry=metrics):
+        self.app = None
+        self.queries = registry.histogram(
+            'warbler_request_queries',
+            "SQL statements run per request.",
+            QUERY_BUCKETS, labels=('endpoint',))
+        self.db_seconds = registry.histogram(
+            'warbler_request_db_seconds',
+            "Time per request spent running SQL statements.",
+            SECONDS_BUCKETS, labels=('endpoint',))
+        self.request_seconds = registry.histogram(
+            'warbler_request_seconds',
+            "Time from the start of a request until its response was ready.",
+            SECONDS_BUCKETS, labels=('endpoint',))
+        self.n_plus_one = registry.counter(
+            'warbler_n_plus_one_requests_total',
+            "Requests that ran one statement QUERY_STATS_N_PLUS_ONE+ times.",
+            labels=('endpoint',))
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        app.config.setdefault('QUERY_STATS_N_PLUS_ONE', 5)
+        app.config.setdefault('QUERY_STATS_SLOW_MS', 100)
+        self.app = app
+
+        event.listen(Engine, 'before_cursor_execute', self.before_execute)
+        event.listen(Engine, 'after_cursor_execute', self.after_execute)
+        event.listen(Engine, 'handle_error', self.execute_failed)
+
+        app.before_request(self.start_request)
+        app.after_request(self.finish_request)
+
+    def current(self):
+        """This request's RequestQueries, or None outside a request."""
+
+        return g.get('queries') if has_app_context() else None
+
+    def before_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        if self.current() is not None:
+            conn.info.setdefault('query_started', []).append(time.perf_counter())
+
+    def after_execute(self, conn, cursor, statement, parameters, context,
+                      executemany):
+        queries = self.current()
+        started = conn.info.get('query_started')
+        if queries is not None and started:
+            queries.record(statement, time.perf_counter() - started.pop())
+
+    def execute_failed(self, context):
+        started = context.connection and context.connection.info.get('query_started')
+        if started:
+            started.pop()
+
+    def start_request(self):
+        g.queries = RequestQueries()
+        g.request_started = time.perf_counter()
+
+    def finish_request(self, response):
+        queries = g.pop('queries', None)
+        if queries is None:
+            return response
+
+        endpoint = request.endpoint or 'unmatched'
+        self.queries.observe(queries.count, endpoint)
+        self.db_seconds.observe(queries.seconds, endpoint)
+        self.request_seconds.observe(time.perf_counter() - g.request_started,
+                                     endpoint)
+
+        logger = self.app.logger
+        repeated = queries.repeated(self.app.config['QUERY_STATS_N_PLUS_ONE'])
+        if repeated:
+            self.n_plus_one.inc(endpoint)
+            statement, count = repeated[0]
+            logger.warning("Possible N+1 in %s: ran %d times: %s",
+                           endpoint, count, statement)
+
+        if queries.seconds * 1000 > self.app.config['QUERY_STATS_SLOW_MS']:
+            logger.warning("Slow queries in %s: %d took %.1f ms; slowest "
+                           "(%.1f ms): %s", endpoint, queries.count,
+                           queries.seconds * 1000,
+                           queries.slowest_seconds * 1000, queries.slowest)
+        else:
+            logger.debug("%s: %d queries in %.1f ms", endpoint,
+                         queries.count, queries.seconds * 1000)
+
+        return response
@@ -0,0 +1,40 @@
+"""Lightweight read models for rendering lists of messages.
+
+List pages only need a handful of columns from a message and its author.
+Fetching them with one joined Core query into small named tuples avoids a
+lazy `msg.user` load per message and never builds full User objects
+(password hash and all) just to print a username.
+"""
+
+from collections import namedtuple
+
+from sqlalchemy import select
+
+from models import Message, User
+
+
+class MessageRow(namedtuple('MessageRow', [
+        'id', 'text', 'timestamp', 'user_id', 'username', 'image_url',
+        'like_count'])):
+    """One message plus the author fields the templates show."""
+
+    __slots__ = ()
+
+
+def select_message_rows():
+    """Select the columns of a MessageRow: messages joined to their authors."""
+
+    return (select(Message.id,
+                   Message.text,
+                   Message.timestamp,
+                   Message.user_id,
+                   User.username,
+                   User.image_url,
+                   Message.like_count)
+            .join(User, User.id == Message.user_id))
+
+
+def to_message_row(row):
+    """Build a MessageRow from the leading columns of a result row."""
+
+    return MessageRow._make(row[:len(MessageRow._fields)])
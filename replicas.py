@@ -0,0 +1,255 @@
+"""Read replica routing.
+
+SQLALCHEMY_REPLICA_URIS (DATABASE_REPLICA_URLS, comma separated) names
+any number of Postgres streaming replicas of the primary database. Each
+becomes a Flask-SQLAlchemy bind, 'replica0', 'replica1' and so on, and
+`db.session` (a RoutingSession) sends the statements of a GET or HEAD
+request to one healthy replica, picked at random per request.
+
+Everything else uses the primary: other methods, CLI commands, and any
+statement that writes (INSERT/UPDATE/DELETE, SELECT ... FOR UPDATE).
+Once a request has written, the rest of it reads from the primary too.
+
+So that users read their own writes, a request that wrote stores a
+deadline REPLICA_STICKY_SECONDS ahead in the user's session; until it
+passes, their GETs read from the primary as well. The redirect after
+posting a message, for example, shows the new message. The deadline
+must outlast the lag a replica is allowed, so REPLICA_STICKY_SECONDS
+defaults to REPLICA_MAX_LAG_SECONDS plus the time between checks, and
+may not be set below REPLICA_MAX_LAG_SECONDS.
+
+Reads that refill a cache which writes invalidate (the logged-in user's
+snapshot, the typeahead index...) go inside `with use_primary():`, so a
+lagging replica can't put back rows from before the write.
+
+Each replica is checked at most every REPLICA_CHECK_SECONDS, by the
+first request that finds the check due. A replica is used only if it
+answers within REPLICA_CONNECT_TIMEOUT seconds and has replayed the
+primary's changes to within REPLICA_MAX_LAG_SECONDS; one that isn't
+receiving WAL from the primary counts as lagging by the age of the last
+change it replayed. A replica whose
+connection breaks mid-request is taken out of use until its next check.
+With no healthy replica, reads go to the primary.
+"""
+
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from flask import current_app, g, has_app_context, request, session
+from flask_sqlalchemy.session import Session
+from sqlalchemy import event, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.sql.elements import TextClause
+
+from metrics import metrics
+
+
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+
+# Where a user's read-from-primary deadline is kept
+SESSION_KEY = '_primary_until'
+
+# Seconds the replica is behind: 0 if it is streaming from the primary and
+# has replayed all it received, else the age of the last change replayed
+# (NULL if it hasn't replayed any since it started)
+LAG_SQL = text(
+    "SELECT CASE WHEN NOT pg_is_in_recovery() THEN 0"
+    " WHEN pg_last_wal_receive_lsn() = pg_last_wal_replay_lsn()"
+    " AND EXISTS (SELECT FROM pg_stat_wal_receiver) THEN 0"
+    " ELSE extract(epoch FROM now() - pg_last_xact_replay_timestamp()) END")
+
+
+def is_write(clause):
+    """Could running this statement change the database?"""
+
+    if clause is None:
+        return False
+    if isinstance(clause, TextClause):
+        return not clause.text.lstrip().upper().startswith('SELECT')
+
+    return (getattr(clause, 'is_dml', False)
+            or getattr(clause, '_for_update_arg', None) is not None)
+
+
+@contextmanager
+def use_primary():
+    """Read from the primary inside this block, even in a replica request."""
+
+    replica = g.pop('db_replica', None) if has_app_context() else None
+    try:
+        yield
+    finally:
+        if replica and not g.get('db_wrote'):
+            g.db_replica = replica
+
+
+class RoutingSession(Session):
+    """A Flask-SQLAlchemy session that reads from the request's replica."""
+
+    def get_bind(self, mapper=None, clause=None, bind=None, **kwargs):
+        if bind is None and has_app_context():
+            if self._flushing or is_write(clause):
+                g.db_wrote = True
+                g.db_replica = None
+            elif g.get('db_replica'):
+                return self._db.engines[g.db_replica]
+
+        return super().get_bind(mapper=mapper, clause=clause, bind=bind, **kwargs)
+
+
+class Replica:
+    """What the last health check found out about one replica."""
+
+    def __init__(self, name):
+        self.name = name
+        self.healthy = False
+        self.lag = None
+        self.checked_at = None
+        self.checking = threading.Lock()
+
+
+class ReplicaRouter:
+    """Picks a replica for each read-only request."""
+
+    def __init__(self, app=None, registry=metrics):
+        self.app = None
+        self.replicas = {}
+
+        registry.gauge(
+            'warbler_replica_healthy',
+            "Whether each read replica is in use (1) or not (0).",
+            lambda: {(r.name,): int(r.healthy) for r in self.replicas.values()},
+            labels=('replica',))
+        registry.gauge(
+            'warbler_replica_lag_seconds',
+            "How far behind the primary each replica was when last checked.",
+            lambda: {(r.name,): r.lag for r in self.replicas.values()
+                     if r.lag is not None},
+            labels=('replica',))
+        self.routed = registry.counter(
+            'warbler_db_routed_requests_total',
+            "Requests by the database they read from.",
+            labels=('database',))
+
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        """Add a bind per replica; must run before `db.init_app(app)`."""
+
+        app.config.setdefault('SQLALCHEMY_REPLICA_URIS', [])
+        app.config.setdefault('REPLICA_CHECK_SECONDS', 5)
+        app.config.setdefault('REPLICA_MAX_LAG_SECONDS', 10)
+        app.config.setdefault('REPLICA_CONNECT_TIMEOUT', 2)
+        # A replica may fall further behind between two checks
+        app.config.setdefault('REPLICA_STICKY_SECONDS',
+                              app.config['REPLICA_MAX_LAG_SECONDS']
+                              + app.config['REPLICA_CHECK_SECONDS'])
+        self.app = app
+
+        if (app.config['REPLICA_STICKY_SECONDS']
+                < app.config['REPLICA_MAX_LAG_SECONDS']):
+            raise ValueError("REPLICA_STICKY_SECONDS must be at least "
+                             "REPLICA_MAX_LAG_SECONDS, or users may not "
+                             "see their own writes")
+
+        binds = app.config.setdefault('SQLALCHEMY_BINDS', {})
+        for number, url in enumerate(app.config['SQLALCHEMY_REPLICA_URIS']):
+            name = f'replica{number}'
+            binds[name] = {
+                'url': url,
+                'connect_args': {
+                    'connect_timeout': app.config['REPLICA_CONNECT_TIMEOUT']},
+            }
+            self.replicas[name] = Replica(name)
+
+        event.listen(Engine, 'handle_error', self.connection_failed)
+
+        app.before_request(self.route_request)
+        app.after_request(self.stick_to_primary)
+
+    def route_request(self):
+        """Pick the replica this request reads from, if it may use one."""
+
+        g.db_replica = None
+        g.db_wrote = False
+        if (self.replicas
+                and request.method in SAFE_METHODS
+                and session.get(SESSION_KEY, 0) <= time.time()):
+            g.db_replica = self.pick()
+
+        self.routed.inc(g.db_replica or 'primary')
+
+    def stick_to_primary(self, response):
+        """Send this user's reads to the primary for a while if we wrote."""
+
+        if self.replicas and g.get('db_wrote'):
+            session[SESSION_KEY] = (
+                time.time() + self.app.config['REPLICA_STICKY_SECONDS'])
+
+        return response
+
+    def pick(self):
+        """The name of a healthy replica, or None if there is none."""
+
+        for replica in self.replicas.values():
+            self.check_if_due(replica)
+
+        healthy = [name for name, replica in self.replicas.items()
+                   if replica.healthy]
+
+        return random.choice(healthy) if healthy else None
+
+    def check_if_due(self, replica):
+        """Check the replica unless it was checked recently or another
+        thread is checking it now."""
+
+        interval = self.app.config['REPLICA_CHECK_SECONDS']
+        if (replica.checked_at is not None
+                and time.monotonic() - replica.checked_at < interval):
+            return
+
+        if replica.checking.acquire(blocking=False):
+            try:
+                self.check(replica)
+            finally:
+                replica.checking.release()
+
+    def check(self, replica):
+        """See whether the replica is up and caught up."""
+
+        engine = current_app.extensions['sqlalchemy'].engines[replica.name]
+        try:
+            with engine.connect() as conn:
+                lag = conn.execute(LAG_SQL).scalar()
+        except SQLAlchemyError as e:
+            healthy, lag = False, None
+            if replica.healthy or replica.checked_at is None:
+                current_app.logger.warning("Read replica %s is down: %s",
+                                           replica.name, e)
+        else:
+            lag = None if lag is None else float(lag)
+            healthy = (lag is not None
+                       and lag <= current_app.config['REPLICA_MAX_LAG_SECONDS'])
+            if not healthy and replica.healthy:
+                current_app.logger.warning("Read replica %s is behind (%s s)",
+                                           replica.name, lag)
+
+        replica.healthy, replica.lag = healthy, lag
+        replica.checked_at = time.monotonic()
+
+    def connection_failed(self, context):
+        """Stop using a replica whose connection just broke."""
+
+        if not (context.is_disconnect and has_app_context()):
+            return
+
+        engines = current_app.extensions['sqlalchemy'].engines
+        for name, replica in self.replicas.items():
+            if engines.get(name) is context.engine:
+                replica.healthy = False
+                replica.checked_at = time.monotonic()
+                current_app.logger.warning("Lost read replica %s", name)
@@ -0,0 +1,147 @@
+"""Username and message search over inverted indexes.
+
+`username_grams` maps every trigram of every username to the users that
+contain it. The User model keeps a user's rows in step with their username
+(see `User.index_username`), so signup, profile edits and deletes update
+the index in the same transaction.
+
+Prefix matches are listed first, read in order off an index of the
+lowercased usernames (an exact match sorts ahead of the rest), so a
+query only touches as many users as fit on the page. Only if the page
+isn't full yet does it go on to the other matches: the users holding all
+of the query's trigrams, less the prefix matches, with a substring check
+weeding out the rare false positive.
+
+Messages are indexed by word in `message_terms`, kept current by
+`Message.index_text`. Each term's posting list is read newest-first off
+the table's primary key. An AND query walks the posting list of its
+longest (usually rarest) term and keeps the message ids that also appear
+in every other term's list, stopping once a page is full, so it never
+scans `messages`; only the page's own rows are joined in for display.
+"""
+
+from flask import abort
+from sqlalchemy import delete, exists, func, insert, literal, select, tuple_
+from sqlalchemy.orm import aliased
+
+from models import (db, Message, MessageTerm, User, UsernameGram,
+                    message_terms, username_grams)
+from pagination import Page, decode_cursor, page_of, paginate, per_page
+from read_models import select_message_rows, to_message_row
+
+
+# What usernames are searched and sorted by; ix_users_username_lower
+NAME = func.lower(User.username).collate('C')
+
+
+def query_grams(q):
+    """The trigrams a username must contain to match the query `q`."""
+
+    q = q.lower()
+    return {q[i:i + 3] for i in range(len(q) - 2)}
+
+
+def search_users(q, before=None, after=None, limit=None):
+    """Return a keyset Page of the users whose username contains `q`.
+
+    Users are listed in tiers, prefix matches first, and each tier is
+    read in index order only until the page is full. Cursors hold the
+    tier along with the lowercased username and id.
+    """
+
+    limit = limit or per_page()
+    q = q.lower()
+    prefix = NAME.startswith(q, autoescape=True)
+
+    tiers = [select(User).where(prefix)]
+    # Shorter queries match no trigrams, so can only be prefixes
+    if len(q) >= 3:
+        grams = query_grams(q)
+        candidates = (select(UsernameGram.user_id)
+                      .where(UsernameGram.gram.in_(grams))
+                      .group_by(UsernameGram.user_id)
+                      .having(func.count() == len(grams)))
+        tiers.append(select(User).where(User.id.in_(candidates), ~prefix,
+                                        NAME.contains(q, autoescape=True)))
+
+    start, position = 0, None
+    if after or before:
+        cursor = decode_cursor(after or before, (int, str, int))
+        if cursor[0] not in range(len(tiers)):
+            abort(400)
+        start, position = cursor[0], tuple_(*cursor[1:])
+    key = tuple_(NAME, User.id)
+
+    # Going back from an `after` cursor walks the tiers in reverse
+    order = range(start, -1, -1) if after else range(start, len(tiers))
+    rows = []
+    for tier in order:
+        stmt = tiers[tier].add_columns(literal(tier), NAME, User.id)
+        if tier == start and position is not None:
+            stmt = stmt.where(key < position if after else key > position)
+        stmt = stmt.order_by(*(NAME.desc(), User.id.desc()) if after
+                             else (NAME, User.id))
+
+        rows += db.session.execute(stmt.limit(limit + 1 - len(rows))).all()
+        if len(rows) > limit:
+            break
+
+    page = page_of(rows, lambda row: tuple(row[1:]), before, after, limit)
+    return page._replace(items=[row[0] for row in page.items])
+
+
+def reindex_users(batch_size=1000):
+    """Rebuild the whole username index from the users table."""
+
+    db.session.execute(delete(UsernameGram))
+
+    users = db.session.execute(
+        select(User.id, User.username).execution_options(yield_per=batch_size))
+
+    for batch in users.partitions():
+        rows = [{'gram': gram, 'user_id': user_id}
+                for user_id, username in batch
+                for gram in username_grams(username)]
+        if rows:
+            db.session.execute(insert(UsernameGram), rows)
+
+    db.session.commit()
+
+
+def search_messages(q, before=None, after=None, limit=None):
+    """Return a keyset Page of MessageRows containing every word of `q`."""
+
+    terms = sorted(message_terms(q), key=lambda term: (-len(term), term))
+    if not terms:
+        return Page([], None, None)
+
+    hits = aliased(MessageTerm)
+    stmt = (select_message_rows()
+            .join(hits, hits.message_id == Message.id)
+            .where(hits.term == terms[0]))
+
+    for term in terms[1:]:
+        other = aliased(MessageTerm)
+        stmt = stmt.where(exists().where(other.term == term,
+                                         other.message_id == hits.message_id))
+
+    return paginate(stmt, (hits.message_id,), before, after, limit,
+                    row_factory=to_message_row)
+
+
+def reindex_messages(batch_size=1000):
+    """Rebuild the whole full-text index from the messages table."""
+
+    db.session.execute(delete(MessageTerm))
+
+    messages = db.session.execute(
+        select(Message.id, Message.text).execution_options(yield_per=batch_size))
+
+    for batch in messages.partitions():
+        rows = [{'term': term, 'message_id': message_id}
+                for message_id, text in batch
+                for term in message_terms(text)]
+        if rows:
+            db.session.execute(insert(MessageTerm), rows)
+
+    db.session.commit()
@@ -28,24 +28,44 @@
 from csv import DictReader
 from app import app
 from models import User, Message, Follows
+import counters
+import like_counts
+import migrations
+import search
+import timelines
 
 
 def seed(db):
     with db.app.app_context():
-        db.drop_all()
-        db.create_all()
+        # Only the primary; replicas follow it
+        db.drop_all(bind_key=None)
+        migrations.clear_history(db.engine)
+        migrations.upgrade(db.engine)
 
         with open('generator/users.csv') as users:
             db.session.bulk_insert_mappings(User, DictReader(users))
 
+        # Message ids are handed out in insert order, which must be the
+        # order the messages were posted in
         with open('generator/messages.csv') as messages:
-            db.session.bulk_insert_mappings(Message, DictReader(messages))
+            db.session.bulk_insert_mappings(
+                Message, sorted(DictReader(messages),
+                                key=lambda row: row['timestamp']))
 
         with open('generator/follows.csv') as follows:
             db.session.bulk_insert_mappings(Follows, DictReader(follows))
 
         db.session.commit()
 
+        # Bulk inserts skip the counters, the fan-out and the search
+        # indexes, so build them afterwards
+        counters.reconcile()
+        like_counts.recount()
+        db.session.commit()
+        timelines.rebuild_all()
+        search.reindex_users()
+        search.reindex_messages()
+
         print("Database seeded!")
 
 if __name__ == '__main__':
@@ -0,0 +1,127 @@
+"""Time-ordered 64-bit ids ("snowflakes") for Warbler's messages.
+
+An id packs, from the most significant bit down:
+
+    41 bits  milliseconds since EPOCH (good for ~69 years)
+    10 bits  worker id, unique among the processes creating ids
+    12 bits  sequence number within the millisecond
+
+so ids sort by creation time, and a process can make up to 4096 a
+millisecond without asking the database. Ids from different workers
+created in the same millisecond are ordered by worker id; that is the
+only way two ids can sort out of creation order.
+
+Every process that creates messages needs its own worker id. The id is
+split into a machine (SNOWFLAKE_NODE_ID) and a slot on it. Under
+gunicorn, gunicorn.conf.py hands each worker a free slot when it is
+forked, but never OFFLINE_SLOT: other processes (CLI commands, scripts)
+default to that one, so they can't collide with a running worker. Two
+such processes making messages at once on one machine need their own
+SNOWFLAKE_WORKER_IDs.
+
+If the system clock steps backwards, ids keep counting from the last
+millisecond used, so they never repeat or go backwards. A millisecond
+whose sequence numbers run out borrows the next one rather than waiting
+for the clock, so ids can run a little ahead of it (by 1 ms per 4096
+ids beyond what the clock allows) but making one never blocks; after a
+backward step, that holds until the clock catches up.
+"""
+
+import threading
+import time
+from datetime import datetime, timedelta
+
+
+# 2024-01-01 00:00:00 UTC, in milliseconds since the Unix epoch
+EPOCH = 1704067200000
+
+WORKER_BITS = 10
+SEQUENCE_BITS = 12
+
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+# The low 5 bits of a worker id pick the slot on a machine...
+SLOT_BITS = 5
+# ...and the one slot gunicorn leaves free is for everything else
+OFFLINE_SLOT = (1 << SLOT_BITS) - 1
+
+
+def worker_id_for(node_id, slot):
+    """The worker id of `slot` on machine `node_id`."""
+
+    if not 0 <= node_id < 1 << (WORKER_BITS - SLOT_BITS):
+        raise ValueError(
+            f"Node id must be below {1 << (WORKER_BITS - SLOT_BITS)}")
+    return (node_id << SLOT_BITS) | slot
+
+
+def millis_of(dt):
+    """`dt`, a naive UTC datetime, in milliseconds since EPOCH."""
+
+    return (dt - datetime(1970, 1, 1)) // timedelta(milliseconds=1) - EPOCH
+
+
+def first_id_at(dt):
+    """The smallest id that can be made at or after `dt` (naive UTC)."""
+
+    return max(millis_of(dt), 0) << (WORKER_BITS + SEQUENCE_BITS)
+
+
+def created_at(id):
+    """When the id was made, as a naive UTC datetime (to the millisecond)."""
+
+    millis = (id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH
+    return datetime(1970, 1, 1) + timedelta(milliseconds=millis)
+
+
+class IdGenerator:
+    """Makes snowflake ids for one worker."""
+
+    def __init__(self, worker_id=0, clock=time.time):
+        self.worker_id = worker_id
+        self.clock = clock
+        self._last = -1
+        self._sequence = 0
+        self._lock = threading.Lock()
+
+    def init_app(self, app):
+        app.config.setdefault('SNOWFLAKE_WORKER_ID',
+                              worker_id_for(0, OFFLINE_SLOT))
+        self.worker_id = app.config['SNOWFLAKE_WORKER_ID']
+
+    @property
+    def worker_id(self):
+        return self._worker_id
+
+    @worker_id.setter
+    def worker_id(self, worker_id):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"Worker id must be between 0 and {MAX_WORKER_ID}")
+        self._worker_id = worker_id
+
+    def _now(self):
+        return int(self.clock() * 1000) - EPOCH
+
+    def next_id(self):
+        """A new id, greater than every id this generator made before."""
+
+        with self._lock:
+            now = max(self._now(), self._last)
+
+            if now == self._last:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    # This millisecond is used up; borrow the next one
+                    now = self._last + 1
+            else:
+                self._sequence = 0
+
+            self._last = now
+
+            return ((now << (WORKER_BITS + SEQUENCE_BITS))
+                    | (self._worker_id << SEQUENCE_BITS)
+                    | self._sequence)
+
+
+ids = IdGenerator()
@@ -0,0 +1,277 @@
+"""Message partition and archive tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_archive.py
+
+
+from app import app, current_users, message_archive, page_cache, CURR_USER_KEY
+import os
+import tempfile
+from datetime import datetime
+from pathlib import Path
+from unittest import TestCase
+
+from sqlalchemy import select, text
+
+from archive import Segment, write_segment
+from models import db, Likes, Message, MessageTerm, TimelineEntry, User
+import counters
+import partitions
+from snowflake import first_id_at
+import timelines
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class SegmentTestCase(TestCase):
+    """Test reading and writing segment files."""
+
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.path = Path(self.folder.name, 'messages.seg')
+
+    def tearDown(self):
+        self.folder.cleanup()
+
+    def test_find(self):
+        when = datetime(2025, 1, 2, 3, 4, 5)
+        rows = [(id, f"warble {id}", when, id % 7, id % 3)
+                for id in range(1000, 3000, 2)]
+        write_segment(self.path, 1000, 3000, rows, block_rows=50)
+
+        segment = Segment(self.path)
+        self.assertEqual(len(segment), 20)
+        for id in (1000, 1002, 1098, 1100, 2998):
+            found = segment.find(id)
+            self.assertEqual(found[:5], (id, f"warble {id}", when, id % 7, id % 3))
+
+        self.assertIsNone(segment.find(1001))
+        self.assertIsNone(segment.find(999))
+        self.assertIsNone(segment.find(3000))
+
+    def test_empty(self):
+        write_segment(self.path, None, 3000, [])
+
+        segment = Segment(self.path)
+        self.assertEqual(len(segment), 0)
+        self.assertTrue(segment.covers(-5))
+        self.assertIsNone(segment.find(5))
+
+    def test_not_a_segment(self):
+        self.path.write_bytes(b'x' * 100)
+
+        with self.assertRaises(ValueError):
+            Segment(self.path)
+
+
+class PartitionTestCase(TestCase):
+    """Test creating message partitions."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_ensure(self):
+        with db.engine.begin() as conn:
+            for partition in partitions.partitions(conn):
+                partitions.drop(conn, partition)
+
+            created = partitions.ensure(conn, now=datetime(2025, 11, 20))
+            self.assertEqual([p.name for p in created], [
+                'messages_y2025m11', 'messages_y2025m12', 'messages_y2026m01'])
+            self.assertIsNone(created[0].low)
+            self.assertEqual(created[0].high, first_id_at(datetime(2025, 12, 1)))
+            self.assertEqual(created[2].low, first_id_at(datetime(2026, 1, 1)))
+
+            self.assertEqual(partitions.ensure(conn, now=datetime(2025, 11, 30)), [])
+            self.assertEqual(
+                [p.name for p in partitions.ensure(conn, now=datetime(2025, 12, 1))],
+                ['messages_y2026m02'])
+
+            self.assertEqual([p.name for p in partitions.partitions(conn)], [
+                'messages_y2025m11', 'messages_y2025m12', 'messages_y2026m01',
+                'messages_y2026m02'])
+
+    def test_new_messages_have_a_partition(self):
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.flush()
+        msg = Message(text="hello", user_id=user.id)
+        db.session.add(msg)
+        db.session.commit()
+
+        where = db.session.execute(text(
+            "SELECT tableoid::regclass::text FROM messages")).scalar()
+        self.assertEqual(where, partitions.name_for(datetime.utcnow()))
+
+
+class ArchiveTestCase(TestCase):
+    """Test archiving old months of messages."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        # Partitions from January 2025 on
+        with db.engine.begin() as conn:
+            for partition in partitions.partitions(conn):
+                partitions.drop(conn, partition)
+            partitions.ensure(conn, now=datetime(2025, 1, 15))
+            partitions.ensure(conn)
+
+        robin = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        tuck = User.signup("tuck", "tuck@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.flush()
+        self.robin_id, self.tuck_id = robin.id, tuck.id
+
+        def posted(when, text):
+            return Message(id=first_id_at(when) + 1, timestamp=when,
+                           text=text, user_id=robin.id)
+
+        self.old = posted(datetime(2025, 1, 10), "archery at dawn")
+        self.kept = posted(datetime(2025, 3, 10), "archery at noon")
+        self.new = Message(text="archery at dusk", user_id=robin.id)
+        db.session.add_all([self.old, self.kept, self.new])
+        db.session.flush()
+        db.session.add_all([Likes(user_id=tuck.id, message_id=self.old.id),
+                            Likes(user_id=tuck.id, message_id=self.kept.id)])
+        db.session.flush()
+        self.old_id, self.kept_id = self.old.id, self.kept.id
+        counters.reconcile()
+        timelines.rebuild(robin.id)
+        db.session.commit()
+
+        self.folder = tempfile.TemporaryDirectory()
+        self.archive_folder = message_archive.folder
+        message_archive.folder = Path(self.folder.name)
+        message_archive.load()
+
+        current_users.clear()
+        page_cache.clear()
+
+    def tearDown(self):
+        message_archive.folder = self.archive_folder
+        self.folder.cleanup()
+        message_archive.load()
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_archive(self):
+        archived = message_archive.archive_older_than(
+            (datetime.utcnow() - datetime(2025, 3, 1)).days)
+
+        self.assertEqual([p.name for p in archived],
+                         ['messages_y2025m01', 'messages_y2025m02'])
+        self.assertEqual(sorted(p.name for p in Path(self.folder.name).iterdir()),
+                         ['messages_y2025m01.seg', 'messages_y2025m02.seg'])
+
+        ids = db.session.execute(select(Message.id)).scalars().all()
+        self.assertNotIn(self.old_id, ids)
+        self.assertIn(self.kept_id, ids)
+        for model in (Likes, MessageTerm, TimelineEntry):
+            self.assertNotIn(self.old_id, db.session.execute(
+                select(model.message_id)).scalars().all())
+
+        # Archived messages and their likes still count...
+        robin = db.session.get(User, self.robin_id)
+        tuck = db.session.get(User, self.tuck_id)
+        self.assertEqual((robin.messages_count, tuck.likes_count), (3, 2))
+
+        # ...and reconcile() agrees
+        counters.reconcile()
+        db.session.expire_all()
+        self.assertEqual((robin.messages_count, tuck.likes_count), (3, 2))
+
+    def test_show_archived(self):
+        message_archive.archive_older_than(
+            (datetime.utcnow() - datetime(2025, 3, 1)).days)
+
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.robin_id
+
+            resp = c.get(f"/messages/{self.old_id}")
+            html = resp.get_data(as_text=True)
+            self.assertEqual(resp.status_code, 200)
+            self.assertIn("archery at dawn", html)
+            self.assertIn("@robin", html)
+            self.assertNotIn("Delete", html)
+
+            resp = c.get(f"/messages/{self.old_id + 1}")
+            self.assertEqual(resp.status_code, 404)
+
+            resp = c.get(f"/messages/{self.kept_id}")
+            self.assertIn("archery at noon", resp.get_data(as_text=True))
+
+    def test_archiving_changes_etag(self):
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.robin_id
+
+            url = f"/messages/{self.old_id}"
+            etag = c.get(url).headers["ETag"]
+            message_archive.archive_older_than(
+                (datetime.utcnow() - datetime(2025, 3, 1)).days)
+
+            resp = c.get(url, headers={"If-None-Match": etag})
+            self.assertEqual(resp.status_code, 200)
+            self.assertNotIn("Delete", resp.get_data(as_text=True))
+
+    def test_rescans_limited(self):
+        message_archive.load()
+        segment = Path(self.folder.name, 'other.seg')
+        write_segment(segment, self.old_id, self.old_id + 10,
+                      [(self.old_id + 2, "archived elsewhere", self.old.timestamp,
+                        self.robin_id, 0)])
+
+        # Just looked, so another process's segment isn't seen yet...
+        self.assertIsNone(message_archive.find(self.old_id + 2))
+
+        # ...until the rescan interval has passed
+        message_archive._scanned_at -= message_archive.rescan_seconds
+        self.assertEqual(message_archive.find(self.old_id + 2).text,
+                         "archived elsewhere")
+
+        # Ids too new to be archived never look at the folder
+        message_archive._scanned_at -= message_archive.rescan_seconds
+        scanned_at = message_archive._scanned_at
+        self.assertIsNone(message_archive.find(self.new.id + 1))
+        self.assertEqual(message_archive._scanned_at, scanned_at)
+
+    def test_purge_deleted_users(self):
+        msg = Message(id=self.old_id + 1, timestamp=self.old.timestamp,
+                      text="tuck at dawn", user_id=self.tuck_id)
+        db.session.add(msg)
+        db.session.commit()
+        message_archive.archive_older_than(
+            (datetime.utcnow() - datetime(2025, 3, 1)).days)
+        self.assertEqual(message_archive.purge_deleted_users(), [])
+
+        tuck = db.session.get(User, self.tuck_id)
+        counters.user_deleted(self.tuck_id)
+        db.session.delete(tuck)
+        db.session.commit()
+
+        purged = message_archive.purge_deleted_users()
+        self.assertEqual([p.name for p in purged], ['messages_y2025m01.seg'])
+        self.assertIsNone(message_archive.find(self.old_id + 1))
+        self.assertEqual(message_archive.find(self.old_id).text, "archery at dawn")
+
+    def test_nothing_to_archive(self):
+        self.assertEqual(message_archive.archive_older_than(10000), [])
+        self.assertEqual(db.session.execute(
+            select(Message.id).where(Message.id == self.old_id)).scalar(),
+            self.old_id)
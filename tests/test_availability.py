@@ -0,0 +1,156 @@
+"""Signup and username/email availability tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_availability.py
+
+
+from app import app
+import os
+import threading
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from availability import BloomFilter, taken
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class BloomFilterTestCase(TestCase):
+    """Test the bloom filter on its own."""
+
+    def test_no_false_negatives(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        words = [f"user{i}" for i in range(1000)]
+        for word in words:
+            bloom.add(word)
+
+        self.assertTrue(all(word in bloom for word in words))
+
+    def test_false_positive_rate(self):
+        bloom = BloomFilter(capacity=1000, error_rate=0.01)
+        for i in range(1000):
+            bloom.add(f"user{i}")
+
+        false_positives = sum(f"other{i}" in bloom for i in range(10000))
+        self.assertLess(false_positives, 300)
+
+
+class SignupTestCase(TestCase):
+    """Test the signup view and the availability endpoint."""
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.drop_all()
+        db.create_all()
+
+        User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        taken.load(db.session.execute(
+            db.select(User.username, User.email, User.names_changed_at)))
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def signup(self, username, email):
+        return self.client.post("/signup", data={
+            "username": username, "email": email, "password": "password",
+            "bio": "Bio", "location": "Sherwood"},
+            follow_redirects=True)
+
+    def test_taken_email_only(self):
+        resp = self.signup("tuck", "robin@test.com")
+        self.assertIn("Email already taken", resp.get_data(as_text=True))
+
+        resp = self.signup("robin", "tuck@test.com")
+        self.assertIn("Username already taken", resp.get_data(as_text=True))
+
+        resp = self.signup("robin", "robin@test.com")
+        self.assertIn("Username and email already taken", resp.get_data(as_text=True))
+
+    def test_signup_queries(self):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.post("/signup", data={
+                "username": "tuck", "email": "tuck@test.com",
+                "password": "password", "bio": "Bio", "location": "Sherwood"})
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        self.assertEqual(resp.status_code, 302)
+        self.assertEqual(len([s for s in statements if s.startswith("SELECT")]), 1)
+        self.assertEqual(len([s for s in statements if s.startswith("INSERT INTO users")]), 1)
+        self.assertIsNotNone(User.query.filter_by(username="tuck").one_or_none())
+
+    def test_available(self):
+        resp = self.client.get("/users/available?username=robin&email=tuck@test.com")
+        self.assertEqual(resp.json, {"username": False, "email": True})
+
+        self.signup("tuck", "tuck@test.com")
+        resp = self.client.get("/users/available?username=tuck&email=tuck@test.com")
+        self.assertEqual(resp.json, {"username": False, "email": False})
+
+    def test_other_workers_changes(self):
+        # This worker's own signup doesn't move the filter's watermark...
+        self.signup("tuck", "tuck@test.com")
+        changed_through = taken.changed_through
+
+        # ...so another worker's signup and rename, stamped before it
+        # committed, are still picked up by the next sync
+        User.signup("marian", "marian@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        robin = User.query.filter_by(username="robin").one()
+        signed_up_at = robin.names_changed_at
+        robin.email = "hood@test.com"
+        db.session.commit()
+        self.assertGreater(robin.names_changed_at, signed_up_at)
+        db.session.execute(db.update(User).values(names_changed_at=changed_through))
+        db.session.commit()
+
+        taken.synced_at = 0
+        resp = self.client.get("/users/available?username=marian&email=hood@test.com")
+        self.assertEqual(resp.json, {"username": False, "email": False})
+
+    def test_rebuild_in_background(self):
+        User.signup("tuck", "tuck@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        taken.loaded_at = taken.synced_at = float('-inf')
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if threading.current_thread() is threading.main_thread():
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.get("/users/available?username=marian")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        # The request didn't read every user to rebuild the filter...
+        self.assertEqual(resp.json, {"username": True})
+        self.assertFalse([s for s in statements if "names_changed_at" in s])
+
+        # ...the rebuild thread did
+        for thread in threading.enumerate():
+            if thread.name == 'reload-TakenFilter':
+                thread.join()
+        self.assertFalse(taken.syncing.locked())
+        self.assertTrue(taken.might_be_taken("username", "tuck"))
@@ -0,0 +1,189 @@
+"""Response compression and static asset build tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_compression.py
+
+
+from app import app, assets, current_users, page_cache, CURR_USER_KEY
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import zlib
+from pathlib import Path
+from unittest import TestCase
+
+from models import db, Message, User
+import http_cache
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class CompressionTestCase(TestCase):
+    """Test gzipping of dynamic responses."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id = user.id
+
+        db.session.add_all([Message(text=f"Arrow number {i}", user_id=self.user_id)
+                            for i in range(40)])
+        db.session.commit()
+
+        current_users.clear()
+        page_cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def test_gzip_when_accepted(self):
+        resp = self.client.get("/login", headers={"Accept-Encoding": "gzip, br"})
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertIn("Accept-Encoding", resp.vary)
+        self.assertNotIn("Content-Length", resp.headers)
+        self.assertIn(b"<form", gzip.decompress(resp.data))
+
+    def test_plain_without_accept_encoding(self):
+        resp = self.client.get("/login")
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn("Accept-Encoding", resp.vary)
+        self.assertIn(b"<form", resp.data)
+
+    def test_gzip_refused(self):
+        resp = self.client.get("/login", headers={"Accept-Encoding": "gzip;q=0"})
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+    def test_small_responses_not_compressed(self):
+        resp = self.client.get("/users/available?username=robin",
+                               headers={"Accept-Encoding": "gzip"})
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertIn("username", resp.json)
+
+    def test_streamed_page_compressed_per_chunk(self):
+        self.login()
+        resp = self.client.get(f"/users/{self.user_id}", buffered=False,
+                               headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        chunks = list(resp.response)
+        resp.close()
+        self.assertGreater(len(chunks), 1)
+
+        # Each chunk is flushed, so the head can be read before the rest arrives
+        first = zlib.decompressobj(31).decompress(chunks[0])
+        self.assertIn(b"<head>", first)
+
+        html = zlib.decompress(b"".join(chunks), 31)
+        self.assertEqual(html.count(b'class="message-link"'), 40)
+
+    def test_not_modified_keeps_weak_etag(self):
+        self.login()
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip"})
+        etag = resp.headers["ETag"]
+        self.assertTrue(etag.startswith("W/"))
+
+        resp = self.client.get("/", headers={"Accept-Encoding": "gzip",
+                                             "If-None-Match": etag})
+        self.assertEqual(resp.status_code, 304)
+        self.assertNotIn("Content-Encoding", resp.headers)
+
+
+class AssetsTestCase(TestCase):
+    """Test the hashed, precompressed static build."""
+
+    def setUp(self):
+        self.folder = assets.folder
+        self.tmpdir = tempfile.mkdtemp()
+        assets.folder = Path(self.tmpdir)
+        self.manifest = assets.build()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+        assets.folder = self.folder
+        assets.load()
+        super().tearDown()
+
+    def test_build(self):
+        css = self.manifest["stylesheets/style.css"]
+        self.assertRegex(css, r"^stylesheets/style\.[0-9a-f]{10}\.css$")
+        self.assertTrue(Path(self.tmpdir, f"{css}.gz").exists())
+
+        logo = self.manifest["images/warbler-logo.png"]
+        self.assertTrue(Path(self.tmpdir, logo).exists())
+        self.assertFalse(Path(self.tmpdir, f"{logo}.gz").exists())
+
+        # Stylesheets link to the hashed images
+        text = Path(self.tmpdir, css).read_text()
+        self.assertNotIn("/static/images/nav-bg.png", text)
+        self.assertIn(f"/assets/{self.manifest['images/nav-bg.png']}", text)
+
+    def test_build_is_repeatable(self):
+        self.assertEqual(assets.build(), self.manifest)
+
+    def test_asset_url(self):
+        with app.test_request_context():
+            self.assertEqual(assets.asset_url("stylesheets/style.css"),
+                             f"/assets/{self.manifest['stylesheets/style.css']}")
+            self.assertEqual(assets.asset_url("missing.js"), "/static/missing.js")
+
+    def test_serve_precompressed(self):
+        css = self.manifest["stylesheets/style.css"]
+        resp = self.client.get(f"/assets/{css}", headers={"Accept-Encoding": "gzip"})
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.headers["Content-Encoding"], "gzip")
+        self.assertEqual(resp.mimetype, "text/css")
+        self.assertIn("Accept-Encoding", resp.vary)
+        self.assertEqual(resp.cache_control.max_age, 31536000)
+        self.assertTrue(resp.cache_control.immutable)
+        self.assertEqual(gzip.decompress(resp.data),
+                         Path(self.tmpdir, css).read_bytes())
+        resp.close()
+
+    def test_serve_uncompressed(self):
+        css = self.manifest["stylesheets/style.css"]
+        resp = self.client.get(f"/assets/{css}")
+
+        self.assertNotIn("Content-Encoding", resp.headers)
+        self.assertEqual(resp.data, Path(self.tmpdir, css).read_bytes())
+        self.assertTrue(resp.cache_control.public)
+        resp.close()
+
+    def test_build_changes_etags(self):
+        changed = dict(self.manifest)
+        changed["stylesheets/style.css"] = "stylesheets/style.0123456789.css"
+
+        with app.test_request_context():
+            etag = http_cache.etag_for("page")
+            (Path(self.tmpdir) / "manifest.json").write_text(json.dumps(changed))
+            assets.load()
+            self.assertNotEqual(http_cache.etag_for("page"), etag)
+
+    def test_manifest_and_gz_not_served(self):
+        css = self.manifest["stylesheets/style.css"]
+        self.assertEqual(self.client.get("/assets/manifest.json").status_code, 404)
+        self.assertEqual(self.client.get(f"/assets/{css}.gz").status_code, 404)
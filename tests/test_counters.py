@@ -0,0 +1,82 @@
+"""Denormalized user counter tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_counters.py
+
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+import counters
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class CounterTestCase(TestCase):
+    """Test maintenance and reconciliation of user counters."""
+
+    def setUp(self):
+        """Create two users; u1 follows u2 and likes one of u2's messages."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.u1 = User.signup("test1", "email1@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+        self.u2 = User.signup("test2", "email2@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+        self.msg = Message(text="like me", user_id=self.u2.id)
+        db.session.add(self.msg)
+        db.session.flush()
+
+        self.u1.following.append(self.u2)
+        db.session.add(Likes(user_id=self.u1.id, message_id=self.msg.id))
+        db.session.flush()
+        counters.reconcile()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_reconcile(self):
+        self.assertEqual(self.u1.following_count, 1)
+        self.assertEqual(self.u1.likes_count, 1)
+        self.assertEqual(self.u1.messages_count, 0)
+        self.assertEqual(self.u2.followers_count, 1)
+        self.assertEqual(self.u2.messages_count, 1)
+
+    def test_message_deleted(self):
+        counters.message_deleted(self.msg)
+        db.session.delete(self.msg)
+        db.session.commit()
+
+        self.assertEqual(self.u2.messages_count, 0)
+        self.assertEqual(self.u1.likes_count, 0)
+
+    def test_user_deleted(self):
+        counters.user_deleted(self.u2.id)
+        db.session.delete(self.u2)
+        db.session.commit()
+
+        self.assertEqual(self.u1.following_count, 0)
+        self.assertEqual(self.u1.likes_count, 0)
+
+    def test_liker_deleted(self):
+        self.msg.like_count = 1
+        db.session.commit()
+
+        counters.user_deleted(self.u1.id)
+        db.session.delete(self.u1)
+        db.session.commit()
+
+        self.assertEqual(self.u2.followers_count, 0)
+        self.assertEqual(self.msg.like_count, 0)
@@ -0,0 +1,98 @@
+"""Current-user cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_current_user.py
+
+
+from app import app, current_users, CURR_USER_KEY
+import os
+import time
+from unittest import TestCase
+
+from cache import LRUCache
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class LRUCacheTestCase(TestCase):
+    """Test eviction and expiry."""
+
+    def test_evicts_least_recently_used(self):
+        cache = LRUCache(maxsize=2)
+        cache.set(1, "one")
+        cache.set(2, "two")
+        cache.get(1)
+        cache.set(3, "three")
+
+        self.assertEqual(cache.get(1), "one")
+        self.assertIsNone(cache.get(2))
+        self.assertEqual(len(cache), 2)
+
+    def test_expires(self):
+        cache = LRUCache(ttl=0.01)
+        cache.set(1, "one")
+        time.sleep(0.02)
+
+        self.assertIsNone(cache.get(1))
+
+
+class CurrentUserTestCase(TestCase):
+    """Test that logged-in users come from the cache until invalidated."""
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        other = User.signup("tuck", "tuck@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id, self.other_id = user.id, other.id
+
+        current_users.clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_snapshot_is_cached(self):
+        self.client.get("/")
+
+        User.query.filter_by(id=self.user_id).update({'bio': "Changed"})
+        db.session.commit()
+
+        self.assertEqual(current_users.get(self.user_id).bio, "Bio")
+
+        current_users.invalidate(self.user_id)
+        self.assertEqual(current_users.get(self.user_id).bio, "Changed")
+
+    def test_follow_invalidates_both_users(self):
+        self.client.get("/")
+        current_users.get(self.other_id)
+
+        self.client.post(f"/users/follow/{self.other_id}")
+
+        self.assertEqual(current_users.get(self.user_id).following_count, 1)
+        self.assertEqual(current_users.get(self.other_id).followers_count, 1)
+
+    def test_profile_edit_invalidates(self):
+        self.client.post("/users/profile", data={
+            "username": "robinhood", "email": "robin@test.com",
+            "password": "password", "bio": "Bio", "location": "Sherwood"})
+
+        self.assertEqual(current_users.get(self.user_id).username, "robinhood")
+
+    def test_missing_user(self):
+        self.assertIsNone(current_users.get(424242))
@@ -0,0 +1,88 @@
+"""Message fragment cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_fragments.py
+
+
+from app import app, fragment_cache
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from cache import LRUCache
+from read_models import MessageRow
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+def message_row(**fields):
+    values = dict(id=1, text="Archery at noon", timestamp=datetime(2024, 5, 1),
+                  user_id=7, username="robin", image_url="/robin.png",
+                  like_count=0)
+    values.update(fields)
+    return MessageRow(**values)
+
+
+class FragmentCacheTestCase(TestCase):
+    """Test caching, keying and the size cap."""
+
+    def setUp(self):
+        self.cache = fragment_cache
+        self.cache.clear()
+
+    def tearDown(self):
+        self.cache._fragments.maxweight = app.config['FRAGMENT_CACHE_MAX_BYTES']
+        self.cache.clear()
+        super().tearDown()
+
+    def test_renders_and_caches(self):
+        html = self.cache.message_body(message_row())
+
+        self.assertIn("@robin", html)
+        self.assertIn("Archery at noon", html)
+        self.assertIn('href="/messages/1"', html)
+        self.assertEqual(len(self.cache._fragments), 1)
+
+        # Like counts are not part of the fragment
+        self.assertEqual(self.cache.message_body(message_row(like_count=5)), html)
+        self.assertEqual(len(self.cache._fragments), 1)
+
+    def test_author_change_is_new_key(self):
+        self.cache.message_body(message_row())
+        html = self.cache.message_body(message_row(username="robinhood"))
+
+        self.assertIn("@robinhood", html)
+        self.assertEqual(len(self.cache._fragments), 2)
+
+    def test_escapes_text(self):
+        html = self.cache.message_body(message_row(text="<script>"))
+
+        self.assertIn("&lt;script&gt;", html)
+
+    def test_size_cap(self):
+        self.cache._fragments.maxweight = 2000
+        for i in range(50):
+            self.cache.message_body(message_row(id=i))
+
+        self.assertLessEqual(self.cache._fragments.weight, 2000)
+        self.assertLess(len(self.cache._fragments), 50)
+
+
+class WeightedLRUCacheTestCase(TestCase):
+    """Test eviction by total weight."""
+
+    def test_evicts_by_weight(self):
+        cache = LRUCache(maxsize=None, weigher=len, maxweight=9)
+        cache.set("a", "xxxx")
+        cache.set("b", "xxxx")
+        cache.set("a", "xx")
+        cache.set("c", "xxxx")
+
+        self.assertIsNone(cache.get("b"))
+        self.assertEqual(cache.weight, 6)
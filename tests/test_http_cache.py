@@ -0,0 +1,177 @@
+"""Conditional GET and Cache-Control tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_http_cache.py
+
+
+from app import app, current_users, page_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, Follows, Message, User
+import timelines
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class HttpCacheTestCase(TestCase):
+    """Test ETags, 304s and per-route cache policies."""
+
+    def setUp(self):
+        app.config['WTF_CSRF_ENABLED'] = False
+        db.drop_all()
+        db.create_all()
+
+        robin = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        tuck = User.signup("tuck", "tuck@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.robin_id, self.tuck_id = robin.id, tuck.id
+
+        msg = Message(text="Archery at noon", user_id=self.tuck_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        current_users.clear()
+        page_cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def login(self):
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.robin_id
+
+    def revalidate(self, url, etag):
+        return self.client.get(url, headers={"If-None-Match": etag})
+
+    def test_anonymous_message_is_public(self):
+        url = f"/messages/{self.msg_id}"
+        resp = self.client.get(url)
+
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.public)
+        self.assertEqual(resp.cache_control.max_age, 60)
+        self.assertIn("Cookie", resp.vary)
+
+        again = self.revalidate(url, resp.headers["ETag"])
+        self.assertEqual(again.status_code, 304)
+        self.assertEqual(again.get_data(), b"")
+
+    def test_follow_changes_etag(self):
+        self.login()
+        url = f"/messages/{self.msg_id}"
+        resp = self.client.get(url)
+        self.assertTrue(resp.cache_control.private)
+        # Revalidated every time, so the follow below shows straight away
+        self.assertEqual(resp.cache_control.max_age, 0)
+        self.assertIsNotNone(resp.headers.get("ETag"))
+
+        self.client.post(f"/users/follow/{self.tuck_id}")
+
+        again = self.revalidate(url, resp.headers["ETag"])
+        self.assertEqual(again.status_code, 200)
+        self.assertIn("Unfollow", again.get_data(as_text=True))
+
+    def test_profile_changes_etag(self):
+        self.login()
+        url = f"/users/{self.robin_id}"
+        etag = self.client.get(url).headers["ETag"]
+        self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+        self.client.post("/messages/new", data={"text": "Feast"})
+
+        self.assertEqual(self.revalidate(url, etag).status_code, 200)
+
+    def test_home_new_message_changes_etag(self):
+        db.session.add(Follows(user_being_followed_id=self.tuck_id,
+                               user_following_id=self.robin_id))
+        timelines.rebuild(self.robin_id)
+        db.session.commit()
+        self.login()
+        etag = self.client.get("/").headers["ETag"]
+        self.assertEqual(self.revalidate("/", etag).status_code, 304)
+
+        msg = Message(text="Feast at dusk", user_id=self.tuck_id)
+        db.session.add(msg)
+        db.session.flush()
+        timelines.push_message(msg)
+        db.session.commit()
+
+        resp = self.revalidate("/", etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("Feast at dusk", resp.get_data(as_text=True))
+
+    def test_following_revalidated_before_page_query(self):
+        marian = User.signup("marian", "marian@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.add(Follows(user_being_followed_id=self.robin_id,
+                               user_following_id=self.tuck_id))
+        db.session.commit()
+        marian_id = marian.id
+        self.login()
+        url = f"/users/{self.tuck_id}/following"
+        etag = self.client.get(url).headers["ETag"]
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            self.assertEqual(self.revalidate(url, etag).status_code, 304)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+        self.assertFalse([s for s in statements if "JOIN follows" in s])
+
+        # Following someone else instead keeps the counts, not the ETag
+        db.session.execute(db.update(Follows)
+                           .where(Follows.user_following_id == self.tuck_id)
+                           .values(user_being_followed_id=marian_id))
+        db.session.commit()
+        resp = self.revalidate(url, etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertIn("@marian", resp.get_data(as_text=True))
+
+    def test_etag_refreshed(self):
+        self.login()
+        url = f"/users/{self.robin_id}/likes"
+        refresh = app.config['ETAG_REFRESH_SECONDS']
+        try:
+            app.config['ETAG_REFRESH_SECONDS'] = 10**9
+            etag = self.client.get(url).headers["ETag"]
+            self.assertEqual(self.revalidate(url, etag).status_code, 304)
+
+            app.config['ETAG_REFRESH_SECONDS'] = 10**-6
+            self.assertEqual(self.revalidate(url, etag).status_code, 200)
+        finally:
+            app.config['ETAG_REFRESH_SECONDS'] = refresh
+
+    def test_other_pages_not_stored(self):
+        resp = self.client.get("/login")
+
+        self.assertTrue(resp.cache_control.no_store)
+        self.assertIsNone(resp.headers.get("ETag"))
+
+    def test_flashes_not_cached(self):
+        self.login()
+        etag = self.client.get("/").headers["ETag"]
+
+        with self.client.session_transaction() as sess:
+            sess["_flashes"] = [("success", "Hello")]
+
+        resp = self.revalidate("/", etag)
+        self.assertEqual(resp.status_code, 200)
+        self.assertTrue(resp.cache_control.no_store)
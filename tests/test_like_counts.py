@@ -0,0 +1,93 @@
+"""Write-behind like count tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_like_counts.py
+
+
+from app import app, like_buffer
+import os
+import time
+from unittest import TestCase
+
+from models import db, User, Message, Likes
+import like_counts
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class LikeCountTestCase(TestCase):
+    """Test buffering, flushing and recounting of message like counts."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        u = User.signup("test1", "email1@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+        self.msg = Message(text="like me", user_id=u.id)
+        db.session.add(self.msg)
+        db.session.commit()
+        self.msg_id = self.msg.id
+
+    def tearDown(self):
+        like_buffer.flush()
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_buffer_coalesces(self):
+        like_buffer.add(self.msg_id, 1)
+        like_buffer.add(self.msg_id, 1)
+        like_buffer.add(self.msg_id, -1)
+        self.assertEqual(like_buffer.pending(self.msg_id), 1)
+
+        # Nothing is written until the buffer is flushed
+        self.assertEqual(Message.query.get(self.msg_id).like_count, 0)
+
+        like_buffer.flush()
+        db.session.expire_all()
+        self.assertEqual(like_buffer.pending(self.msg_id), 0)
+        self.assertEqual(Message.query.get(self.msg_id).like_count, 1)
+
+    def test_failed_flush_retried(self):
+        interval = app.config['LIKE_BUFFER_INTERVAL']
+        app.config['LIKE_BUFFER_INTERVAL'] = 0.05
+        try:
+            # One more like than the column can hold makes the flush fail...
+            db.session.execute(db.update(Message).values(like_count=2**31 - 1))
+            db.session.commit()
+            like_buffer.add(self.msg_id, 1)
+            like_buffer.flush()
+            self.assertEqual(like_buffer.pending(self.msg_id), 1)
+
+            # ...and once the database takes it, the retry writes it out
+            # without another like coming in
+            db.session.execute(db.update(Message).values(like_count=0))
+            db.session.commit()
+            deadline = time.monotonic() + 10
+            while time.monotonic() < deadline:
+                db.session.rollback()
+                if Message.query.get(self.msg_id).like_count == 1:
+                    break
+                time.sleep(0.01)
+
+            self.assertEqual(Message.query.get(self.msg_id).like_count, 1)
+            self.assertEqual(like_buffer.pending(self.msg_id), 0)
+        finally:
+            app.config['LIKE_BUFFER_INTERVAL'] = interval
+
+    def test_recount(self):
+        u2 = User.signup("test2", "email2@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+        db.session.add(Likes(user_id=u2.id, message_id=self.msg_id))
+        db.session.commit()
+
+        like_counts.recount()
+        db.session.commit()
+
+        self.assertEqual(Message.query.get(self.msg_id).like_count, 1)
@@ -94,3 +94,20 @@ class MessageModelTestCase(TestCase):
         l = Likes.query.filter(Likes.user_id == uid).all()
         self.assertEqual(len(l), 1)
         self.assertEqual(l[0].message_id, m1.id)
+
+    def test_like_toggle(self):
+        m = Message(text="a warble", user_id=self.uid)
+        u = User.signup("testing123", "testing@test12134343.com", "password", None, bio="I am not good looking", location= "USA",header_image_url="http:google.com")
+        db.session.add(m)
+        db.session.commit()
+
+        # Both users can like the same message
+        self.assertEqual(Likes.toggle(self.uid, m.id), (True, True))
+        self.assertEqual(Likes.toggle(u.id, m.id), (True, True))
+        self.assertEqual(Likes.query.filter(Likes.message_id == m.id).count(), 2)
+
+        # Setting a state that is already there changes nothing
+        self.assertFalse(Likes.set(u.id, m.id, liked=True))
+
+        self.assertEqual(Likes.toggle(u.id, m.id), (False, True))
+        self.assertEqual(Likes.query.filter(Likes.message_id == m.id).count(), 1)
@@ -5,7 +5,7 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-from app import app, CURR_USER_KEY
+from app import app, current_users, page_cache, CURR_USER_KEY
 import os
 from unittest import TestCase
 
@@ -43,6 +43,8 @@ class MessageViewTestCase(TestCase):
         db.create_all()
 
         self.client = app.test_client()
+        current_users.clear()
+        page_cache.clear()
         self.testuser = User.signup("testing", "testing@test.com", "password", image_url=None, bio="I am good looking", location= "Canada",header_image_url="http:google.com")
         self.testuser_id = 8989
         self.testuser.id = self.testuser_id
@@ -51,7 +53,7 @@ class MessageViewTestCase(TestCase):
 
     def tearDown(self):
         res = super().tearDown()
-        db.session.rollback()
+        db.session.remove()
         db.drop_all()
         return res
     
@@ -158,6 +160,26 @@ class MessageViewTestCase(TestCase):
             self.assertEqual(msg.text, "Hello")
 
 
+    def test_like_json(self):
+        u = User.signup("liker", "liker@test.com", "password", None, "Bio", "Toronto", "http://")
+        u.id = 76543
+        m = Message(id=1234, text="a test message", user_id=self.testuser_id)
+        db.session.add_all([u, m])
+        db.session.commit()
+
+        with self.client as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = 76543
+
+            resp = c.post("/messages/1234/like", json={"liked": True},
+                          headers={"Accept": "application/json"})
+            self.assertEqual(resp.json, {"liked": True, "likes": 1})
+
+            # JSON that isn't an object is a bad request, not a crash
+            for body in ([1], "x", 5, []):
+                resp = c.post("/messages/1234/like", json=body)
+                self.assertEqual(resp.status_code, 400)
+
     def test_invalid_message_show(self):
         with self.client as c:
             with c.session_transaction() as sess:
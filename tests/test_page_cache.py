@@ -0,0 +1,125 @@
+"""Anonymous page cache tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_page_cache.py
+
+
+from app import app, current_users, page_cache, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, ArchivedCounts, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class PageCacheTestCase(TestCase):
+    """Test that logged-out visitors are served stored pages."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id = user.id
+
+        msg = Message(text="Archery at noon", user_id=self.user_id)
+        db.session.add(msg)
+        db.session.commit()
+        self.msg_id = msg.id
+
+        current_users.clear()
+        page_cache.clear()
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def count_queries(self, url, client=None):
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = (client or self.client).get(url)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        return resp, len(statements)
+
+    def test_hit_skips_database(self):
+        url = f"/messages/{self.msg_id}"
+        first, queries = self.count_queries(url)
+        self.assertGreater(queries, 0)
+
+        second, queries = self.count_queries(url)
+        self.assertEqual(queries, 0)
+        self.assertEqual(second.get_data(), first.get_data())
+        self.assertEqual(second.headers["ETag"], first.headers["ETag"])
+        self.assertTrue(second.cache_control.public)
+
+        again = self.client.get(url, headers={"If-None-Match": first.headers["ETag"]})
+        self.assertEqual(again.status_code, 304)
+
+    def test_logged_in_not_cached(self):
+        url = f"/messages/{self.msg_id}"
+        self.client.get(url)
+
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        resp, queries = self.count_queries(url)
+
+        self.assertGreater(queries, 0)
+        self.assertIn("Delete", resp.get_data(as_text=True))
+
+    def test_delete_invalidates(self):
+        url = f"/messages/{self.msg_id}"
+        self.client.get(url)
+
+        author = app.test_client()
+        with author.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        author.post(f"/messages/{self.msg_id}/delete")
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+    def delete_author(self):
+        author = app.test_client()
+        with author.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+        author.post("/users/delete")
+
+    def test_delete_user_invalidates(self):
+        url = f"/messages/{self.msg_id}"
+        self.client.get(url)
+        self.client.get("/")
+
+        self.delete_author()
+
+        self.assertEqual(self.client.get(url).status_code, 404)
+        # Other pages are left alone
+        self.assertIsNotNone(page_cache.backend.get("/"))
+
+    def test_delete_user_with_archived_messages(self):
+        db.session.add(ArchivedCounts(user_id=self.user_id, messages_count=1))
+        db.session.commit()
+        self.client.get("/")
+
+        self.delete_author()
+
+        # Their archived messages' pages can't be found, so none are kept
+        self.assertIsNone(page_cache.backend.get("/"))
@@ -0,0 +1,111 @@
+"""Password hashing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_passwords.py
+
+
+from app import app
+import os
+import threading
+from unittest import TestCase
+
+from models import db, User
+from passwords import HasherBusy, PasswordHasher, hash_rounds, hasher
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class PasswordHasherTestCase(TestCase):
+    """Test hashing on the pool, inline, and when the queue is full."""
+
+    def make_hasher(self, **config):
+        config.setdefault('BCRYPT_LOG_ROUNDS', 4)
+        fake_app = type('FakeApp', (), {'config': config})()
+        return PasswordHasher(fake_app)
+
+    def test_pool(self):
+        pool_hasher = self.make_hasher(BCRYPT_WORKERS=2)
+        try:
+            hashed = pool_hasher.hash("secret")
+            self.assertEqual(hash_rounds(hashed), 4)
+            self.assertTrue(pool_hasher.check(hashed, "secret"))
+            self.assertFalse(pool_hasher.check(hashed, "wrong"))
+        finally:
+            pool_hasher.shutdown()
+
+    def test_pool_process_killed(self):
+        pool_hasher = self.make_hasher(BCRYPT_WORKERS=1)
+        try:
+            hashed = pool_hasher.hash("secret")
+            for process in list(pool_hasher._pool._processes.values()):
+                process.kill()
+                process.join()
+
+            self.assertTrue(pool_hasher.check(hashed, "secret"))
+        finally:
+            pool_hasher.shutdown()
+
+    def test_needs_rehash(self):
+        inline = self.make_hasher(BCRYPT_WORKERS=0)
+        hashed = inline.hash("secret")
+        self.assertFalse(inline.needs_rehash(hashed))
+
+        inline.rounds = 5
+        self.assertTrue(inline.needs_rehash(hashed))
+
+    def test_busy(self):
+        inline = self.make_hasher(BCRYPT_WORKERS=0, BCRYPT_MAX_PENDING=1)
+        started, release = threading.Event(), threading.Event()
+
+        def slow(*args):
+            started.set()
+            release.wait()
+
+        thread = threading.Thread(target=inline._run, args=(slow,))
+        thread.start()
+        started.wait()
+        try:
+            with self.assertRaises(HasherBusy) as raised:
+                inline.hash("secret")
+            self.assertEqual(raised.exception.code, 503)
+        finally:
+            release.set()
+            thread.join()
+
+
+class RehashOnLoginTestCase(TestCase):
+    """Test that logging in upgrades hashes made with an old work factor."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+        self.rounds = hasher.rounds
+
+    def tearDown(self):
+        hasher.rounds = self.rounds
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_rehash(self):
+        hasher.rounds = 4
+        User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+
+        hasher.rounds = 5
+        user = User.authenticate("robin", "password")
+        db.session.commit()
+        self.assertEqual(hash_rounds(user.password), 5)
+
+        old_hash = user.password
+        User.authenticate("robin", "password")
+        self.assertEqual(user.password, old_hash)
+
+        self.assertFalse(User.authenticate("robin", "wrong"))
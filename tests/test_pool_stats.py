@@ -0,0 +1,96 @@
+"""Connection pool settings and metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_pool_stats.py
+
+
+from app import app
+import os
+from unittest import TestCase
+
+from flask import Flask
+from sqlalchemy import create_engine, text
+from sqlalchemy.exc import TimeoutError
+
+from metrics import Registry, metrics
+from models import db
+from pool_stats import InstrumentedQueuePool, PoolStats, pool_stats
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class PoolSettingsTestCase(TestCase):
+    """Test that every engine gets the configured pool."""
+
+    def test_primary_pool(self):
+        pool = db.engine.pool
+
+        self.assertIsInstance(pool, InstrumentedQueuePool)
+        self.assertEqual(pool.size(), app.config['DB_POOL_SIZE'])
+        self.assertEqual(pool._max_overflow, app.config['DB_MAX_OVERFLOW'])
+        self.assertEqual(pool._recycle, app.config['DB_POOL_RECYCLE'])
+        self.assertEqual(pool._pre_ping, app.config['DB_POOL_PRE_PING'])
+
+    def test_binds(self):
+        test_app = Flask(__name__)
+        test_app.config.update(
+            DB_POOL_SIZE=8,
+            SQLALCHEMY_BINDS={'replica0': "postgresql:///replica"})
+        PoolStats(test_app, registry=Registry())
+
+        bind = test_app.config['SQLALCHEMY_BINDS']['replica0']
+        self.assertEqual(bind['url'], "postgresql:///replica")
+        self.assertEqual(bind['pool_size'], 8)
+        self.assertEqual(bind['pool_logging_name'], 'replica0')
+        self.assertIs(bind['poolclass'], InstrumentedQueuePool)
+        self.assertEqual(test_app.config['SQLALCHEMY_ENGINE_OPTIONS']['pool_size'], 8)
+
+
+class PoolMetricsTestCase(TestCase):
+    """Test the pool's checkout timings and gauges."""
+
+    def setUp(self):
+        self.engine = create_engine(
+            app.config['SQLALCHEMY_DATABASE_URI'],
+            poolclass=InstrumentedQueuePool, pool_logging_name='test',
+            pool_size=1, max_overflow=1, pool_timeout=0.1)
+
+    def tearDown(self):
+        self.engine.dispose()
+        pool_stats.checkout_seconds.clear()
+        pool_stats.timeouts.clear()
+        super().tearDown()
+
+    def gauge(self, name):
+        for line in metrics.render().splitlines():
+            if line.startswith(f'warbler_db_pool_{name}{{pool="test"}}'):
+                return int(line.split()[-1])
+
+    def test_checkouts(self):
+        with self.engine.connect() as one:
+            one.execute(text("SELECT 1"))
+            self.assertEqual(self.gauge('in_use'), 1)
+            self.assertEqual(self.gauge('overflow'), 0)
+
+            with self.engine.connect() as two:
+                two.execute(text("SELECT 1"))
+                self.assertEqual(self.gauge('in_use'), 2)
+                self.assertEqual(self.gauge('overflow'), 1)
+
+        self.assertEqual(pool_stats.checkout_seconds.count('test'), 2)
+        self.assertEqual(self.gauge('in_use'), 0)
+        self.assertEqual(self.gauge('idle'), 1)
+
+    def test_timeout(self):
+        with self.engine.connect(), self.engine.connect():
+            with self.assertRaises(TimeoutError):
+                self.engine.connect()
+
+        self.assertEqual(pool_stats.timeouts.value('test'), 1)
+        self.assertEqual(pool_stats.checkout_seconds.count('test'), 3)
@@ -0,0 +1,269 @@
+"""Query plan regression tests for the hot pages.
+
+Each test loads a page against a database built by the migrations and
+runs EXPLAIN on every SELECT the page issued, with sequential scans and
+sorts priced out of the planner's choices. A plan that still scans a
+whole table, or sorts rows that weren't already cut down by a LIMIT,
+means an index the query relies on is missing.
+"""
+
+# run these tests like:
+#
+#    python -m unittest test_query_plans.py
+
+
+from app import app, current_users, page_cache, CURR_USER_KEY
+import os
+import re
+from unittest import TestCase
+
+from sqlalchemy import event, text
+
+from models import db, Follows, Likes, Message, User
+import counters
+import migrations
+import search
+import timelines
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+SORTS = ('Sort', 'Incremental Sort')
+
+INDEX_SCANS = ('Index Scan', 'Index Only Scan', 'Bitmap Index Scan')
+
+
+def plan_problems(plan, leading_columns):
+    """Descriptions of the full scans and unbounded sorts in `plan`.
+
+    `leading_columns` maps index names to their first column. An index
+    scan that doesn't constrain that column reads the whole index, which
+    is only acceptable when a LIMIT above it stops the scan early.
+    """
+
+    problems = []
+
+    def walk(node, limited):
+        kind = node['Node Type']
+        children = node.get('Plans', [])
+
+        if kind == 'Seq Scan':
+            problems.append(f"Seq Scan on {node['Relation Name']}")
+        if kind in SORTS and not any(map(has_limit, children)):
+            problems.append(f"{kind} on {node['Sort Key']}")
+        if kind in INDEX_SCANS:
+            leading = leading_columns.get(node['Index Name'])
+            condition = node.get('Index Cond')
+            if condition is None and not limited:
+                problems.append(f"Full {kind} on {node['Index Name']}")
+            elif condition and leading and not re.search(
+                    rf'\b{leading}\b', condition):
+                problems.append(f"{kind} on {node['Index Name']} "
+                                f"without {leading}: {condition}")
+
+        limited = limited or kind == 'Limit'
+        for child in children:
+            walk(child, limited)
+
+    def has_limit(node):
+        return (node['Node Type'] == 'Limit'
+                or any(map(has_limit, node.get('Plans', []))))
+
+    walk(plan, False)
+    return problems
+
+
+class QueryPlanTestCase(TestCase):
+    """Test that the hot pages' queries are served by indexes."""
+
+    def setUp(self):
+        db.drop_all()
+        migrations.clear_history(db.engine)
+        migrations.upgrade(db.engine)
+
+        users = [User.signup(f"user{i}", f"user{i}@test.com", "password", None, bio="Bio", location="Here", header_image_url="http://")
+                 for i in range(4)]
+        db.session.flush()
+        self.user_id = users[0].id
+        for user in users[1:]:
+            db.session.add(Follows(user_being_followed_id=user.id,
+                                   user_following_id=self.user_id))
+        db.session.add(Follows(user_being_followed_id=self.user_id,
+                               user_following_id=users[1].id))
+        db.session.flush()
+        counters.reconcile()
+
+        messages = [Message(text=f"warble number {i}", user_id=users[i % 4].id)
+                    for i in range(200)]
+        db.session.add_all(messages)
+        db.session.flush()
+        self.message_id = messages[0].id
+        db.session.add_all([Likes(user_id=self.user_id, message_id=msg.id)
+                            for msg in messages[::3]])
+        db.session.commit()
+
+        # user3 is popular enough to be merged into timelines on read
+        self.threshold = app.config['TIMELINE_FANOUT_THRESHOLD']
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 1
+        db.session.execute(text("UPDATE users SET followers_count = 5, "
+                                "timeline_pulled = true WHERE id = :id"),
+                           {'id': users[3].id})
+        timelines.rebuild_all()
+        search.reindex_messages()
+        db.session.remove()
+
+        with db.engine.connect() as conn:
+            conn.execution_options(isolation_level='AUTOCOMMIT').execute(
+                text("ANALYZE"))
+
+        current_users.clear()
+        page_cache.clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = self.threshold
+        db.session.remove()
+        db.drop_all()
+        migrations.clear_history(db.engine)
+        db.create_all()
+        super().tearDown()
+
+    def selects_for(self, url):
+        """The SELECT statements (and their parameters) run to serve `url`."""
+
+        statements = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            if statement.lstrip().upper().startswith('SELECT'):
+                statements.append((statement, parameters))
+
+        event.listen(db.engine, 'before_cursor_execute', capture)
+        try:
+            resp = self.client.get(url)
+        finally:
+            event.remove(db.engine, 'before_cursor_execute', capture)
+
+        self.assertEqual(resp.status_code, 200)
+        return statements
+
+    def assertIndexed(self, url):
+        statements = self.selects_for(url)
+        self.assertTrue(statements)
+
+        with db.engine.connect() as conn:
+            leading_columns = dict(conn.execute(text(
+                "SELECT index.relname, attname FROM pg_index"
+                " JOIN pg_class index ON index.oid = indexrelid"
+                " JOIN pg_attribute ON attrelid = indrelid"
+                " AND attnum = indkey[0]")).all())
+
+            conn.execute(text("SET enable_seqscan = off"))
+            conn.execute(text("SET enable_sort = off"))
+            for statement, parameters in statements:
+                plan = conn.exec_driver_sql(
+                    f"EXPLAIN (FORMAT JSON) {statement}", parameters).scalar()
+                problems = plan_problems(plan[0]['Plan'], leading_columns)
+                self.assertEqual(problems, [], f"{url}: {statement}")
+
+    def test_home_timeline(self):
+        self.assertIndexed("/")
+
+    def test_profile(self):
+        self.assertIndexed(f"/users/{self.user_id}")
+
+    def test_following(self):
+        self.assertIndexed(f"/users/{self.user_id}/following")
+
+    def test_followers(self):
+        self.assertIndexed(f"/users/{self.user_id}/followers")
+
+    def test_likes(self):
+        self.assertIndexed(f"/users/{self.user_id}/likes")
+
+    def test_message(self):
+        self.assertIndexed(f"/messages/{self.message_id}")
+
+    def test_message_search(self):
+        self.assertIndexed("/messages/search?q=warble+number")
+
+    def test_user_search(self):
+        self.assertIndexed("/users?q=user")
+        self.assertIndexed("/users?q=ser1")
+
+    def test_plan_problems(self):
+        leading = {'messages_pkey': 'id', 'follows_pkey': 'user_being_followed_id'}
+
+        self.assertEqual(plan_problems({
+            'Node Type': 'Sort', 'Sort Key': ['timestamp'], 'Plans': [
+                {'Node Type': 'Seq Scan', 'Relation Name': 'messages'},
+            ],
+        }, leading), ["Sort on ['timestamp']", "Seq Scan on messages"])
+
+        self.assertEqual(plan_problems({
+            'Node Type': 'Sort', 'Sort Key': ['timestamp'], 'Plans': [
+                {'Node Type': 'Limit', 'Plans': [
+                    {'Node Type': 'Index Scan', 'Index Name': 'messages_pkey'},
+                ]},
+            ],
+        }, leading), [])
+
+        self.assertEqual(plan_problems({
+            'Node Type': 'Index Only Scan', 'Index Name': 'follows_pkey',
+            'Index Cond': '(user_following_id = 1)',
+        }, leading), ["Index Only Scan on follows_pkey without "
+                      "user_being_followed_id: (user_following_id = 1)"])
+
+
+class MigrationTestCase(TestCase):
+    """Test upgrading databases built before migrations existed."""
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        migrations.clear_history(db.engine)
+        db.create_all()
+        super().tearDown()
+
+    def indexes(self):
+        return set(db.session.execute(text(
+            "SELECT indexname FROM pg_indexes WHERE schemaname = 'public'"
+            " AND tablename != 'schema_migrations'")).scalars())
+
+    def test_upgrade_create_all_database(self):
+        db.drop_all()
+        migrations.clear_history(db.engine)
+        db.create_all()
+        expected = self.indexes()
+        db.session.remove()
+
+        # The tables the original models' create_all() made, unrecorded
+        db.drop_all()
+        migrations.clear_history(db.engine)
+        with db.engine.begin() as conn:
+            migrations.discover()[0].module.upgrade(conn)
+
+        ran = migrations.upgrade(db.engine)
+
+        self.assertEqual(len(ran), len(migrations.discover()))
+        self.assertEqual(self.indexes(), expected)
+        self.assertEqual(migrations.pending(db.engine), [])
+        self.assertEqual(migrations.upgrade(db.engine), [])
+
+    def test_fresh_database_matches_models(self):
+        db.drop_all()
+        migrations.clear_history(db.engine)
+        db.create_all()
+        expected = self.indexes()
+        db.session.remove()
+
+        db.drop_all()
+        migrations.upgrade(db.engine)
+
+        self.assertEqual(self.indexes(), expected)
@@ -0,0 +1,142 @@
+"""Query instrumentation and metrics tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_query_stats.py
+
+
+from app import app, current_users, page_cache, query_stats, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from flask import g, make_response
+from sqlalchemy import select
+
+from metrics import Registry, metrics
+from models import db, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class MetricsTestCase(TestCase):
+    """Test the Prometheus text format."""
+
+    def test_render(self):
+        registry = Registry()
+        hits = registry.counter('hits_total', "Hits.", labels=('page',))
+        sizes = registry.histogram('size', "Sizes.", (1, 10), labels=('page',))
+        registry.gauge('open', "Open things.", lambda: {(): 3})
+
+        hits.inc('home')
+        hits.inc('home', amount=2)
+        sizes.observe(0.5, 'home')
+        sizes.observe(5, 'home')
+        sizes.observe(50, 'home')
+
+        self.assertEqual(registry.render(), "\n".join([
+            '# HELP hits_total Hits.',
+            '# TYPE hits_total counter',
+            'hits_total{page="home"} 3',
+            '# HELP size Sizes.',
+            '# TYPE size histogram',
+            'size_bucket{page="home",le="1"} 1',
+            'size_bucket{page="home",le="10"} 2',
+            'size_bucket{page="home",le="+Inf"} 3',
+            'size_sum{page="home"} 55.5',
+            'size_count{page="home"} 3',
+            '# HELP open Open things.',
+            '# TYPE open gauge',
+            'open 3',
+        ]) + "\n")
+
+    def test_label_escaping(self):
+        registry = Registry()
+        registry.counter('c', "C.", labels=('q',)).inc('say "hi"\n')
+
+        self.assertIn(r'c{q="say \"hi\"\n"} 1', registry.render())
+
+    def test_duplicate_name(self):
+        registry = Registry()
+        registry.counter('c', "C.")
+
+        with self.assertRaises(ValueError):
+            registry.counter('c', "C again.")
+
+
+class QueryStatsTestCase(TestCase):
+    """Test per-request query counting."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id = user.id
+
+        metrics.clear()
+        current_users.clear()
+        page_cache.clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_request_recorded(self):
+        self.client.get(f"/users/{self.user_id}/following")
+
+        self.assertEqual(query_stats.queries.count('show_following'), 1)
+        self.assertEqual(query_stats.db_seconds.count('show_following'), 1)
+        self.assertEqual(query_stats.n_plus_one.value('show_following'), 0)
+
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertIn('warbler_request_queries_count{endpoint="show_following"} 1',
+                      text)
+        self.assertIn('# TYPE warbler_request_db_seconds histogram', text)
+
+    def test_counts_statements(self):
+        with app.test_request_context("/"):
+            query_stats.start_request()
+            db.session.execute(select(User.id)).all()
+            db.session.execute(select(User.username)).all()
+
+            self.assertEqual(g.queries.count, 2)
+            self.assertGreater(g.queries.seconds, 0)
+            self.assertIsNotNone(g.queries.slowest)
+
+            query_stats.finish_request(make_response(""))
+            self.assertNotIn('queries', g)
+
+    def test_n_plus_one(self):
+        threshold = app.config['QUERY_STATS_N_PLUS_ONE']
+
+        with app.test_request_context("/"):
+            query_stats.start_request()
+            for _ in range(threshold):
+                db.session.execute(select(User).where(User.id == self.user_id)).all()
+
+            statement, count = g.queries.repeated(threshold)[0]
+            self.assertEqual(count, threshold)
+            self.assertIn("FROM users", statement)
+
+            with self.assertLogs(app.logger, 'WARNING') as logs:
+                query_stats.finish_request(make_response(""))
+
+        self.assertIn("Possible N+1", logs.output[0])
+        self.assertEqual(query_stats.n_plus_one.value('homepage'), 1)
+
+    def test_outside_requests_ignored(self):
+        with app.app_context():
+            db.session.execute(select(User.id)).all()
+
+        self.assertEqual(query_stats.queries.count('unmatched'), 0)
@@ -0,0 +1,151 @@
+"""Read replica routing tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_replicas.py
+
+
+from app import app
+import os
+from unittest import TestCase
+
+from flask import Flask
+from flask_sqlalchemy import SQLAlchemy
+from sqlalchemy import literal, make_url, select, text, update
+
+from metrics import Registry
+from models import Message
+from replicas import ReplicaRouter, RoutingSession, SESSION_KEY, is_write, use_primary
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+def replica_url(**changes):
+    """The test database under another application_name, as a "replica"."""
+
+    url = make_url(app.config['SQLALCHEMY_DATABASE_URI'])
+    url = url.update_query_dict({'application_name': 'warbler-replica'})
+    return url.set(**changes).render_as_string(hide_password=False)
+
+
+class IsWriteTestCase(TestCase):
+    """Test telling writes from reads."""
+
+    def test_is_write(self):
+        self.assertFalse(is_write(select(Message)))
+        self.assertFalse(is_write(text("SELECT 1")))
+        self.assertTrue(is_write(select(Message).with_for_update()))
+        self.assertTrue(is_write(update(Message).values(like_count=0)))
+        self.assertTrue(is_write(text("DELETE FROM messages")))
+
+
+class ReplicaSettingsTestCase(TestCase):
+    """Test how long users read their own writes from the primary."""
+
+    def test_sticky_covers_lag(self):
+        test_app = Flask(__name__)
+        test_app.config['REPLICA_MAX_LAG_SECONDS'] = 30
+        ReplicaRouter(test_app, registry=Registry())
+
+        self.assertEqual(test_app.config['REPLICA_STICKY_SECONDS'], 35)
+
+    def test_sticky_shorter_than_lag(self):
+        test_app = Flask(__name__)
+        test_app.config.update(REPLICA_MAX_LAG_SECONDS=10,
+                               REPLICA_STICKY_SECONDS=5)
+
+        with self.assertRaises(ValueError):
+            ReplicaRouter(test_app, registry=Registry())
+
+
+class ReplicaRoutingTestCase(TestCase):
+    """Test which database requests read from."""
+
+    def make_app(self, replica_url=replica_url(), **config):
+        test_app = Flask(__name__)
+        test_app.config.update(
+            SECRET_KEY="secret",
+            SQLALCHEMY_DATABASE_URI=app.config['SQLALCHEMY_DATABASE_URI'],
+            SQLALCHEMY_REPLICA_URIS=[replica_url],
+            REPLICA_STICKY_SECONDS=60,
+            **config)
+
+        self.router = ReplicaRouter(test_app, registry=Registry())
+        self.db = SQLAlchemy(test_app, session_options={'class_': RoutingSession})
+        db = self.db
+
+        def served_by():
+            return db.session.execute(
+                text("SELECT current_setting('application_name')")).scalar()
+
+        @test_app.route('/read', methods=['GET', 'POST'])
+        def read():
+            return served_by()
+
+        @test_app.route('/lock')
+        def lock():
+            db.session.execute(select(literal(1)).with_for_update())
+            return served_by()
+
+        @test_app.route('/refill')
+        def refill():
+            with use_primary():
+                cached = served_by()
+            return f"{cached}|{served_by()}"
+
+        self.app = test_app
+        return test_app.test_client()
+
+    def tearDown(self):
+        with self.app.app_context():
+            for engine in self.db.engines.values():
+                engine.dispose()
+        super().tearDown()
+
+    def test_get_reads_from_replica(self):
+        client = self.make_app()
+
+        self.assertEqual(client.get('/read').text, 'warbler-replica')
+        self.assertTrue(self.router.replicas['replica0'].healthy)
+
+    def test_post_reads_from_primary(self):
+        client = self.make_app()
+
+        self.assertNotEqual(client.post('/read').text, 'warbler-replica')
+
+    def test_reads_own_writes(self):
+        client = self.make_app()
+
+        # Reads after a write in the same request go to the primary...
+        self.assertNotEqual(client.get('/lock').text, 'warbler-replica')
+        # ...and so do the user's next requests...
+        self.assertNotEqual(client.get('/read').text, 'warbler-replica')
+
+        # ...until the sticky window has passed
+        with client.session_transaction() as sess:
+            sess[SESSION_KEY] = 0
+        self.assertEqual(client.get('/read').text, 'warbler-replica')
+
+    def test_refill_cache_from_primary(self):
+        client = self.make_app()
+
+        cached, other = client.get('/refill').text.split('|')
+        self.assertNotEqual(cached, 'warbler-replica')
+        self.assertEqual(other, 'warbler-replica')
+
+    def test_replica_down(self):
+        client = self.make_app(replica_url(database='warbler-no-such-db'))
+
+        self.assertNotEqual(client.get('/read').text, 'warbler-replica')
+        self.assertFalse(self.router.replicas['replica0'].healthy)
+
+    def test_replica_behind(self):
+        client = self.make_app(REPLICA_MAX_LAG_SECONDS=-1)
+
+        self.assertNotEqual(client.get('/read').text, 'warbler-replica')
+        self.assertEqual(self.router.replicas['replica0'].lag, 0)
@@ -0,0 +1,181 @@
+"""Username and message search tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_search.py
+
+
+from app import app, current_users, CURR_USER_KEY
+import os
+from datetime import datetime
+from unittest import TestCase
+
+from werkzeug.exceptions import BadRequest
+
+from models import db, Message, MessageTerm, User, UsernameGram
+from pagination import encode_cursor
+import search
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class SearchTestCase(TestCase):
+    """Test the username trigram index and ranked search."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        for name in ["robin", "robinhood", "merrobin", "tuck"]:
+            User.signup(name, f"{name}@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_mismatched_cursor(self):
+        # Well-formed cursors whose values aren't what the sort key holds
+        bogus = [encode_cursor(values) for values in
+                 [("1",), ([1],), (1.5,), (True,), (2**63,),
+                  (datetime(2025, 1, 1),), (1, 2)]]
+
+        with app.test_request_context():
+            for cursor in bogus:
+                with self.assertRaises(BadRequest):
+                    search.search_messages("noon", before=cursor)
+            for values in [(0, 1, 1), (0, "robin", "1"), ("0", "robin", 1)]:
+                with self.assertRaises(BadRequest):
+                    search.search_users("robin", after=encode_cursor(values))
+
+        client = app.test_client()
+        for cursor in bogus:
+            self.assertEqual(client.get(f"/users?before={cursor}").status_code, 400)
+
+    def usernames(self, q):
+        with app.test_request_context():
+            return [user.username for user in search.search_users(q).items]
+
+    def test_ranking(self):
+        self.assertEqual(self.usernames("robin"), ["robin", "robinhood", "merrobin"])
+
+    def test_short_query_is_prefix(self):
+        self.assertEqual(self.usernames("tu"), ["tuck"])
+        self.assertEqual(self.usernames("uc"), [])
+
+    def test_pagination(self):
+        User.signup("Robinet", "robinet@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        User.signup("sirrobin", "sirrobin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+
+        with app.test_request_context():
+            first = search.search_users("robin", limit=2)
+            second = search.search_users("robin", before=first.before, limit=2)
+            third = search.search_users("robin", before=second.before, limit=2)
+            back = search.search_users("robin", after=third.after, limit=2)
+
+        def names(page):
+            return [user.username for user in page.items]
+
+        self.assertEqual(names(first), ["robin", "Robinet"])
+        self.assertEqual(names(second), ["robinhood", "merrobin"])
+        self.assertEqual(names(third), ["sirrobin"])
+        self.assertIsNone(third.before)
+        self.assertEqual(names(back), names(second))
+        self.assertIsNotNone(back.after)
+
+    def test_rename_updates_index(self):
+        user = User.query.filter_by(username="tuck").one()
+        user.username = "friartuck"
+        db.session.commit()
+
+        self.assertEqual(self.usernames("friar"), ["friartuck"])
+
+    def test_reindex(self):
+        UsernameGram.query.delete()
+        db.session.commit()
+        # Prefix matches don't need the trigram index
+        self.assertEqual(self.usernames("robin"), ["robin", "robinhood"])
+
+        search.reindex_users()
+        self.assertEqual(self.usernames("robin"), ["robin", "robinhood", "merrobin"])
+
+
+class MessageSearchTestCase(TestCase):
+    """Test the full-text message index and AND search."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id = user.id
+
+        texts = ["Archery at noon", "Noon feast in the forest",
+                 "Archery in the forest at noon", "Nothing to see"]
+        for i, text in enumerate(texts, start=1):
+            db.session.add(Message(id=i, text=text, user_id=user.id))
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def message_ids(self, q, **cursor):
+        with app.test_request_context():
+            return search.search_messages(q, **cursor)
+
+    def test_no_like_button_on_own_messages(self):
+        tuck = User.signup("tuck", "tuck@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        tuck_id = tuck.id
+        current_users.clear()
+
+        client = app.test_client()
+        for viewer_id, buttons in [(self.user_id, 0), (tuck_id, 3)]:
+            with client.session_transaction() as sess:
+                sess[CURR_USER_KEY] = viewer_id
+            page = client.get("/messages/search?q=noon").get_data(as_text=True)
+            self.assertEqual(page.count("/users/add_like/"), buttons)
+
+    def test_and_query(self):
+        self.assertEqual([msg.id for msg in self.message_ids("noon").items], [3, 2, 1])
+        self.assertEqual([msg.id for msg in self.message_ids("Forest NOON").items], [3, 2])
+        self.assertEqual(self.message_ids("forest dragons").items, [])
+        self.assertEqual(self.message_ids("the").items, [])
+
+    def test_pagination(self):
+        first = self.message_ids("noon", limit=2)
+        self.assertEqual([msg.id for msg in first.items], [3, 2])
+
+        second = self.message_ids("noon", before=first.before, limit=2)
+        self.assertEqual([msg.id for msg in second.items], [1])
+        self.assertIsNone(second.before)
+
+    def test_edit_and_delete_update_index(self):
+        msg = db.session.get(Message, 4)
+        msg.text = "Archery lesson at noon"
+        db.session.commit()
+        self.assertEqual([m.id for m in self.message_ids("archery noon").items], [4, 3, 1])
+
+        db.session.delete(msg)
+        db.session.commit()
+        self.assertEqual(MessageTerm.query.filter_by(message_id=4).count(), 0)
+
+    def test_reindex(self):
+        MessageTerm.query.delete()
+        db.session.commit()
+        self.assertEqual(self.message_ids("noon").items, [])
+
+        search.reindex_messages()
+        self.assertEqual([msg.id for msg in self.message_ids("noon").items], [3, 2, 1])
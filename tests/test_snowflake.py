@@ -0,0 +1,186 @@
+"""Snowflake message id tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_snowflake.py
+
+
+from app import app, current_users, CURR_USER_KEY
+import os
+import runpy
+import threading
+import time
+from datetime import datetime
+from types import SimpleNamespace
+from unittest import TestCase
+
+from flask import Flask
+
+from models import db, Message, User
+from pagination import encode_cursor
+from snowflake import (IdGenerator, created_at, first_id_at, worker_id_for,
+                       EPOCH, OFFLINE_SLOT)
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class FakeClock:
+    def __init__(self, millis):
+        self.millis = millis
+
+    def __call__(self):
+        return (EPOCH + self.millis) / 1000
+
+
+class IdGeneratorTestCase(TestCase):
+    """Test making ids."""
+
+    def test_layout(self):
+        ids = IdGenerator(worker_id=5, clock=FakeClock(1000))
+
+        self.assertEqual(ids.next_id(), (1000 << 22) | (5 << 12) | 0)
+        self.assertEqual(ids.next_id(), (1000 << 22) | (5 << 12) | 1)
+
+    def test_increasing(self):
+        ids = IdGenerator()
+        made = [ids.next_id() for _ in range(10000)]
+
+        self.assertEqual(made, sorted(set(made)))
+
+    def test_unique_across_threads(self):
+        ids = IdGenerator()
+        made = []
+
+        def make():
+            made.extend(ids.next_id() for _ in range(2000))
+
+        threads = [threading.Thread(target=make) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(len(set(made)), 8000)
+
+    def test_workers_differ(self):
+        clock = FakeClock(1000)
+        one = IdGenerator(worker_id=1, clock=clock)
+        two = IdGenerator(worker_id=2, clock=clock)
+
+        self.assertNotEqual(one.next_id(), two.next_id())
+
+    def test_clock_backwards(self):
+        clock = FakeClock(1000)
+        ids = IdGenerator(clock=clock)
+        first = ids.next_id()
+
+        clock.millis = 500
+        self.assertGreater(ids.next_id(), first)
+
+    def test_sequence_exhausted(self):
+        clock = FakeClock(1000)
+        ids = IdGenerator(clock=clock)
+        for _ in range(4096):
+            ids.next_id()
+
+        # The next id borrows the next millisecond instead of waiting for it
+        self.assertEqual(ids.next_id(), 1001 << 22)
+        self.assertEqual(ids.next_id(), (1001 << 22) | 1)
+
+        # Once the clock gets there, ids carry on from the borrowed one
+        clock.millis = 1001
+        self.assertEqual(ids.next_id(), (1001 << 22) | 2)
+
+    def test_clock_backwards_sequence_exhausted(self):
+        clock = FakeClock(60000)
+        ids = IdGenerator(clock=clock)
+        first = ids.next_id()
+
+        # A clock stepped back a minute doesn't stall ids until it catches up
+        clock.millis = 0
+        started = time.monotonic()
+        made = [ids.next_id() for _ in range(3 * 4096)]
+        self.assertLess(time.monotonic() - started, 5)
+
+        self.assertEqual(made, sorted(set(made)))
+        self.assertGreater(made[0], first)
+        self.assertEqual(made[-1] >> 22, 60003)
+
+    def test_worker_id_range(self):
+        with self.assertRaises(ValueError):
+            IdGenerator(worker_id=1024)
+
+    def test_offline_slot_not_given_to_workers(self):
+        conf = runpy.run_path(os.path.join(app.root_path, 'gunicorn.conf.py'))
+        workers = {pid: SimpleNamespace() for pid in range(OFFLINE_SLOT)}
+        server = SimpleNamespace(WORKERS=workers)
+
+        for worker in workers.values():
+            conf['pre_fork'](server, worker)
+        self.assertEqual(sorted(w.snowflake_slot for w in workers.values()),
+                         list(range(OFFLINE_SLOT)))
+
+        with self.assertRaises(RuntimeError):
+            conf['pre_fork'](server, SimpleNamespace())
+
+    def test_offline_default(self):
+        ids = IdGenerator()
+        ids.init_app(Flask(__name__))
+
+        self.assertEqual(ids.worker_id, worker_id_for(0, OFFLINE_SLOT))
+        self.assertEqual(worker_id_for(2, OFFLINE_SLOT), 95)
+
+    def test_times(self):
+        when = datetime(2025, 3, 4, 5, 6, 7, 8000)
+        ids = IdGenerator(worker_id=3, clock=FakeClock(0))
+        ids.clock = lambda: (when - datetime(1970, 1, 1)).total_seconds()
+
+        id = ids.next_id()
+        self.assertEqual(created_at(id), when)
+        self.assertEqual(first_id_at(when), id & ~((1 << 22) - 1))
+
+
+class MessageIdTestCase(TestCase):
+    """Test messages' ids and timestamps."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id = user.id
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_messages_ordered_by_id(self):
+        first = Message(text="first", user_id=self.user_id)
+        db.session.add(first)
+        db.session.commit()
+        second = Message(text="second", user_id=self.user_id)
+        db.session.add(second)
+        db.session.commit()
+
+        self.assertGreater(second.id, first.id)
+        self.assertGreater(second.id, 2**32)
+        self.assertLess(first.timestamp, second.timestamp)
+
+    def test_old_cursor_rejected(self):
+        current_users.clear()
+        with app.test_client() as c:
+            with c.session_transaction() as sess:
+                sess[CURR_USER_KEY] = self.user_id
+
+            cursor = encode_cursor((datetime(2024, 5, 1), 10))
+            resp = c.get(f"/users/{self.user_id}?before={cursor}")
+
+        self.assertEqual(resp.status_code, 400)
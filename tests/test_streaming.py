@@ -0,0 +1,98 @@
+"""Streamed page rendering tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_streaming.py
+
+
+from app import app, current_users, CURR_USER_KEY
+import os
+from unittest import TestCase
+
+from sqlalchemy import event
+
+from models import db, Likes, Message, User
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class StreamingTestCase(TestCase):
+    """Test that timeline pages are sent in chunks."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        user = User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        self.user_id = user.id
+
+        db.session.add_all([Message(text=f"Arrow number {i}", user_id=self.user_id)
+                            for i in range(40)])
+        db.session.commit()
+
+        self.chunk_size = app.config['STREAM_CHUNK_SIZE']
+        app.config['STREAM_CHUNK_SIZE'] = 1024
+
+        current_users.clear()
+        self.client = app.test_client()
+        with self.client.session_transaction() as sess:
+            sess[CURR_USER_KEY] = self.user_id
+
+    def tearDown(self):
+        app.config['STREAM_CHUNK_SIZE'] = self.chunk_size
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_profile_streams(self):
+        resp = self.client.get(f"/users/{self.user_id}", buffered=False)
+
+        self.assertTrue(resp.is_streamed)
+        chunks = list(resp.response)
+        resp.close()
+
+        self.assertGreater(len(chunks), 5)
+        self.assertIn(b"<head>", chunks[0])
+        self.assertEqual(b"".join(chunks).count(b'class="message-link"'), 40)
+
+    def test_no_queries_while_streaming(self):
+        tuck = User.signup("tuck", "tuck@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        tuck_id = tuck.id
+        db.session.add_all([Likes(user_id=tuck_id, message_id=msg.id)
+                            for msg in Message.query.limit(10)])
+        db.session.commit()
+
+        # Someone else's likes page, which asks whether robin follows them
+        resp = self.client.get(f"/users/{tuck_id}/likes", buffered=False)
+        self.assertTrue(resp.is_streamed)
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            page = b"".join(resp.response)
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+            resp.close()
+
+        self.assertEqual(statements, [])
+        self.assertIn(b"Follow", page)
+        self.assertEqual(page.count(b'class="message-link"'), 10)
+
+    def test_flashes_shown_once(self):
+        with self.client.session_transaction() as sess:
+            sess["_flashes"] = [("success", "Bullseye!")]
+
+        self.assertIn("Bullseye!", self.client.get("/").get_data(as_text=True))
+        self.assertNotIn("Bullseye!", self.client.get("/").get_data(as_text=True))
@@ -0,0 +1,190 @@
+"""Home timeline tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_timelines.py
+
+
+from app import app
+import os
+from unittest import TestCase
+
+from models import db, User, Message, TimelineEntry
+import counters
+import timelines
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class TimelineTestCase(TestCase):
+    """Test fan-out and maintenance of materialized timelines."""
+
+    def setUp(self):
+        """Create two users where u1 follows u2."""
+
+        db.drop_all()
+        db.create_all()
+
+        self.u1 = User.signup("test1", "email1@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+        self.u2 = User.signup("test2", "email2@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+        self.u1.following.append(self.u2)
+        db.session.flush()
+        counters.reconcile()
+        db.session.commit()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def post(self, user, text):
+        msg = Message(text=text, user_id=user.id)
+        db.session.add(msg)
+        db.session.flush()
+        timelines.push_message(msg)
+        db.session.commit()
+        return msg
+
+    def test_push_message(self):
+        msg = self.post(self.u2, "hello followers")
+
+        self.assertEqual([m.id for m in timelines.read(self.u1.id).items], [msg.id])
+        self.assertEqual([m.id for m in timelines.read(self.u2.id).items], [msg.id])
+
+    def test_push_skips_non_followers(self):
+        self.post(self.u1, "only for me")
+
+        self.assertEqual(len(timelines.read(self.u1.id).items), 1)
+        self.assertEqual(timelines.read(self.u2.id).items, [])
+
+    def test_remove_message(self):
+        msg = self.post(self.u2, "soon gone")
+        timelines.remove_message(msg)
+        db.session.commit()
+
+        self.assertEqual(TimelineEntry.query.count(), 0)
+
+    def test_follow_and_unfollow(self):
+        msg = self.post(self.u1, "from u1")
+
+        self.u2.following.append(self.u1)
+        db.session.flush()
+        timelines.follow(self.u2.id, self.u1.id)
+        db.session.commit()
+        self.assertIn(msg.id, [m.id for m in timelines.read(self.u2.id).items])
+
+        self.u2.following.remove(self.u1)
+        timelines.unfollow(self.u2.id, self.u1.id)
+        db.session.commit()
+        self.assertEqual(timelines.read(self.u2.id).items, [])
+
+    def test_trim(self):
+        old = app.config['TIMELINE_MAX_LENGTH'], app.config['TIMELINE_TRIM_EVERY']
+        app.config['TIMELINE_MAX_LENGTH'] = 2
+        try:
+            # Posts that trim no timelines leave them over the cap...
+            app.config['TIMELINE_TRIM_EVERY'] = 10**9
+            for i in range(3):
+                self.post(self.u2, f"warble {i}")
+            entries = TimelineEntry.query.filter_by(user_id=self.u1.id).count()
+            self.assertEqual(entries, 3)
+
+            # ...until one trims them
+            app.config['TIMELINE_TRIM_EVERY'] = 1
+            self.post(self.u2, "warble 3")
+        finally:
+            app.config['TIMELINE_MAX_LENGTH'], app.config['TIMELINE_TRIM_EVERY'] = old
+
+        entries = TimelineEntry.query.filter_by(user_id=self.u1.id).count()
+        self.assertEqual(entries, 2)
+
+    def test_rebuild(self):
+        msg = self.post(self.u2, "rebuild me")
+        TimelineEntry.query.delete()
+        db.session.commit()
+
+        timelines.rebuild(self.u1.id)
+        db.session.commit()
+
+        self.assertEqual([m.id for m in timelines.read(self.u1.id).items], [msg.id])
+
+    def test_pulled_author(self):
+        old_threshold = app.config['TIMELINE_FANOUT_THRESHOLD']
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 1
+        try:
+            # A follow takes u2 to the threshold
+            timelines.follow(self.u1.id, self.u2.id)
+            db.session.commit()
+            self.assertTrue(timelines.is_pulled(self.u2.id))
+
+            msg = self.post(self.u2, "too famous to push")
+
+            pushed = TimelineEntry.query.filter_by(user_id=self.u1.id).count()
+            self.assertEqual(pushed, 0)
+            self.assertEqual([m.id for m in timelines.read(self.u1.id).items], [msg.id])
+        finally:
+            app.config['TIMELINE_FANOUT_THRESHOLD'] = old_threshold
+
+    def test_back_below_threshold(self):
+        thresholds = (app.config['TIMELINE_FANOUT_THRESHOLD'],
+                      app.config['TIMELINE_PUSH_THRESHOLD'])
+        app.config['TIMELINE_FANOUT_THRESHOLD'] = 2
+        app.config['TIMELINE_PUSH_THRESHOLD'] = 1
+        try:
+            u3 = User.signup("test3", "email3@email.com", "password", None, bio="Bio", location="Canada", header_image_url="http://")
+            u3.following.append(self.u2)
+            db.session.flush()
+            counters.followed(u3.id, self.u2.id)
+            timelines.follow(u3.id, self.u2.id)
+            db.session.commit()
+
+            pulled = self.post(self.u2, "posted while pulled")
+            self.assertEqual(TimelineEntry.query.filter_by(user_id=self.u1.id).count(), 0)
+
+            # One unfollow takes u2 under the fan-out threshold, but not
+            # under the push threshold: still pulled, still on u1's timeline
+            u3.following.remove(self.u2)
+            counters.unfollowed(u3.id, self.u2.id)
+            timelines.unfollow(u3.id, self.u2.id)
+            db.session.commit()
+            self.assertTrue(timelines.is_pulled(self.u2.id))
+            self.assertEqual([m.id for m in timelines.read(self.u1.id).items], [pulled.id])
+            self.assertEqual(timelines.settle_all(), [])
+
+            # Under the push threshold, settling pushes the older message to
+            # u1 before u2's messages stop being pulled
+            app.config['TIMELINE_PUSH_THRESHOLD'] = 2
+            self.assertEqual(timelines.settle_all(), [self.u2.id])
+            self.assertFalse(timelines.is_pulled(self.u2.id))
+            self.assertEqual(TimelineEntry.query.filter_by(
+                user_id=self.u1.id, message_id=pulled.id).count(), 1)
+            self.assertEqual([m.id for m in timelines.read(self.u1.id).items], [pulled.id])
+
+            pushed = self.post(self.u2, "pushed again")
+            self.assertEqual([m.id for m in timelines.read(self.u1.id).items],
+                             [pushed.id, pulled.id])
+        finally:
+            (app.config['TIMELINE_FANOUT_THRESHOLD'],
+             app.config['TIMELINE_PUSH_THRESHOLD']) = thresholds
+
+    def test_read_pages(self):
+        msgs = [self.post(self.u2, f"warble {i}") for i in range(3)]
+        newest_first = [m.id for m in reversed(msgs)]
+
+        with app.test_request_context():
+            first = timelines.read(self.u1.id, limit=2)
+            self.assertEqual([m.id for m in first.items], newest_first[:2])
+            self.assertIsNone(first.after)
+
+            second = timelines.read(self.u1.id, before=first.before, limit=2)
+            self.assertEqual([m.id for m in second.items], newest_first[2:])
+            self.assertIsNone(second.before)
+
+            back = timelines.read(self.u1.id, after=second.after, limit=2)
+            self.assertEqual([m.id for m in back.items], newest_first[:2])
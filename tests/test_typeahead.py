@@ -0,0 +1,139 @@
+"""Username typeahead index tests."""
+
+# run these tests like:
+#
+#    python -m unittest test_typeahead.py
+
+
+from app import app
+import os
+import threading
+from datetime import datetime
+from unittest import TestCase
+
+from sqlalchemy import event, select
+
+from models import db, User
+from typeahead import UsernameIndex, usernames
+
+# BEFORE we import our app, let's set an environmental variable
+# to use a different database for tests (we need to do this
+# before we import our app, since that will have already
+# connected to the database
+
+os.environ['DATABASE_URL'] = "postgresql:///warbler-test"
+
+
+class UsernameIndexTestCase(TestCase):
+    """Test the sorted prefix index behind /users/autocomplete."""
+
+    def setUp(self):
+        self.index = UsernameIndex(max_size=5)
+        self.index.load([(1, "robin", 0, datetime(2025, 1, 1)),
+                         (2, "Robinhood", 0, datetime(2025, 1, 2)),
+                         (3, "tuck", 0, datetime(2025, 1, 4)),
+                         (4, "rob", 0, datetime(2025, 1, 3))])
+
+    def test_complete(self):
+        self.assertEqual(self.index.complete("rob"),
+                         [(4, "rob"), (1, "robin"), (2, "Robinhood")])
+        self.assertEqual(self.index.complete("ROBIN", limit=1), [(1, "robin")])
+        self.assertEqual(self.index.complete("x"), [])
+
+    def test_add_and_remove(self):
+        self.index.add(5, "robert")
+        self.assertIn((5, "robert"), self.index.complete("rob"))
+
+        self.index.remove(1, "robin")
+        self.assertNotIn((1, "robin"), self.index.complete("rob"))
+
+    def test_max_size(self):
+        self.index.add(5, "marian")
+        self.index.add(6, "john")
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.complete("john"), [])
+
+    def test_keeps_most_followed(self):
+        # Over max_size, the index keeps the most-followed users, not the
+        # first names in alphabetical order
+        self.index.load([(i, f"aaron{i}", 0, datetime(2025, 1, 1))
+                         for i in range(1, 6)]
+                        + [(6, "zed", 100, datetime(2025, 1, 2)),
+                           (7, "yolanda", 5, datetime(2025, 1, 3))])
+
+        self.assertEqual(len(self.index), 5)
+        self.assertEqual(self.index.complete("zed"), [(6, "zed")])
+        self.assertEqual(self.index.complete("yo"), [(7, "yolanda")])
+        self.assertEqual(len(self.index.complete("aaron")), 3)
+        self.assertEqual(self.index.changed_through, datetime(2025, 1, 3))
+
+    def test_catch_up(self):
+        self.assertEqual(self.index.changed_through, datetime(2025, 1, 4))
+
+        # A window that overlaps what the index has already seen
+        self.index.catch_up([(3, "tuck", 0, datetime(2025, 1, 4)),
+                             (7, "alan", 0, datetime(2025, 1, 3, 12)),
+                             (6, "john", 0, datetime(2025, 1, 5))])
+        self.assertEqual(self.index.changed_through, datetime(2025, 1, 5))
+        self.assertEqual(self.index.complete("al"), [(7, "alan")])
+        self.assertEqual(self.index.complete("tuck"), [(3, "tuck")])
+
+        # Full, but still moving on past the users it couldn't take
+        self.index.catch_up([(8, "marian", 0, datetime(2025, 1, 6))])
+        self.assertEqual(self.index.changed_through, datetime(2025, 1, 6))
+        self.assertEqual(self.index.complete("marian"), [])
+
+    def test_add_twice(self):
+        self.index.add(4, "rob")
+        self.assertEqual(len(self.index), 4)
+
+
+class AutocompleteTestCase(TestCase):
+    """Test /users/autocomplete and how it keeps its index current."""
+
+    def setUp(self):
+        db.drop_all()
+        db.create_all()
+
+        User.signup("robin", "robin@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        usernames.load(db.session.execute(
+            select(User.id, User.username, User.followers_count,
+                   User.names_changed_at)))
+
+        self.client = app.test_client()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.create_all()
+        super().tearDown()
+
+    def test_reload_in_background(self):
+        User.signup("robert", "robert@test.com", "password", None, bio="Bio", location="Sherwood", header_image_url="http://")
+        db.session.commit()
+        usernames.loaded_at = usernames.synced_at = float('-inf')
+
+        statements = []
+
+        def record(conn, cursor, statement, *args):
+            if threading.current_thread() is threading.main_thread():
+                statements.append(statement)
+
+        event.listen(db.engine, "before_cursor_execute", record)
+        try:
+            resp = self.client.get("/users/autocomplete?q=rob")
+        finally:
+            event.remove(db.engine, "before_cursor_execute", record)
+
+        # The request answered from the old index without reading users...
+        self.assertEqual([user['username'] for user in resp.json['users']], ["robin"])
+        self.assertFalse([s for s in statements if "FROM users" in s])
+
+        # ...while the rebuild ran on its own thread
+        for thread in threading.enumerate():
+            if thread.name == 'reload-UsernameIndex':
+                thread.join()
+        self.assertFalse(usernames.syncing.locked())
+        self.assertEqual([name for _, name in usernames.complete("rob")],
+                         ["robert", "robin"])
@@ -5,7 +5,7 @@
 #    FLASK_ENV=production python -m unittest test_message_views.py
 
 
-from app import app, CURR_USER_KEY
+from app import app, current_users, page_cache, CURR_USER_KEY
 import os
 from unittest import TestCase
 
@@ -44,6 +44,8 @@ class UserViewTestCase(TestCase):
         db.create_all()
 
         self.client = app.test_client()
+        current_users.clear()
+        page_cache.clear()
 
         self.testuser = User.signup(
         username="testuser",
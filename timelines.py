@@ -0,0 +1,354 @@
+"""Materialized home timelines for Warbler.
+
+Every user has a capped list of message ids in `timeline_entries`. A new
+message is pushed into its author's and its followers' timelines when it is
+posted (fan-out on write), so reading a home timeline is one bounded range
+scan instead of an IN-list over everyone the user follows. Cutting a
+timeline back to TIMELINE_MAX_LENGTH means walking that many entries, so a
+post only trims a random one in TIMELINE_TRIM_EVERY of the timelines it
+goes into; each runs about that many entries over the cap.
+
+Authors with at least TIMELINE_FANOUT_THRESHOLD followers are not pushed.
+Their messages are pulled at read time and merged into the timeline instead,
+so the cost of a single post stays bounded no matter how popular its author.
+
+Which authors are pulled is stored (`users.timeline_pulled`), not worked
+out from followers_count on each read: messages posted while an author
+was pulled are in no follower's timeline, so reads must go on pulling
+them until they have been pushed. An author is switched to pull as soon
+as a follow takes them to the threshold. They are switched back only
+once they are down to fewer than TIMELINE_PUSH_THRESHOLD followers, by
+`settle()` (`flask settle-timelines`), which pushes their latest messages
+to their followers in the same transaction. The gap between the two
+thresholds keeps an author hovering around one from switching back and
+forth.
+
+None of these functions commit; they run inside the caller's transaction.
+"""
+
+from flask import current_app
+from sqlalchemy import delete, func, insert, literal, select, true, union, union_all, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import aliased
+
+from models import db, Follows, Message, TimelineEntry, User
+from pagination import keyset, paginate
+from read_models import select_message_rows, to_message_row
+
+
+def max_length():
+    """How many entries each timeline keeps."""
+
+    return current_app.config['TIMELINE_MAX_LENGTH']
+
+
+def trim_every():
+    """A post trims about one in this many of the timelines it goes into."""
+
+    return current_app.config['TIMELINE_TRIM_EVERY']
+
+
+def fanout_threshold():
+    """Follower count at which an author switches from push to pull."""
+
+    return current_app.config['TIMELINE_FANOUT_THRESHOLD']
+
+
+def push_threshold():
+    """Follower count below which a pulled author can go back to push."""
+
+    return current_app.config['TIMELINE_PUSH_THRESHOLD']
+
+
+def is_pulled(user_id, lock=False):
+    """Are this author's messages pulled at read time instead of pushed?
+
+    With `lock`, the author can't be switched until the transaction ends.
+    """
+
+    stmt = select(User.timeline_pulled).where(User.id == user_id)
+    if lock:
+        stmt = stmt.with_for_update(read=True)
+
+    return bool(db.session.execute(stmt).scalar())
+
+
+def _followees(user_id, pulled):
+    """Select the ids of followed users whose messages are pulled (or not)."""
+
+    return (select(Follows.user_being_followed_id)
+            .join(User, User.id == Follows.user_being_followed_id)
+            .where(Follows.user_following_id == user_id,
+                   User.timeline_pulled if pulled else ~User.timeline_pulled))
+
+
+def pulled_followees(user_id):
+    """Select the ids of followed users whose messages are pulled."""
+
+    return _followees(user_id, pulled=True)
+
+
+def read(user_id, before=None, after=None, limit=None):
+    """Return one keyset Page of MessageRows from this user's home timeline.
+
+    Merges the pushed timeline entries with the latest messages of any
+    pulled authors the user follows; the pushed entries and each pulled
+    author's messages are cut to one page before the merge. UNION drops
+    duplicates left over from before an author crossed the threshold.
+    """
+
+    pushed = keyset(
+        select(TimelineEntry.message_id.label('message_id'))
+        .where(TimelineEntry.user_id == user_id),
+        (TimelineEntry.message_id,),
+        before, after, limit,
+    ).subquery()
+
+    # One page from each pulled author, read off their messages index
+    authors = pulled_followees(user_id).subquery('authors')
+    latest = keyset(
+        select(Message.id.label('message_id'))
+        .where(Message.user_id == authors.c.user_being_followed_id),
+        (Message.id,),
+        before, after, limit,
+    ).lateral('latest')
+    pulled = (select(latest.c.message_id)
+              .select_from(authors.join(latest, true()))
+              .subquery())
+    feed = union(select(pushed), select(pulled)).subquery('feed')
+
+    return paginate(
+        select_message_rows().join(feed, feed.c.message_id == Message.id),
+        (feed.c.message_id,),
+        before, after, limit,
+        row_factory=to_message_row,
+    )
+
+
+def latest(user_id):
+    """The id of the newest message on this user's home timeline, or None.
+
+    Cheap next to `read()`: one index lookup into the pushed entries and
+    one per pulled author.
+    """
+
+    pushed = (select(func.max(TimelineEntry.message_id))
+              .where(TimelineEntry.user_id == user_id)
+              .scalar_subquery())
+
+    authors = pulled_followees(user_id).subquery('authors')
+    newest = (select(func.max(Message.id).label('message_id'))
+              .where(Message.user_id == authors.c.user_being_followed_id)
+              .lateral('newest'))
+    pulled = (select(func.max(newest.c.message_id))
+              .select_from(authors.join(newest, true()))
+              .scalar_subquery())
+
+    return db.session.execute(select(func.greatest(pushed, pulled))).scalar()
+
+
+def push_message(msg):
+    """Fan a newly-flushed message out to its author and their followers.
+
+    Messages by pulled authors only go into the author's own timeline.
+    """
+
+    recipients = select(literal(msg.user_id).label('user_id'))
+    if not is_pulled(msg.user_id, lock=True):
+        followers = (select(Follows.user_following_id.label('user_id'))
+                     .where(Follows.user_being_followed_id == msg.user_id))
+        recipients = union_all(recipients, followers)
+    recipients = recipients.subquery('recipients')
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(
+            ['user_id', 'message_id'],
+            select(recipients.c.user_id, literal(msg.id)),
+        )
+    )
+    _trim(select(recipients.c.user_id)
+          .where(func.random() * trim_every() < 1)
+          .subquery('trimmed'))
+
+
+def remove_message(msg):
+    """Take a message out of every timeline it was pushed to."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.message_id == msg.id)
+        .execution_options(synchronize_session=False)
+    )
+
+
+def follow(follower_id, followed_id):
+    """Backfill a follower's timeline with the newly followed user's messages.
+
+    Pulled authors need no backfill; their messages are merged in on read.
+    A followed author who has reached the fan-out threshold is switched
+    to pull here; call after counting the follow.
+    """
+
+    db.session.execute(
+        update(User)
+        .where(User.id == followed_id,
+               User.followers_count >= fanout_threshold())
+        .values(timeline_pulled=True)
+        .execution_options(synchronize_session=False)
+    )
+
+    if is_pulled(followed_id):
+        return
+
+    already_there = (select(TimelineEntry.message_id)
+                     .where(TimelineEntry.user_id == follower_id))
+    latest = (select(literal(follower_id), Message.id)
+              .where(Message.user_id == followed_id,
+                     Message.id.not_in(already_there))
+              .order_by(Message.id.desc())
+              .limit(max_length()))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(['user_id', 'message_id'], latest)
+    )
+    _trim(select(literal(follower_id).label('user_id')).subquery('recipients'))
+
+
+def unfollow(follower_id, followed_id):
+    """Drop an unfollowed user's messages from the follower's timeline."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == follower_id,
+               TimelineEntry.message_id.in_(
+                   select(Message.id).where(Message.user_id == followed_id)))
+        .execution_options(synchronize_session=False)
+    )
+
+
+def settle(user_id):
+    """Switch an author back to push if they have fewer than
+    TIMELINE_PUSH_THRESHOLD followers. Returns whether they were switched.
+
+    Their latest messages go into every follower's timeline first, so
+    none of them drop out of those timelines when reads stop pulling
+    them. The author's row stays locked until the caller commits, so no
+    message of theirs is posted in between.
+    """
+
+    followers = db.session.execute(
+        select(User.followers_count)
+        .where(User.id == user_id, User.timeline_pulled)
+        .with_for_update()
+    ).scalar()
+    if followers is None or followers >= push_threshold():
+        return False
+
+    followers = (select(Follows.user_following_id.label('user_id'))
+                 .where(Follows.user_being_followed_id == user_id)
+                 .subquery('recipients'))
+    latest = (select(Message.id)
+              .where(Message.user_id == user_id)
+              .order_by(Message.id.desc())
+              .limit(max_length())
+              .subquery('latest'))
+
+    db.session.execute(
+        pg_insert(TimelineEntry)
+        .from_select(['user_id', 'message_id'],
+                     select(followers.c.user_id, latest.c.id)
+                     .select_from(followers.join(latest, true())))
+        .on_conflict_do_nothing()
+    )
+    _trim(followers)
+
+    db.session.execute(
+        update(User)
+        .where(User.id == user_id)
+        .values(timeline_pulled=False)
+        .execution_options(synchronize_session=False)
+    )
+
+    return True
+
+
+def settle_all():
+    """Switch every pulled author who is down to fewer than
+    TIMELINE_PUSH_THRESHOLD followers back to push, committing after
+    each. Returns the ids of the authors switched.
+    """
+
+    user_ids = db.session.execute(
+        select(User.id)
+        .where(User.timeline_pulled,
+               User.followers_count < push_threshold())
+        .order_by(User.id)).scalars().all()
+
+    switched = []
+    for user_id in user_ids:
+        if settle(user_id):
+            switched.append(user_id)
+        db.session.commit()
+
+    return switched
+
+
+def rebuild(user_id):
+    """Recreate one user's timeline from scratch out of follows and messages."""
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == user_id)
+        .execution_options(synchronize_session=False)
+    )
+
+    followed = _followees(user_id, pulled=False)
+    latest = (select(literal(user_id), Message.id)
+              .where((Message.user_id == user_id)
+                     | Message.user_id.in_(followed))
+              .order_by(Message.id.desc())
+              .limit(max_length()))
+
+    db.session.execute(
+        insert(TimelineEntry).from_select(['user_id', 'message_id'], latest)
+    )
+
+
+def rebuild_all(batch_size=500):
+    """Rebuild every user's timeline, committing every `batch_size` users."""
+
+    user_ids = db.session.execute(select(User.id).order_by(User.id)).scalars()
+
+    for count, user_id in enumerate(user_ids.all(), start=1):
+        rebuild(user_id)
+        if count % batch_size == 0:
+            db.session.commit()
+
+    db.session.commit()
+
+
+def _trim(recipients):
+    """Cut the timelines of everyone in `recipients` back to the max length.
+
+    `recipients` is a subquery with a `user_id` column. For each of those
+    users we find the first entry past the cap with one index probe and
+    delete it along with everything older.
+    """
+
+    entry = aliased(TimelineEntry)
+    boundary = (select(entry.message_id)
+                .where(entry.user_id == recipients.c.user_id)
+                .order_by(entry.message_id.desc())
+                .offset(max_length())
+                .limit(1)
+                .lateral('boundary'))
+    cutoffs = (select(recipients.c.user_id, boundary.c.message_id)
+               .select_from(recipients.join(boundary, true()))
+               .subquery('cutoffs'))
+
+    db.session.execute(
+        delete(TimelineEntry)
+        .where(TimelineEntry.user_id == cutoffs.c.user_id,
+               TimelineEntry.message_id <= cutoffs.c.message_id)
+        .execution_options(synchronize_session=False)
+    )
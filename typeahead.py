@@ -0,0 +1,142 @@
+"""In-process username typeahead.
+
+Usernames are kept lowercased in one sorted list, with the display names
+and user ids in parallel arrays. That is a flattened prefix trie: every
+username starting with a given prefix sits in one contiguous run, found
+with a binary search, so a lookup is O(log n + limit) with no per-node
+overhead. The index holds at most `max_size` names to keep memory bounded:
+when there are more users than that, `load()` keeps the most-followed
+ones (the likeliest to be looked up), whatever their names. Once full, the
+index takes no new names until the next rebuild picks again.
+
+Each worker process has its own index. It is loaded from `users` at
+startup and updated in place by signups, renames and deletes that happen
+in the same process. `catch_up()` adds the users whose names other
+workers set since, found by `users.names_changed_at` just like in the
+availability filter (see availability.py). The old names of users other
+workers renamed or deleted stay in the index until it is next rebuilt
+with `load()`.
+"""
+
+import bisect
+import heapq
+import threading
+import time
+from array import array
+
+
+class UsernameIndex:
+    """Sorted, prefix-searchable index of (user id, username)."""
+
+    def __init__(self, max_size=2_000_000):
+        self.max_size = max_size
+        # The latest names_changed_at read from the database
+        self.changed_through = None
+        self.loaded_at = 0.0
+        self.synced_at = 0.0
+        self.syncing = threading.Lock()
+        self._keys = []
+        self._names = []
+        self._ids = array('q')
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def load(self, rows):
+        """Replace the index with `rows` of (user id, username,
+        followers_count, names_changed_at).
+
+        Past `max_size` rows, the users with the most followers are kept.
+        """
+
+        changed_through = None
+        users = []
+        for user_id, name, followers, changed_at in rows:
+            users.append((followers, user_id, name))
+            if changed_through is None or changed_at > changed_through:
+                changed_through = changed_at
+        if len(users) > self.max_size:
+            users = heapq.nlargest(self.max_size, users)
+        entries = sorted((self._key(name), name, user_id)
+                         for _, user_id, name in users)
+
+        with self._lock:
+            self._keys = [key for key, _, _ in entries]
+            self._names = [name for _, name, _ in entries]
+            self._ids = array('q', (user_id for _, _, user_id in entries))
+            self.changed_through = changed_through
+            self.loaded_at = self.synced_at = time.monotonic()
+
+    def add(self, user_id, username):
+        """Add one user, unless already there; ignored once the index is full."""
+
+        key = self._key(username)
+
+        with self._lock:
+            i = bisect.bisect_left(self._keys, key)
+            j = i
+            while j < len(self._keys) and self._keys[j] == key:
+                if self._ids[j] == user_id:
+                    return
+                j += 1
+
+            if len(self._keys) >= self.max_size:
+                return
+            self._keys.insert(i, key)
+            self._names.insert(i, username)
+            self._ids.insert(i, user_id)
+
+    def remove(self, user_id, username):
+        """Remove one user, if present."""
+
+        key = self._key(username)
+
+        with self._lock:
+            i = bisect.bisect_left(self._keys, key)
+            while i < len(self._keys) and self._keys[i] == key:
+                if self._ids[i] == user_id:
+                    del self._keys[i]
+                    del self._names[i]
+                    del self._ids[i]
+                    return
+                i += 1
+
+    def catch_up(self, rows):
+        """Add `rows` of (user id, username, followers_count,
+        names_changed_at) changed since the last sync.
+
+        Callers select users changed after `changed_through`, less a margin
+        for transactions that commit out of order.
+        """
+
+        for user_id, username, _, changed_at in rows:
+            self.add(user_id, username)
+            with self._lock:
+                if self.changed_through is None or changed_at > self.changed_through:
+                    self.changed_through = changed_at
+        self.synced_at = time.monotonic()
+
+    def complete(self, prefix, limit=10):
+        """Up to `limit` (user id, username) pairs starting with `prefix`."""
+
+        key = prefix.lower()
+
+        with self._lock:
+            i = bisect.bisect_left(self._keys, key)
+            end = min(i + limit, len(self._keys))
+            matches = []
+            while i < end and self._keys[i].startswith(key):
+                matches.append((self._ids[i], self._names[i]))
+                i += 1
+
+        return matches
+
+    @staticmethod
+    def _key(username):
+        key = username.lower()
+        # Share the string when the name is already lowercase
+        return username if key == username else key
+
+
+usernames = UsernameIndex()